@@ -1,15 +1,37 @@
+import copy
+import hashlib
+import inspect
+import logging
+import queue
+import random
 import re
+import threading
+import time
 import warnings
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 
 import django
 from django.conf import settings
 from django.contrib.postgres.constraints import ExclusionConstraint
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
 from django.db.backends.ddl_references import Statement, Table
 from django.db.backends.postgresql.schema import (
     DatabaseSchemaEditor as PostgresDatabaseSchemaEditor
 )
+from django.db.migrations.migration import Migration
 from django.db.models import NOT_PROVIDED
+from django.db.models.signals import post_migrate
+from django.db.models.sql import UpdateQuery
+from django.db.utils import DatabaseError, NotSupportedError, OperationalError
+
+from django_zero_downtime_migrations.casts import (
+    DEFAULT_SAFE_TYPE_CAST_RULES, load_rule
+)
+from django_zero_downtime_migrations.events import load_sink
+
+logger = logging.getLogger(__name__)
 
 
 class Unsafe:
@@ -18,6 +40,11 @@ class Unsafe:
         "See details for safe alternative "
         "https://github.com/tbicr/django-pg-zero-downtime-migrations#create-column-not-null"
     )
+    ADD_COLUMN_VOLATILE_DEFAULT = (
+        "ADD COLUMN with volatile DEFAULT is unsafe operation\n"
+        "See details for safe alternative "
+        "https://github.com/tbicr/django-pg-zero-downtime-migrations#create-column-not-null"
+    )
     ALTER_COLUMN_TYPE = (
         "ALTER COLUMN TYPE is unsafe operation\n"
         "See details for safe alternative "
@@ -49,10 +76,18 @@ class UnsafeOperationWarning(Warning):
     pass
 
 
+class RedundantIndexWarning(Warning):
+    pass
+
+
 class UnsafeOperationException(Exception):
     pass
 
 
+class LockBlockedException(OperationalError):
+    pass
+
+
 class DummySQL:
     def __mod__(self, other):
         return DUMMY_SQL
@@ -120,6 +155,7 @@ class MultiStatementSQL(list):
 
 
 class PGLock:
+    lock_mode = None
 
     def __init__(
         self,
@@ -170,6 +206,45 @@ class PGLock:
 
 
 class PGAccessExclusive(PGLock):
+    lock_mode = "ACCESS EXCLUSIVE"
+
+    def __init__(
+        self,
+        sql,
+        *,
+        use_timeouts=True,
+        disable_statement_timeout=False,
+        idempotent_condition=None,
+    ):
+        super().__init__(
+            sql,
+            use_timeouts=use_timeouts,
+            disable_statement_timeout=disable_statement_timeout,
+            idempotent_condition=idempotent_condition,
+        )
+
+
+class PGShare(PGLock):
+    lock_mode = "SHARE"
+
+    def __init__(
+        self,
+        sql,
+        *,
+        use_timeouts=True,
+        disable_statement_timeout=False,
+        idempotent_condition=None,
+    ):
+        super().__init__(
+            sql,
+            use_timeouts=use_timeouts,
+            disable_statement_timeout=disable_statement_timeout,
+            idempotent_condition=idempotent_condition,
+        )
+
+
+class PGShareRowExclusive(PGLock):
+    lock_mode = "SHARE ROW EXCLUSIVE"
 
     def __init__(
         self,
@@ -188,6 +263,7 @@ class PGAccessExclusive(PGLock):
 
 
 class PGShareUpdateExclusive(PGLock):
+    lock_mode = "SHARE UPDATE EXCLUSIVE"
 
     def __init__(
         self,
@@ -207,51 +283,187 @@ class PGShareUpdateExclusive(PGLock):
 
 class DatabaseSchemaEditorMixin:
     ZERO_TIMEOUT = '0ms'
+    LOCK_NOT_AVAILABLE = '55P03'
 
-    _sql_get_lock_timeout = "SELECT setting || unit FROM pg_settings WHERE name = 'lock_timeout'"
-    _sql_get_statement_timeout = "SELECT setting || unit FROM pg_settings WHERE name = 'statement_timeout'"
+    _sql_get_timeouts = "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')"
     _sql_set_lock_timeout = "SET lock_timeout TO '%(lock_timeout)s'"
     _sql_set_statement_timeout = "SET statement_timeout TO '%(statement_timeout)s'"
+    # timeouts change in any statement of sql, eg. in multi statement RunSQL
+    _session_timeouts_change_regexp = re.compile(
+        r"(^|;)\s*((SET|RESET)\s+((SESSION|LOCAL)\s+)?(statement_timeout|lock_timeout|ALL)\b|DISCARD\s+ALL\b)"
+        r"|\bset_config\s*\(\s*'(statement_timeout|lock_timeout)'",
+        re.IGNORECASE | re.MULTILINE,
+    )
+    # timeout value without unit is milliseconds, eg. '0', 0 and '0ms' are same timeouts
+    # statements that can change relation kind, eg. recreate table as partitioned
+    _relkind_change_regexp = re.compile(
+        r'^\s*(CREATE|DROP)\s+TABLE\b|^\s*ALTER\s+TABLE\b.*\bRENAME\s+TO\b',
+        re.IGNORECASE,
+    )
+    _timeout_regexp = re.compile(r'^\s*(?P<value>\d+(\.\d+)?)\s*(?P<unit>us|ms|s|min|h|d)?\s*$')
+    _timeout_units = {"us": 0.001, "ms": 1, "s": 1000, "min": 60 * 1000, "h": 60 * 60 * 1000, "d": 24 * 60 * 60 * 1000}
+    # statements that rewrite table with indexes or read whole table, other statements change metadata only,
+    # type change without USING can be metadata only or scan, so it's estimated as scan
+    # if it's not metadata only by ZERO_DOWNTIME_MIGRATIONS_SAFE_TYPE_CAST_RULES
+    _table_rewrite_regexp = re.compile(r'\bSET TABLESPACE\b|\bTYPE\b.+\bUSING\b', re.IGNORECASE | re.DOTALL)
+    _table_scan_regexp = re.compile(
+        r'^\s*(CREATE (UNIQUE )?INDEX|REINDEX|UPDATE)\b|\bVALIDATE CONSTRAINT\b|\bEXCLUDE\b|\bALTER COLUMN .+ TYPE\b',
+        re.IGNORECASE | re.DOTALL,
+    )
+    _index_build_regexp = re.compile(r'^\s*(CREATE (UNIQUE )?INDEX|REINDEX)\b', re.IGNORECASE)
+    # table of raw sql, eg. ALTER TABLE "t", CREATE INDEX ... ON "t", COMMENT ON COLUMN "t"."c", UPDATE "t"
+    _statement_table_regexp = re.compile(
+        r'\b(?:TABLE|ON(?:\s+(?:TABLE|COLUMN))?|UPDATE)\s+(?:ONLY\s+)?("(?:[^"]|"")+"|\w+(?:\.\w+)?)',
+        re.IGNORECASE,
+    )
 
+    # conditions use oid lookups in pg_catalog instead of slow information_schema views,
+    # to_regclass resolves quoted names with respect to search_path and returns NULL for missing relations
     _sql_identity_exists = (
-        "SELECT 1 FROM information_schema.columns "
-        "WHERE table_name = TRIM('\"' FROM '%(table)s') "
-        "AND column_name = TRIM('\"' FROM '%(column)s')"
-        "AND is_identity = 'YES'"
-    )
-    _sql_sequence_exists = "SELECT 1 FROM pg_class WHERE relname = TRIM('\"' FROM '%(name)s')"
-    _sql_index_exists = "SELECT 1 FROM pg_class WHERE relname = TRIM('\"' FROM '%(name)s')"
-    _sql_table_exists = "SELECT 1 FROM pg_class WHERE relname = TRIM('\"' FROM '%(table)s')"
-    _sql_new_table_exists = "SELECT 1 FROM pg_class WHERE relname = TRIM('\"' FROM '%(new_table)s')"
+        "SELECT 1 FROM pg_attribute "
+        "WHERE attrelid = to_regclass('%(table)s') "
+        "AND attname = TRIM('\"' FROM '%(column)s') "
+        "AND attnum > 0 AND NOT attisdropped "
+        "AND attidentity != ''"
+    )
+    _sql_sequence_exists = "SELECT 1 WHERE to_regclass('%(name)s') IS NOT NULL"
+    _sql_index_exists = "SELECT 1 WHERE to_regclass('%(name)s') IS NOT NULL"
+    _sql_table_exists = "SELECT 1 WHERE to_regclass('%(table)s') IS NOT NULL"
+    _sql_new_table_exists = "SELECT 1 WHERE to_regclass('%(new_table)s') IS NOT NULL"
     _sql_column_exists = (
-        "SELECT 1 FROM information_schema.columns "
-        "WHERE table_name = TRIM('\"' FROM '%(table)s') "
-        "AND column_name = TRIM('\"' FROM '%(column)s')"
+        "SELECT 1 FROM pg_attribute "
+        "WHERE attrelid = to_regclass('%(table)s') "
+        "AND attname = TRIM('\"' FROM '%(column)s') "
+        "AND attnum > 0 AND NOT attisdropped"
     )
     _sql_new_column_exists = (
-        "SELECT 1 FROM information_schema.columns "
-        "WHERE table_name = TRIM('\"' FROM '%(table)s') "
-        "AND column_name = TRIM('\"' FROM '%(new_column)s')"
+        "SELECT 1 FROM pg_attribute "
+        "WHERE attrelid = to_regclass('%(table)s') "
+        "AND attname = TRIM('\"' FROM '%(new_column)s') "
+        "AND attnum > 0 AND NOT attisdropped"
     )
     _sql_constraint_exists = (
-        "SELECT 1 FROM information_schema.table_constraints "
-        "WHERE table_name = TRIM('\"' FROM '%(table)s') "
-        "AND constraint_name = TRIM('\"' FROM '%(name)s')"
+        "SELECT 1 FROM pg_constraint "
+        "WHERE conrelid = to_regclass('%(table)s') "
+        "AND conname = TRIM('\"' FROM '%(name)s')"
     )
     _sql_index_valid = (
         "SELECT 1 "
         "FROM pg_index "
-        "WHERE indrelid = TRIM('\"' FROM '%(table)s')::regclass::oid "
-        "AND indexrelid = TRIM('\"' FROM '%(name)s')::regclass::oid "
+        "WHERE indrelid = to_regclass('%(table)s') "
+        "AND indexrelid = to_regclass('%(name)s') "
         "AND indisvalid"
     )
     _sql_constraint_valid = (
         "SELECT 1 "
         "FROM pg_constraint "
-        "WHERE conrelid = TRIM('\"' FROM '%(table)s')::regclass::oid "
+        "WHERE conrelid = to_regclass('%(table)s') "
         "AND conname = TRIM('\"' FROM '%(name)s') "
         "AND convalidated"
     )
+    _sql_trigger_exists = (
+        "SELECT 1 FROM pg_trigger "
+        "WHERE tgrelid = to_regclass('%(table)s') "
+        "AND tgname = TRIM('\"' FROM '%(trigger)s')"
+    )
+    # postgres table level lock modes conflicts for modes taken by deferred sql,
+    # see https://www.postgresql.org/docs/current/explicit-locking.html#LOCKING-TABLES
+    _lock_conflicts = {
+        "SHARE UPDATE EXCLUSIVE": {"SHARE UPDATE EXCLUSIVE", "SHARE", "SHARE ROW EXCLUSIVE", "ACCESS EXCLUSIVE"},
+        "SHARE": {"SHARE UPDATE EXCLUSIVE", "SHARE ROW EXCLUSIVE", "ACCESS EXCLUSIVE"},
+        "SHARE ROW EXCLUSIVE": {"SHARE UPDATE EXCLUSIVE", "SHARE", "SHARE ROW EXCLUSIVE", "ACCESS EXCLUSIVE"},
+        "ACCESS EXCLUSIVE": {"SHARE UPDATE EXCLUSIVE", "SHARE", "SHARE ROW EXCLUSIVE", "ACCESS EXCLUSIVE"},
+    }
+    _lock_modes_order = ["SHARE UPDATE EXCLUSIVE", "SHARE", "SHARE ROW EXCLUSIVE", "ACCESS EXCLUSIVE"]
+    # foreign key creation takes SHARE ROW EXCLUSIVE lock on referenced table
+    _referenced_table_lock_mode = "SHARE ROW EXCLUSIVE"
+
+    # pg_locks modes that conflict with lock modes taken by statements
+    _lock_blockers_modes = {
+        "SHARE UPDATE EXCLUSIVE": [
+            "ShareUpdateExclusiveLock", "ShareLock", "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock",
+        ],
+        "SHARE": [
+            "RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareRowExclusiveLock", "ExclusiveLock",
+            "AccessExclusiveLock",
+        ],
+        "SHARE ROW EXCLUSIVE": [
+            "RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareLock", "ShareRowExclusiveLock", "ExclusiveLock",
+            "AccessExclusiveLock",
+        ],
+        "ACCESS EXCLUSIVE": [
+            "AccessShareLock", "RowShareLock", "RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareLock",
+            "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock",
+        ],
+    }
+
+    # sessions that hold or wait locks conflicting with statement locks on tables in transaction
+    # started long time ago, lock request will wait them and block all next conflicting queries to these tables
+    _sql_get_lock_blockers = (
+        "SELECT DISTINCT a.pid, a.state, EXTRACT(EPOCH FROM now() - a.xact_start)::float, a.xact_start "
+        "FROM pg_locks AS l "
+        "JOIN pg_stat_activity AS a ON a.pid = l.pid "
+        "WHERE l.locktype = 'relation' "
+        "AND (l.relation, l.mode) IN ("
+        "SELECT to_regclass(t.name), t.mode FROM unnest(%s::text[], %s::text[]) AS t(name, mode)"
+        ") "
+        "AND l.pid != pg_backend_pid() "
+        "AND a.xact_start < now() - make_interval(secs => %s) "
+        "ORDER BY a.xact_start"
+    )
+    _sql_get_backend_pid = "SELECT pg_backend_pid()"
+    _sql_get_table_size = "SELECT pg_total_relation_size(to_regclass(%s))"
+    # column with volatile default is filled by table rewrite, other defaults are stored in catalog only
+    _sql_get_volatile_functions = "SELECT proname FROM pg_proc WHERE proname = ANY(%s) AND provolatile = 'v'"
+    _sql_backfill_column_default = (
+        "UPDATE %(table)s SET %(column)s = DEFAULT WHERE %(pk)s <= %%s%(where)s AND %(column)s IS NULL"
+    )
+    _sql_backfill_null_column = (
+        "UPDATE %(table)s SET %(column)s = %(value)s WHERE %(pk)s <= %%s%(where)s AND %(column)s IS NULL"
+    )
+    _sql_get_null_column_backfill_start = "SELECT min(%(pk)s) FROM %(table)s WHERE %(column)s IS NULL"
+    _sql_get_table_sizes = "SELECT pg_relation_size(to_regclass(%s)), pg_total_relation_size(to_regclass(%s))"
+    _sql_get_blocking_backends = (
+        "SELECT pid, state, usename, application_name, "
+        "EXTRACT(EPOCH FROM now() - xact_start)::float, query "
+        "FROM pg_stat_activity "
+        "WHERE pid = ANY(pg_blocking_pids(%s)) "
+        "AND pid <> ALL(%s::integer[]) "
+        "AND usename = ANY(COALESCE(%s::text[], ARRAY[current_user::text]))"
+    )
+    _sql_get_backend_lock_wait = "SELECT wait_event_type = 'Lock' FROM pg_stat_activity WHERE pid = %s"
+    _sql_get_index_progress = (
+        "SELECT NULLIF(index_relid, 0)::regclass::text, relid::regclass::text, phase, "
+        "blocks_done, blocks_total, tuples_done, tuples_total "
+        "FROM pg_stat_progress_create_index "
+        "WHERE pid = %s"
+    )
+    _sql_create_journal = (
+        "CREATE TABLE IF NOT EXISTS zero_downtime_migrations_journal ("
+        "migration text NOT NULL, "
+        "statement_hash text NOT NULL, "
+        "outcome text NOT NULL, "
+        "sql text NOT NULL, "
+        "applied_at timestamptz NOT NULL DEFAULT now(), "
+        "PRIMARY KEY (migration, statement_hash))"
+    )
+    _sql_get_journal = "SELECT statement_hash FROM zero_downtime_migrations_journal WHERE migration = %s"
+    _sql_journal_statement = (
+        "INSERT INTO zero_downtime_migrations_journal (migration, statement_hash, outcome, sql) "
+        "VALUES (%s, %s, %s, %s) "
+        "ON CONFLICT (migration, statement_hash) DO UPDATE "
+        "SET outcome = EXCLUDED.outcome, sql = EXCLUDED.sql, applied_at = now()"
+    )
+    _sql_clear_journal = "DELETE FROM zero_downtime_migrations_journal WHERE migration = %s"
+    _sql_journal_exists = "SELECT to_regclass('zero_downtime_migrations_journal') IS NOT NULL"
+    _sql_clear_migrations_journal = "DELETE FROM zero_downtime_migrations_journal WHERE migration = ANY(%s)"
+    # statements that can't run in transaction block, so they can't be sent with journal record in one query
+    _non_transactional_regexp = re.compile(r'\bCONCURRENTLY\b', re.IGNORECASE)
+    _sql_cancel_backend = "SELECT pg_cancel_backend(%s)"
+    _sql_terminate_backend = "SELECT pg_terminate_backend(%s)"
+    _sql_conditions_exist = "SELECT %(conditions)s"
+    _sql_condition_exists = "EXISTS (%(condition)s)"
+    _conditions_batch_size = 1000  # postgres allows up to 1664 columns in select
 
     sql_alter_sequence_type = PGAccessExclusive(PostgresDatabaseSchemaEditor.sql_alter_sequence_type)
     sql_add_identity = PGAccessExclusive(
@@ -460,6 +672,360 @@ class DatabaseSchemaEditorMixin:
         ),
     )
 
+    # shadow column can replace column only if nothing except indexes depends on it
+    _sql_get_shadow_column_info = """
+        SELECT
+            a.attnotnull,
+            col_description(a.attrelid, a.attnum),
+            c.relkind = 'r' AND NOT EXISTS (
+                SELECT 1 FROM pg_inherits WHERE inhrelid = c.oid OR inhparent = c.oid
+            ),
+            a.attacl IS NULL AND NOT EXISTS (
+                SELECT 1
+                FROM pg_depend AS d
+                LEFT JOIN pg_class AS dc ON d.classid = 'pg_class'::regclass AND dc.oid = d.objid
+                WHERE d.refclassid = 'pg_class'::regclass
+                AND d.refobjid = a.attrelid
+                AND d.refobjsubid = a.attnum
+                AND dc.relkind IS DISTINCT FROM 'i'
+                AND d.objid NOT IN (SELECT oid FROM pg_trigger WHERE tgrelid = a.attrelid AND tgname = %s)
+            ) AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint WHERE confrelid = a.attrelid AND a.attnum = ANY(confkey)
+            )
+        FROM pg_attribute AS a
+        JOIN pg_class AS c ON c.oid = a.attrelid
+        WHERE a.attrelid = to_regclass(%s)
+        AND a.attname = %s
+        AND a.attnum > 0 AND NOT a.attisdropped
+    """
+    # index can be rebuilt for shadow column if column is used as key or included column
+    # with default operator class, but not in expressions or predicate
+    _sql_get_shadow_column_indexes = r"""
+        SELECT
+            ic.relname,
+            pg_get_indexdef(i.indexrelid),
+            quote_ident(a.attname),
+            a.attnum = ANY(i.indkey)
+            AND COALESCE(i.indexprs::text, '') || COALESCE(i.indpred::text, '') !~ (':varattno ' || a.attnum || '\y')
+            AND NOT EXISTS (
+                SELECT 1
+                FROM unnest(i.indkey::int2[], i.indclass::oid[]) AS k(attnum, opclass)
+                JOIN pg_opclass AS o ON o.oid = k.opclass
+                WHERE k.attnum = a.attnum AND NOT o.opcdefault
+            )
+        FROM pg_index AS i
+        JOIN pg_class AS ic ON ic.oid = i.indexrelid
+        JOIN pg_attribute AS a ON a.attrelid = i.indrelid
+        WHERE i.indrelid = to_regclass(%s)
+        AND a.attname = %s
+        AND (
+            a.attnum = ANY(i.indkey)
+            OR COALESCE(i.indexprs::text, '') || COALESCE(i.indpred::text, '') ~ (':varattno ' || a.attnum || '\y')
+        )
+        ORDER BY ic.relname
+    """
+    _indexdef_regexp = re.compile(
+        r'^CREATE (?P<unique>UNIQUE )?INDEX (?P<name>"(?:[^"]|"")+"|\S+) ON (?P<table>.+?) USING (?P<using>.+)$',
+        re.DOTALL,
+    )
+    # string literals, quoted identifiers, parentheses, commas and other text of index definition
+    _indexdef_token_regexp = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|[(),]|[^'"(),]+""")
+    _sql_create_shadow_column_function = (
+        "CREATE OR REPLACE FUNCTION %(function)s() RETURNS trigger AS $$ "
+        "BEGIN NEW.%(new_column)s := %(cast)s; RETURN NEW; END "
+        "$$ LANGUAGE plpgsql"
+    )
+    _sql_create_shadow_column_trigger = PGShareRowExclusive(
+        "CREATE TRIGGER %(trigger)s BEFORE INSERT OR UPDATE OF %(column)s ON %(table)s "
+        "FOR EACH ROW EXECUTE FUNCTION %(function)s()",
+        idempotent_condition=Condition(_sql_trigger_exists, False),
+    )
+    _sql_get_backfill_batch_end = (
+        "SELECT max(%(pk)s) FROM (SELECT %(pk)s FROM %(table)s%(where)s ORDER BY %(pk)s LIMIT %(limit)s) AS batch"
+    )
+    # first row that isn't synced by trigger or backfill of previous failed run
+    _sql_get_shadow_column_backfill_start = (
+        "SELECT min(%(pk)s) FROM %(table)s WHERE %(new_column)s IS NULL AND %(column)s IS NOT NULL"
+    )
+    # column type is normalized by temporary table in rolled back transaction to compare it with new type
+    _sql_create_type_probe_table = (
+        "CREATE TEMPORARY TABLE zero_downtime_migrations_type_probe (probe %(type)s) ON COMMIT DROP"
+    )
+    _sql_shadow_column_swapped = """
+        SELECT
+            format_type(a.atttypid, a.atttypmod) = (
+                SELECT format_type(p.atttypid, p.atttypmod)
+                FROM pg_attribute AS p
+                WHERE p.attrelid = 'zero_downtime_migrations_type_probe'::regclass AND p.attname = 'probe'
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_attribute
+                WHERE attrelid = a.attrelid AND attname = %s AND attnum > 0 AND NOT attisdropped
+            )
+            AND NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = a.attrelid AND tgname = %s)
+        FROM pg_attribute AS a
+        WHERE a.attrelid = to_regclass(%s)
+        AND a.attname = %s
+        AND a.attnum > 0 AND NOT a.attisdropped
+    """
+    _sql_backfill_shadow_column = (
+        "UPDATE %(table)s SET %(column)s = %(cast)s "
+        "WHERE %(pk)s <= %%s%(where)s AND %(column)s IS NULL AND %(old_column)s IS NOT NULL"
+    )
+    _sql_create_shadow_index = MultiStatementSQL(
+        PGShareUpdateExclusive(
+            "%(definition)s",
+            idempotent_condition=Condition(_sql_index_exists, False),
+            disable_statement_timeout=True,
+        ),
+        PGShareUpdateExclusive(
+            "REINDEX INDEX CONCURRENTLY %(name)s",
+            idempotent_condition=Condition(_sql_index_valid, False, idempotent_mode_only=True),
+            disable_statement_timeout=True,
+        ),
+    )
+    # all swap statements are sent by one query, so postgres runs them in one implicit transaction
+    _sql_swap_shadow_column = [
+        "DROP TRIGGER %(trigger)s ON %(table)s",
+        "ALTER TABLE %(table)s DROP COLUMN %(column)s",
+        "ALTER TABLE %(table)s RENAME COLUMN %(new_column)s TO %(column)s",
+    ]
+    _sql_swap_shadow_column_not_null = [
+        "ALTER TABLE %(table)s ALTER COLUMN %(column)s SET NOT NULL",
+        "ALTER TABLE %(table)s DROP CONSTRAINT %(name)s",
+    ]
+    _sql_swap_shadow_column_rename_index = "ALTER INDEX %(old_name)s RENAME TO %(new_name)s"
+    _sql_swap_shadow_column_comment = "COMMENT ON COLUMN %(table)s.%(column)s IS %(comment)s"
+    _sql_drop_shadow_column_function = "DROP FUNCTION IF EXISTS %(function)s()"
+    # single column primary key with its identity or serial sequence for primary key type change
+    _sql_get_primary_key_info = """
+        SELECT
+            a.attname,
+            format_type(a.atttypid, a.atttypmod),
+            a.attidentity,
+            s.relname,
+            pg_get_expr(d.adbin, d.adrelid),
+            c.relkind
+        FROM pg_constraint AS con
+        JOIN pg_class AS c ON c.oid = con.conrelid
+        JOIN pg_attribute AS a ON a.attrelid = con.conrelid AND a.attnum = con.conkey[1]
+        LEFT JOIN pg_attrdef AS d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        LEFT JOIN pg_class AS s ON s.oid = pg_get_serial_sequence(c.oid::regclass::text, a.attname)::regclass
+        WHERE con.conrelid = to_regclass(%s)
+        AND con.contype = 'p'
+        AND array_length(con.conkey, 1) = 1
+    """
+    # foreign keys that reference primary key with their tables primary keys for keyset backfill
+    _sql_get_primary_key_references = """
+        SELECT
+            con.conname,
+            pg_get_constraintdef(con.oid),
+            c.relname,
+            c.relkind,
+            array_length(con.conkey, 1),
+            a.attname,
+            format_type(a.atttypid, a.atttypmod),
+            pk.attname
+        FROM pg_constraint AS con
+        JOIN pg_class AS c ON c.oid = con.conrelid
+        JOIN pg_attribute AS a ON a.attrelid = con.conrelid AND a.attnum = con.conkey[1]
+        LEFT JOIN pg_constraint AS pkcon
+            ON pkcon.conrelid = con.conrelid AND pkcon.contype = 'p' AND array_length(pkcon.conkey, 1) = 1
+        LEFT JOIN pg_attribute AS pk ON pk.attrelid = pkcon.conrelid AND pk.attnum = pkcon.conkey[1]
+        WHERE con.confrelid = to_regclass(%s)
+        AND con.contype = 'f'
+        AND con.confkey = (SELECT conkey FROM pg_constraint WHERE conrelid = con.confrelid AND contype = 'p')
+        ORDER BY c.relname, a.attname, con.conname
+    """
+    _sql_swap_primary_key_not_null = [
+        "ALTER TABLE %(table)s ALTER COLUMN %(new_column)s SET NOT NULL",
+        "ALTER TABLE %(table)s DROP CONSTRAINT %(name)s",
+    ]
+    _sql_swap_primary_key_identity = [
+        "ALTER TABLE %(table)s ALTER COLUMN %(new_column)s ADD GENERATED %(identity)s AS IDENTITY "
+        "(SEQUENCE NAME %(new_sequence)s)",
+        "SELECT setval(%(new_sequence_literal)s, last_value, is_called) FROM %(sequence)s",
+    ]
+    _sql_swap_primary_key_identity_rename = "ALTER SEQUENCE %(new_sequence)s RENAME TO %(sequence)s"
+    _sql_swap_primary_key_serial = "ALTER SEQUENCE %(sequence)s OWNED BY NONE"
+    _sql_swap_primary_key_serial_default = [
+        "ALTER TABLE %(table)s ALTER COLUMN %(column)s SET DEFAULT %(default)s",
+        "ALTER SEQUENCE %(sequence)s AS %(type)s OWNED BY %(table)s.%(column)s",
+    ]
+    # column constraints that are recreated on swap, other constraints would be silently dropped with column
+    _sql_get_primary_key_column_constraints = """
+        SELECT con.conname, con.contype, ic.relname, con.condeferrable, con.condeferred, con.confrelid = to_regclass(%s)
+        FROM pg_constraint AS con
+        JOIN pg_attribute AS a ON a.attrelid = con.conrelid AND a.attnum = ANY(con.conkey)
+        LEFT JOIN pg_class AS ic ON ic.oid = con.conindid
+        WHERE con.conrelid = to_regclass(%s)
+        AND a.attname = %s
+        ORDER BY con.conname
+    """
+    _sql_swap_shadow_column_constraint = (
+        "ALTER TABLE %(table)s ADD CONSTRAINT %(name)s %(type)s USING INDEX %(index)s%(deferrable)s"
+    )
+    _sql_swap_primary_key_drop_foreign_key = "ALTER TABLE %(table)s DROP CONSTRAINT %(name)s"
+    _sql_swap_primary_key_add_foreign_key = "ALTER TABLE %(table)s ADD CONSTRAINT %(name)s %(definition)s NOT VALID"
+
+    # invalid indexes left by failed or cancelled concurrent builds,
+    # indexes of tables with running index builds are ignored as they are invalid until build is finished
+    _sql_get_invalid_indexes = """
+        SELECT
+            ic.relname,
+            ic.oid::regclass::text,
+            c.relname,
+            pg_size_pretty(pg_relation_size(ic.oid)),
+            pg_get_indexdef(ic.oid)
+        FROM pg_index AS i
+        JOIN pg_class AS ic ON ic.oid = i.indexrelid
+        JOIN pg_class AS c ON c.oid = i.indrelid
+        JOIN pg_namespace AS n ON n.oid = ic.relnamespace
+        WHERE NOT i.indisvalid
+        AND ic.relkind = 'i'
+        AND n.nspname = ANY(current_schemas(false))
+        AND NOT EXISTS (SELECT 1 FROM pg_stat_progress_create_index AS p WHERE p.relid = i.indrelid)
+        ORDER BY c.relname, ic.relname
+    """
+    _sql_rebuild_index = PGShareUpdateExclusive(
+        "REINDEX INDEX CONCURRENTLY %(name)s",
+        disable_statement_timeout=True,
+    )
+    # failed REINDEX CONCURRENTLY leaves new or old copy of index next to valid index
+    _reindex_leftover_regexp = re.compile(r'_cc(new|old)\d*$')
+
+    # single column integer primary keys and foreign keys with primary key column that limits their values
+    _sql_get_integer_keys = """
+        SELECT
+            c.oid::regclass::text,
+            a.attname,
+            format_type(a.atttypid, a.atttypmod),
+            rc.oid::regclass::text,
+            ra.attname,
+            pg_get_serial_sequence(rc.oid::regclass::text, ra.attname)
+        FROM pg_constraint AS con
+        JOIN pg_class AS c ON c.oid = con.conrelid
+        JOIN pg_namespace AS n ON n.oid = c.relnamespace
+        JOIN pg_attribute AS a ON a.attrelid = con.conrelid AND a.attnum = con.conkey[1]
+        JOIN pg_class AS rc ON rc.oid = CASE WHEN con.contype = 'p' THEN con.conrelid ELSE con.confrelid END
+        JOIN pg_attribute AS ra ON ra.attrelid = rc.oid
+            AND ra.attnum = CASE WHEN con.contype = 'p' THEN con.conkey[1] ELSE con.confkey[1] END
+        WHERE con.contype IN ('p', 'f')
+        AND array_length(con.conkey, 1) = 1
+        AND a.atttypid IN ('smallint'::regtype, 'integer'::regtype)
+        AND n.nspname = ANY(current_schemas(false))
+        AND NOT c.relispartition
+        ORDER BY c.oid::regclass::text, a.attname
+    """
+    # max() of primary key is read from index, sequence value covers rows that were deleted or rolled back
+    _sql_get_key_value = "SELECT GREATEST((SELECT max(%(column)s) FROM %(table)s), %(sequence_value)s)"
+    _sql_sequence_last_value = "pg_sequence_last_value(%(sequence)s::regclass)"
+
+    # valid indexes, indexes used by constraints can't be renamed to reuse for new index
+    _sql_get_reusable_indexes = """
+        SELECT ic.relname, pg_get_indexdef(i.indexrelid), EXISTS (
+            SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid
+        )
+        FROM pg_index AS i
+        JOIN pg_class AS ic ON ic.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(%s)
+        AND i.indisvalid
+        ORDER BY ic.relname
+    """
+    # new index definition is built for empty temporary copy of table in rolled back transaction
+    _sql_create_index_probe_table = (
+        "CREATE TEMPORARY TABLE zero_downtime_migrations_index_probe (LIKE %(table)s) ON COMMIT DROP"
+    )
+    _sql_get_index_probe_definition = "SELECT pg_get_indexdef('zero_downtime_migrations_index_probe_idx'::regclass)"
+    _sql_reuse_index = PGShareUpdateExclusive(
+        "ALTER INDEX %(old_name)s RENAME TO %(name)s",
+        use_timeouts=True,
+        disable_statement_timeout=False,
+        idempotent_condition=Condition(_sql_index_exists, False),
+    )
+    _btree_columns_regexp = re.compile(r'^btree \((?P<columns>.+)\)$', re.DOTALL)
+    # unique indexes that can be attached to constraint with ADD CONSTRAINT ... USING INDEX: valid, not partial,
+    # without expressions and included columns, with default opclasses, collations and sorting
+    _sql_get_attachable_unique_indexes = """
+        SELECT ic.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index AS i
+        JOIN pg_class AS ic ON ic.oid = i.indexrelid
+        JOIN LATERAL (
+            SELECT
+                string_agg('"' || replace(a.attname, '"', '""') || '"', ', ' ORDER BY c.n) AS columns,
+                bool_and(o.opcdefault AND c.indcollation = a.attcollation AND c.indoption = 0) AS default_sorting
+            FROM unnest(i.indkey::int2[], i.indclass::oid[], i.indcollation::oid[], i.indoption::int2[])
+                WITH ORDINALITY AS c(attnum, indclass, indcollation, indoption, n)
+            JOIN pg_attribute AS a ON a.attrelid = i.indrelid AND a.attnum = c.attnum
+            JOIN pg_opclass AS o ON o.oid = c.indclass
+        ) AS k ON true
+        WHERE i.indrelid = to_regclass(%s)
+        AND i.indisunique
+        AND i.indisvalid
+        AND i.indpred IS NULL
+        AND i.indexprs IS NULL
+        AND i.indnkeyatts = i.indnatts
+        AND k.default_sorting
+        AND k.columns = %s
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid AND contype != 'f')
+        ORDER BY ic.relname
+    """
+    _sql_attach_unique = PGAccessExclusive(
+        "ALTER TABLE %(table)s ADD CONSTRAINT %(name)s UNIQUE USING INDEX %(index)s%(deferrable)s",
+        idempotent_condition=Condition(_sql_constraint_exists, False),
+    )
+    _sql_attach_pk = PGAccessExclusive(
+        "ALTER TABLE %(table)s ADD CONSTRAINT %(name)s PRIMARY KEY USING INDEX %(index)s",
+        idempotent_condition=Condition(_sql_constraint_exists, False),
+    )
+
+    # CREATE INDEX CONCURRENTLY isn't supported for partitioned tables, so index is created for parent only,
+    # built concurrently for each partition and attached, parent index becomes valid when all partitions attached
+    _sql_is_partitioned_table = "SELECT 1 FROM pg_class WHERE oid = to_regclass(%s) AND relkind = 'p'"
+    _sql_get_index_validity = "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)"
+    _sql_get_partitions_indexes = """
+        SELECT c.relname, c.relkind = 'p', attached.relname, attached.indisvalid
+        FROM pg_inherits AS inh
+        JOIN pg_class AS c ON c.oid = inh.inhrelid
+        LEFT JOIN LATERAL (
+            SELECT ic.relname, i.indisvalid
+            FROM pg_inherits AS iinh
+            JOIN pg_index AS i ON i.indexrelid = iinh.inhrelid
+            JOIN pg_class AS ic ON ic.oid = i.indexrelid
+            WHERE iinh.inhparent = to_regclass(%s)
+            AND i.indrelid = c.oid
+        ) AS attached ON true
+        WHERE inh.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+    """
+    _sql_index_attached = (
+        "SELECT 1 FROM pg_inherits "
+        "WHERE inhrelid = to_regclass('%(partition_index)s') "
+        "AND inhparent = to_regclass('%(name)s')"
+    )
+    _sql_attach_index_partition = PGAccessExclusive(
+        "ALTER INDEX %(name)s ATTACH PARTITION %(partition_index)s",
+        idempotent_condition=Condition(_sql_index_attached, False),
+    )
+    # VALIDATE CONSTRAINT for partitioned table validates all partitions by one long statement,
+    # so constraint is validated for each leaf partition separately and then for parent without scans
+    _sql_get_constraint_validity = (
+        "SELECT convalidated FROM pg_constraint WHERE conrelid = to_regclass(%s) AND conname = TRIM('\"' FROM %s)"
+    )
+    _sql_get_leaf_partitions_constraints = """
+        SELECT c.relname, con.convalidated
+        FROM pg_partition_tree(to_regclass(%s)) AS t
+        JOIN pg_class AS c ON c.oid = t.relid
+        LEFT JOIN pg_constraint AS con ON con.conrelid = t.relid AND con.conname = TRIM('"' FROM %s)
+        WHERE t.isleaf
+        ORDER BY c.relname
+    """
+    _sql_validate_constraint = PGShareUpdateExclusive(
+        "ALTER TABLE %(table)s VALIDATE CONSTRAINT %(name)s",
+        idempotent_condition=Condition(_sql_constraint_valid, False),
+        disable_statement_timeout=True,
+    )
+
     _sql_get_table_constraints_introspection = r"""
         SELECT
             c.conname,
@@ -508,8 +1074,7 @@ class DatabaseSchemaEditorMixin:
         ORDER BY i.indrelid::regclass::text, i.indexrelid::regclass::text
     """
 
-    _varchar_type_regexp = re.compile(r'^varchar\((?P<max_length>\d+)\)$')
-    _numeric_type_regexp = re.compile(r'^numeric\((?P<precision>\d+), *(?P<scale>\d+)\)$')
+    _function_call_regexp = re.compile(r'(?<![\w$."])([a-z_][\w$]*)\s*\(', re.IGNORECASE)
 
     @property
     def sql_alter_column_no_default_null(self):
@@ -537,6 +1102,8 @@ class DatabaseSchemaEditorMixin:
         self.FLEXIBLE_STATEMENT_TIMEOUT = getattr(
             settings, "ZERO_DOWNTIME_MIGRATIONS_FLEXIBLE_STATEMENT_TIMEOUT", False)
         self.RAISE_FOR_UNSAFE = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE", False)
+        self.UNSAFE_TABLE_SIZE_THRESHOLD = getattr(
+            settings, "ZERO_DOWNTIME_MIGRATIONS_UNSAFE_TABLE_SIZE_THRESHOLD", None)
         self.DEFERRED_SQL = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL", True)
         self.IDEMPOTENT_SQL = (
             getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_IDEMPOTENT_SQL", False)
@@ -552,43 +1119,1012 @@ class DatabaseSchemaEditorMixin:
             )
             self.KEEP_DEFAULT = False
         self.EXPLICIT_CONSTRAINTS_DROP = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_EXPLICIT_CONSTRAINTS_DROP", True)
+        self.LOCK_RETRIES = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRIES", 0)
+        self.LOCK_RETRY_DELAY = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_DELAY", 1)
+        self.LOCK_RETRY_MAX_DELAY = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_MAX_DELAY", 60)
+        self.LOCK_RETRY_JITTER = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_JITTER", 0.5)
+        self.DEFERRED_SQL_WORKERS = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS", 1)
+        self.LOCK_BLOCKERS_TIMEOUT = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_TIMEOUT", None)
+        self.LOCK_BLOCKERS_MIN_AGE = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_MIN_AGE", 1)
+        self.LOCK_BLOCKERS_POLL_INTERVAL = getattr(
+            settings, "ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL", 1)
+        self.CANCEL_BLOCKERS_AFTER = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER", None)
+        self.CANCEL_BLOCKERS_ROLES = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_ROLES", None)
+        self.CANCEL_BLOCKERS_APPLICATION_NAMES = getattr(
+            settings, "ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES", None)
+        if (
+            self.CANCEL_BLOCKERS_AFTER is not None
+            and not self.CANCEL_BLOCKERS_ROLES
+            and not self.CANCEL_BLOCKERS_APPLICATION_NAMES
+        ):
+            raise ImproperlyConfigured(
+                "settings.ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER requires "
+                "settings.ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_ROLES or "
+                "settings.ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES allow-list."
+            )
+        self.ESTIMATE = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_ESTIMATE", False)
+        self.ESTIMATE_THROUGHPUT = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_ESTIMATE_THROUGHPUT", 100 * 1024 * 1024)
+        self.SHADOW_COLUMN_TYPE_CHANGE = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE", False)
+        # shadow column batch settings are kept as fallbacks of backfill batch settings
+        self.BACKFILL_BATCH_SIZE = getattr(
+            settings, "ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SIZE",
+            getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_BATCH_SIZE", 1000),
+        )
+        self.BACKFILL_BATCH_SLEEP = getattr(
+            settings, "ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SLEEP",
+            getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_BATCH_SLEEP", 0),
+        )
+        self.INDEX_PROGRESS_INTERVAL = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_INDEX_PROGRESS_INTERVAL", None)
+        self.REUSE_INDEXES = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES", False)
+        self.JOURNAL = getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_JOURNAL", False) and not collect_sql
+        self.SAFE_TYPE_CAST_RULES = [
+            load_rule(rule)
+            for rule in getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_SAFE_TYPE_CAST_RULES", DEFAULT_SAFE_TYPE_CAST_RULES)
+        ]
+        self.EVENT_SINKS = [load_sink(sink) for sink in getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS", [])]
+
+        # Session timeouts tracked in memory for schema editor lifetime to avoid extra round-trips
+        self._default_timeouts = None
+        self._session_timeouts = None
+        self._changing_session_timeouts = False
+        # Idempotent conditions prefetched by one query, actual until next statement changes schema
+        self._conditions_cache = {}
+        # Constraints and indexes introspection per table, actual until next statement changes related table
+        self._introspection_cache = {}
+        # Migration connection backend pid to find sessions that block migration statements
+        self._backend_pid = None
+        # Backend pids of open migration side connections (workers and monitors) that never are cancelled as blockers
+        self._side_backend_pids = {}
+        # Table sizes and estimated durations for sqlmigrate annotations
+        self._estimate_table_sizes = {}
+        # Column type changes that are metadata only by safe type cast rules, as old type isn't known from sql
+        self._estimate_metadata_only_sql = set()
+        self._estimate_total = 0
+        self._estimate_lock_total = 0
+        # Event of currently executed statement to track lock retries and waits
+        self._statement_event = None
+        # Lock wait sampler thread with its own connection is shared by all statements of schema editor
+        self._lock_wait_sampler = None
+        self._lock_wait_sampler_stop = threading.Event()
+        self._lock_wait_sampler_lock = threading.Lock()
+        # Blockers monitor thread with its own connection is shared by all statements of schema editor,
+        # monitored statement is marked by token, so blockers are tracked per statement
+        self._blockers_monitor = None
+        self._blockers_monitor_stop = threading.Event()
+        self._blockers_monitor_statement = None
+        # Applied statements hashes of current migration loaded from journal table
+        self._journal_migration = None
+        self._journal = None
+        self._journal_occurrences = None
+        # Position of executed deferred statement, deferred statements can run in parallel by side editors,
+        # so they are journaled by stable position instead of execution order
+        self._journal_deferred_index = None
+        # Models of tables that indexes are built for, their migration state tells which indexes Django tracks
+        self._index_models = {}
+
+    def __enter__(self):
+        editor = super().__enter__()
+        # timeouts can be changed bypassing schema editor, eg. by RunPython or raw cursor of migration connection
+        self.connection.execute_wrappers.append(self._track_session_timeouts)
+        return editor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                # migration executor records applied migration before schema editor exit only without deferred sql,
+                # otherwise migration is recorded after exit and journal is cleared by post_migrate signal
+                recorded = (
+                    not self.deferred_sql
+                    and self._journal_migration is not None
+                    and self._journal_migration.endswith(".apply")
+                )
+                self._execute_deferred_sql(self.deferred_sql)
+                self.deferred_sql.clear()
+                if recorded:
+                    self._clear_journal()
+                if self.collect_sql and self.ESTIMATE:
+                    self.collected_sql.append(
+                        f"-- estimated total {self._estimate_total:.1f}s, "
+                        f"with ACCESS EXCLUSIVE lock {self._estimate_lock_total:.1f}s"
+                    )
+        finally:
+            self._stop_lock_wait_sampler()
+            self._stop_blockers_monitor()
+            if self._track_session_timeouts in self.connection.execute_wrappers:
+                self.connection.execute_wrappers.remove(self._track_session_timeouts)
+        super().__exit__(exc_type, exc_value, traceback)
 
     def execute(self, sql, params=()):
         if sql is DUMMY_SQL:
             return
-        statements = []
+        sql = self._reuse_equivalent_index(sql)
+        sql = self._attach_existing_unique_index(sql)
+        if self._is_partitioned_table_statement(sql):
+            if self._is_statement_template(sql, self._partitioned_index_templates):
+                self._create_partitioned_index(sql)
+            else:
+                self._create_partitioned_constraint(sql)
+            return
+        statements = self._split_statements(sql)
+        journal_keys = self._get_journal_keys(statements, params)
+        statements = self._skip_journaled(statements, journal_keys)
+        self._prefetch_conditions(statements)
+        try:
+            for statement in statements:
+                journal_sql = self._get_journal_statement_sql(journal_keys, statement, params)
+                applied = self._execute_statement(statement, params, journal_sql)
+                if not applied or journal_sql is None:
+                    self._journal_statement(journal_keys, statement, "applied" if applied else "skipped")
+                elif journal_keys is not None:
+                    self._journal.add(journal_keys[id(statement)])
+        except Exception:
+            # restore error must not hide original statement error
+            try:
+                self._restore_session_timeouts()
+            except DatabaseError:
+                logger.exception("restore session timeouts after failed statement failed")
+            raise
+        self._restore_session_timeouts()
+
+    def _reuse_equivalent_index(self, sql):
+        """Rename existing equivalent index instead of building new one with ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES
+        and warn if new index is redundant as it's prefix of existing btree index.
+
+        Index definitions are compared by pg_get_indexdef without index and table names, new index definition
+        is got by creating it for empty temporary copy of table, so it's normalized same way as existing indexes.
+        Only indexes that migration state of model doesn't track are reused, as renamed index can't be removed
+        or altered by later migrations, and indexes of constraints can't be renamed.
+        """
+        if (
+            not self.REUSE_INDEXES
+            or self.collect_sql
+            or not isinstance(sql, Statement)
+            or not isinstance(sql.parts.get("table"), Table)
+            or not any(sql.template is template for template in (
+                self.sql_create_index, self.sql_create_index_concurrently, self.sql_create_unique_index,
+            ))
+        ):
+            return sql
+        table = sql.parts["table"]
+        name = sql.parts["name"]
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_reusable_indexes, [str(table)])
+            indexes = cursor.fetchall()
+        if not indexes or any(self.quote_name(relname) == str(name) for relname, _, _ in indexes):
+            return sql
+        probe_sql = Statement(
+            sql.template[0].sql.replace(" CONCURRENTLY", ""),
+            **{
+                **sql.parts,
+                "table": "zero_downtime_migrations_index_probe",
+                "name": "zero_downtime_migrations_index_probe_idx",
+            },
+        )
+        with transaction.atomic(self.connection.alias), self.connection.cursor() as cursor:
+            cursor.execute(self._sql_create_index_probe_table % {"table": table})
+            cursor.execute(str(probe_sql))
+            cursor.execute(self._sql_get_index_probe_definition)
+            definition = self._indexdef_regexp.match(cursor.fetchone()[0])
+            transaction.set_rollback(True, self.connection.alias)
+        unique, using = definition.group("unique"), definition.group("using")
+        tracked = None
+        for relname, indexdef, constraint in indexes:
+            existing = self._indexdef_regexp.match(indexdef)
+            if constraint or existing.group("unique") != unique or existing.group("using") != using:
+                continue
+            if tracked is None:
+                tracked = self._get_tracked_index_names(table.table)
+            if tracked is None or self.quote_name(relname) in tracked:
+                logger.info("skip reuse of equivalent index %s on %s that migration state can track", relname, table)
+                continue
+            logger.info("reuse equivalent index %s on %s instead of building %s", relname, table, name)
+            return Statement(self._sql_reuse_index, table=table, old_name=self.quote_name(relname), name=name)
+        match = self._btree_columns_regexp.match(using)
+        if unique is None and match is not None and " INCLUDE " not in using and " WHERE " not in using:
+            for relname, indexdef, _ in indexes:
+                existing_using = self._indexdef_regexp.match(indexdef).group("using")
+                if " WHERE " not in existing_using and existing_using.startswith(
+                    f"btree ({match.group('columns')}, "
+                ):
+                    warnings.warn(RedundantIndexWarning(
+                        f"index {name} on {table} is redundant, it's prefix of existing index {relname}"
+                    ))
+        return sql
+
+    def _get_tracked_index_names(self, table):
+        """Return quoted names of indexes and constraints of table in migration state of its model
+        or None if index isn't built for model."""
+        model = self._index_models.get(table)
+        if model is None:
+            return None
+        names = set()
+        for state_model in model._meta.apps.get_models(include_auto_created=True):
+            if state_model._meta.db_table != table:
+                continue
+            names.update(str(statement.parts["name"]) for statement in self._model_indexes_sql(state_model))
+            names.update(self.quote_name(constraint.name) for constraint in state_model._meta.constraints)
+        return names
+
+    def _create_index_sql(self, model, **kwargs):
+        self._index_models[model._meta.db_table] = model
+        return super()._create_index_sql(model, **kwargs)
+
+    def _create_unique_sql(self, model, *args, **kwargs):
+        self._index_models[model._meta.db_table] = model
+        return super()._create_unique_sql(model, *args, **kwargs)
+
+    def _attach_existing_unique_index(self, sql):
+        """Add UNIQUE or PRIMARY KEY constraint using existing unique index on same columns instead of building
+        new one with ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES, index is renamed to constraint name by postgres."""
+        if (
+            not self.REUSE_INDEXES
+            or self.collect_sql
+            or not isinstance(sql, Statement)
+            or not isinstance(sql.parts.get("table"), Table)
+            or not any(sql.template is template for template in (self.sql_create_unique, self.sql_create_pk))
+        ):
+            return sql
+        table = sql.parts["table"]
+        name = sql.parts["name"]
+        nulls_not_distinct = bool(str(sql.parts.get("nulls_distinct", "")))
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_attachable_unique_indexes, [str(table), str(sql.parts["columns"])])
+            indexes = cursor.fetchall()
+        for relname, indexdef in indexes:
+            if (" NULLS NOT DISTINCT" in indexdef) != nulls_not_distinct:
+                continue
+            logger.info("attach existing unique index %s on %s to constraint %s", relname, table, name)
+            if sql.template is self.sql_create_pk:
+                return Statement(self._sql_attach_pk, table=table, name=name, index=self.quote_name(relname))
+            return Statement(
+                self._sql_attach_unique,
+                table=table,
+                name=name,
+                index=self.quote_name(relname),
+                deferrable=sql.parts.get("deferrable", ""),
+            )
+        return sql
+
+    @property
+    def _partitioned_index_templates(self):
+        return self.sql_create_index, self.sql_create_index_concurrently, self.sql_create_unique_index
+
+    @property
+    def _partitioned_constraint_templates(self):
+        return self.sql_create_check, self.sql_create_fk, self._sql_column_not_null
+
+    def _is_statement_template(self, sql, templates):
+        return any(sql.template is template for template in templates)
+
+    def _is_partitioned_table_statement(self, sql):
+        """Check statement that is processed per partition for partitioned table, table kind is checked
+        once for index and constraint statements and cached per table."""
+        if (
+            self.collect_sql
+            or not isinstance(sql, Statement)
+            or not isinstance(sql.parts.get("table"), Table)
+            or not self._is_statement_template(
+                sql, self._partitioned_index_templates + self._partitioned_constraint_templates,
+            )
+        ):
+            return False
+        return self._is_partitioned_table(sql.parts["table"])
+
+    def _is_partitioned_table(self, table):
+        def fetch():
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_is_partitioned_table, [str(table)])
+                return cursor.fetchone() is not None, set()
+
+        return self._get_cached_introspection("partitioned", table.table, fetch)
+
+    def _get_index_validity(self, name):
+        """Get None for missing index, otherwise index validity."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_index_validity, [str(name)])
+            row = cursor.fetchone()
+        return row[0] if row is not None else None
+
+    def _create_partitioned_index(self, sql):
+        """Create index on partitioned table with ON ONLY, build index concurrently for each partition
+        and attach it to parent index, parent index becomes valid when indexes for all partitions are attached.
+
+        Partitions indexes are built in parallel with ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS > 1.
+        Build is resumable: invalid parent index is reused, partitions with attached valid indexes are skipped
+        and invalid partitions indexes left by failed builds are rebuilt.
+        """
+        table = sql.parts["table"]
+        name = sql.parts["name"]
+        if self._get_index_validity(name) is not False:
+            template = sql.template[0].sql.replace(" CONCURRENTLY", "", 1).replace(
+                " ON %(table)s", " ON ONLY %(table)s", 1,
+            )
+            self.execute(Statement(
+                PGShare(template, idempotent_condition=Condition(self._sql_index_exists, False)),
+                **sql.parts,
+            ))
+        while True:
+            builds, attaches = self._get_partitions_index_statements(sql)
+            if not builds and not attaches:
+                break
+            logger.info(
+                "build index %s on %s for %s partitions and attach %s partitions",
+                name, table, len(builds), len(attaches),
+            )
+            self._execute_deferred_sql(builds)
+            for attach in attaches:
+                self.execute(attach)
+        if not self._get_index_validity(name):
+            raise DatabaseError(f"Index {name} on {table} is invalid after indexes for all partitions attached.")
+
+    def _get_partitions_index_statements(self, sql):
+        table = sql.parts["table"]
+        name = str(sql.parts["name"])
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_partitions_indexes, [name, str(table)])
+            partitions = cursor.fetchall()
+        builds = []
+        attaches = []
+        for partition, partitioned, attached_index, attached_valid in partitions:
+            if attached_valid:
+                continue
+            partition_table = Table(partition, self.quote_name)
+            # relation kind is known, so partition index build doesn't check it again
+            self._introspection_cache[("partitioned", partition)] = (partitioned, {partition})
+            partition_index = self.quote_name(
+                attached_index or self._create_index_name(partition, [name.strip('"')], suffix="")
+            )
+            # sub-partitioned partition is processed by same way recursively
+            validity = None if partitioned else self._get_index_validity(partition_index)
+            if validity is None:
+                builds.append(Statement(sql.template, **{
+                    **sql.parts, "table": partition_table, "name": partition_index,
+                }))
+            elif validity is False:
+                builds.append(Statement(self._sql_rebuild_index, table=partition_table, name=partition_index))
+            if attached_index is None:
+                attaches.append(Statement(
+                    self._sql_attach_index_partition, table=table, name=name, partition_index=partition_index,
+                ))
+        return builds, attaches
+
+    def _create_partitioned_constraint(self, sql):
+        """Validate CHECK, NOT NULL or FOREIGN KEY constraint of partitioned table for each leaf partition
+        separately instead of one long VALIDATE CONSTRAINT for all partitions.
+
+        CHECK constraint is added to parent as NOT VALID, validated for each leaf partition and then for parent
+        without scans. FOREIGN KEY can't be added as NOT VALID to partitioned table, so it's added as NOT VALID
+        and validated for each leaf partition and then added to parent, that attaches validated constraints.
+        Validations are run in parallel with ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS > 1.
+        Validation is resumable: already validated partitions are skipped.
+        """
+        table = sql.parts["table"]
+        name = sql.parts["name"]
+        statements = self._split_statements(sql)
+        is_fk = sql.template is self.sql_create_fk
+        if not is_fk:
+            # NOT VALID constraint left by interrupted validation is reused
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_get_constraint_validity, [str(table), str(name)])
+                row = cursor.fetchone()
+            if row is None or row[0]:
+                self.execute(statements[0])
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_leaf_partitions_constraints, [str(table), str(name)])
+            partitions = cursor.fetchall()
+        add_statements = []
+        validations = []
+        for partition, validated in partitions:
+            if validated:
+                continue
+            partition_table = Table(partition, self.quote_name)
+            if validated is None:
+                # foreign key only, check constraint is inherited from parent
+                add_statements.append(Statement(sql.template[0], **{**sql.parts, "table": partition_table}))
+            validations.append(Statement(self._sql_validate_constraint, table=partition_table, name=name))
+        logger.info(
+            "validate constraint %s on %s for %s of %s partitions", name, table, len(validations), len(partitions),
+        )
+        for add_statement in add_statements:
+            self.execute(add_statement)
+        self._execute_deferred_sql(validations)
+        if is_fk:
+            self.execute(Statement(
+                PGAccessExclusive(
+                    sql.template[0].sql.replace(" NOT VALID", ""),
+                    idempotent_condition=Condition(self._sql_constraint_exists, False),
+                ),
+                **sql.parts,
+            ))
+        else:
+            for statement in statements[1:]:
+                self.execute(statement)
+
+    def _split_statements(self, sql):
         if isinstance(sql, MultiStatementSQL):
-            statements.extend(sql)
-        elif isinstance(sql, Statement) and isinstance(sql.template, MultiStatementSQL):
-            statements.extend(Statement(s, **sql.parts) for s in sql.template)
+            return list(sql)
+        if isinstance(sql, Statement) and isinstance(sql.template, MultiStatementSQL):
+            return [Statement(s, **sql.parts) for s in sql.template]
+        return [sql]
+
+    def _unpack_statement(self, statement):
+        idempotent_condition = None
+        if isinstance(statement, PGLock):
+            use_timeouts = statement.use_timeouts
+            disable_statement_timeout = statement.disable_statement_timeout
+            idempotent_condition = statement.idempotent_condition
+            statement = statement.sql
+        elif isinstance(statement, Statement) and isinstance(statement.template, PGLock):
+            use_timeouts = statement.template.use_timeouts
+            disable_statement_timeout = statement.template.disable_statement_timeout
+            if statement.template.idempotent_condition is not None:
+                idempotent_condition = statement.template.idempotent_condition % statement.parts
+            statement = Statement(statement.template.sql, **statement.parts)
         else:
-            statements.append(sql)
+            use_timeouts = False
+            disable_statement_timeout = False
+        return statement, use_timeouts, disable_statement_timeout, idempotent_condition
+
+    def _execute_statement(self, statement, params, journal_sql=None):
+        lock = self._get_lock(statement)
+        lock_mode = lock.lock_mode if lock is not None else None
+        statement, use_timeouts, disable_statement_timeout, idempotent_condition = self._unpack_statement(statement)
+        if self._skip_applied(idempotent_condition):
+            self._emit_event(self._create_statement_event(statement, lock, skipped=True))
+            return False
+        if self.collect_sql and self.ESTIMATE:
+            self.collected_sql.append(self._estimate_statement(statement, lock_mode))
+        # any applied statement can change schema, so prefetched conditions are not actual anymore
+        self._conditions_cache.clear()
+        self._invalidate_introspection_cache(statement)
+        with self._trace_statement(statement, lock), self._report_index_progress(statement):
+            if use_timeouts:
+                with self._set_operation_timeout(self.STATEMENT_TIMEOUT, self.LOCK_TIMEOUT), self._cancel_blockers():
+                    self._execute_with_lock_retries(statement, params, lock_mode, journal_sql)
+            elif disable_statement_timeout and self.FLEXIBLE_STATEMENT_TIMEOUT:
+                with self._set_operation_timeout(self.ZERO_TIMEOUT), self._cancel_blockers():
+                    self._execute_with_journal(statement, params, journal_sql)
+            else:
+                with self._set_operation_timeout(), self._cancel_blockers(enabled=disable_statement_timeout):
+                    self._execute_with_journal(statement, params, journal_sql)
+                self._forget_changed_session_timeouts(statement)
+        return True
+
+    def _get_journal_migration(self):
+        """Find migration applied or unapplied with this schema editor.
+
+        Django doesn't pass migration to schema editor, so it's found in Migration.apply or Migration.unapply
+        call frame with this schema editor argument, this way works for migration executor, sqlmigrate
+        and custom migration classes that call super().apply or super().unapply.
+        Deferred sql is executed after these calls in schema editor exit, so last found migration is used.
+        Statements executed by schema editor outside of migration aren't journaled.
+        """
+        frame = inspect.currentframe()
+        while frame is not None:
+            if (
+                frame.f_code.co_name in ("apply", "unapply")
+                and isinstance(frame.f_locals.get("self"), Migration)
+                and frame.f_locals.get("schema_editor") is self
+            ):
+                migration = frame.f_locals["self"]
+                return f"{migration.app_label}.{migration.name}.{frame.f_code.co_name}"
+            frame = frame.f_back
+        return self._journal_migration
+
+    def _get_journal_keys(self, statements, params):
+        """Get journal keys for statements by ZERO_DOWNTIME_MIGRATIONS_JOURNAL hash of migration and statement,
+        same statements in one migration are distinguished by occurrence number
+        and deferred statements by their position in deferred sql.
+
+        Journal of opposite direction is cleared when migration is started, as it's left by interrupted
+        migrate run (eg. failed next migration) and isn't actual after migration is applied or unapplied again.
+        """
+        if not self.JOURNAL:
+            return None
+        migration = self._get_journal_migration()
+        if migration is None:
+            return None
+        if migration != self._journal_migration:
+            name, direction = migration.rsplit(".", 1)
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_create_journal)
+                cursor.execute(self._sql_clear_journal, [f"{name}.{'unapply' if direction == 'apply' else 'apply'}"])
+                cursor.execute(self._sql_get_journal, [migration])
+                self._journal = {row[0] for row in cursor.fetchall()}
+            self._journal_migration = migration
+            self._journal_occurrences = {}
+        keys = {}
         for statement in statements:
-            idempotent_condition = None
-            if isinstance(statement, PGLock):
-                use_timeouts = statement.use_timeouts
-                disable_statement_timeout = statement.disable_statement_timeout
-                idempotent_condition = statement.idempotent_condition
-                statement = statement.sql
-            elif isinstance(statement, Statement) and isinstance(statement.template, PGLock):
-                use_timeouts = statement.template.use_timeouts
-                disable_statement_timeout = statement.template.disable_statement_timeout
-                if statement.template.idempotent_condition is not None:
-                    idempotent_condition = statement.template.idempotent_condition % statement.parts
-                statement = Statement(statement.template.sql, **statement.parts)
+            sql = f"{self._unpack_statement(statement)[0]}\n{params!r}"
+            occurrence = self._journal_occurrences.get((self._journal_deferred_index, sql), 0)
+            self._journal_occurrences[(self._journal_deferred_index, sql)] = occurrence + 1
+            if self._journal_deferred_index is not None:
+                occurrence = f"deferred {self._journal_deferred_index}.{occurrence}"
+            keys[id(statement)] = hashlib.sha256(f"{migration}\n{occurrence}\n{sql}".encode()).hexdigest()
+        return keys
+
+    def _skip_journaled(self, statements, journal_keys):
+        if journal_keys is None:
+            return statements
+        pending = []
+        for statement in statements:
+            if journal_keys[id(statement)] in self._journal:
+                logger.info("skip statement applied by previous run of %s: %s", self._journal_migration, statement)
+                self._emit_event(self._create_statement_event(
+                    self._unpack_statement(statement)[0], self._get_lock(statement), skipped=True,
+                ))
             else:
-                use_timeouts = False
-                disable_statement_timeout = False
-
-            if not self._skip_applied(idempotent_condition):
-                if use_timeouts:
-                    with self._set_operation_timeout(self.STATEMENT_TIMEOUT, self.LOCK_TIMEOUT):
-                        super().execute(statement, params)
-                elif disable_statement_timeout and self.FLEXIBLE_STATEMENT_TIMEOUT:
-                    with self._set_operation_timeout(self.ZERO_TIMEOUT):
-                        super().execute(statement, params)
-                else:
-                    super().execute(statement, params)
+                pending.append(statement)
+        return pending
+
+    def _journal_statement(self, journal_keys, statement, outcome):
+        if journal_keys is None:
+            return
+        key = journal_keys[id(statement)]
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                self._sql_journal_statement,
+                [self._journal_migration, key, outcome, str(self._unpack_statement(statement)[0])],
+            )
+        self._journal.add(key)
+
+    def _get_journal_statement_sql(self, journal_keys, statement, params):
+        """Get journal record insert that is sent with statement in one query without extra round-trip.
+
+        Statements in one query run in one implicit transaction, so record is inserted only if statement applied.
+        Only schema editor statements without params that can run in transaction block are combined,
+        raw sql (eg. RunSQL with own transaction control) is journaled by separate query.
+        """
+        if journal_keys is None or params or self._get_lock(statement) is None:
+            return None
+        sql = str(self._unpack_statement(statement)[0])
+        if self._non_transactional_regexp.search(sql):
+            return None
+        return self._sql_journal_statement % tuple(
+            self.quote_value(value) for value in (self._journal_migration, journal_keys[id(statement)], "applied", sql)
+        )
+
+    def _execute_with_journal(self, statement, params, journal_sql=None):
+        if journal_sql is None:
+            return super().execute(statement, params)
+        return super().execute(f"{statement};\n{journal_sql}", None)
+
+    def _clear_journal(self):
+        # migration is completed and recorded, so journal is not needed for rerun anymore
+        if self._journal_migration is None:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_clear_journal, [self._journal_migration])
+        self._journal_migration = None
+        self._journal = None
+        self._journal_occurrences = None
+
+    def _get_lock(self, statement):
+        if isinstance(statement, Statement):
+            statement = statement.template
+        return statement if isinstance(statement, PGLock) else None
+
+    def _get_statement_tables(self, statement):
+        if isinstance(statement, Statement):
+            tables = [part.table for part in statement.parts.values() if isinstance(part, Table)]
+            if tables:
+                return tables
+        table = self._get_statement_table(statement)
+        if table is None:
+            return []
+        if table.startswith('"'):
+            table = table[1:-1].replace('""', '"')
+        return [table]
+
+    def _get_statement_table(self, statement):
+        """Get main table of statement quoted as in sql: from Table parts of statement
+        or by regexp for raw sql, eg. django builds column alter statements as strings."""
+        if isinstance(statement, Statement):
+            tables = [part for part in statement.parts.values() if isinstance(part, Table)]
+            table = statement.parts.get("table")
+            if not isinstance(table, Table) and tables:
+                table = tables[0]
+            if isinstance(table, Table):
+                return str(table)
+        match = self._statement_table_regexp.search(str(statement))
+        return match.group(1) if match else None
+
+    def _create_statement_event(self, statement, lock, skipped=False):
+        """Structured event for statement sent to ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS.
+
+        Timeouts are None when session defaults are used, durations are in seconds.
+        """
+        if not self.EVENT_SINKS or self.collect_sql:
+            return None
+        return {
+            "event": "statement",
+            "timestamp": time.time(),
+            "database": self.connection.alias,
+            "sql": str(statement),
+            "lock": type(lock).__name__ if lock is not None else None,
+            "lock_mode": lock.lock_mode if lock is not None else None,
+            "tables": self._get_statement_tables(statement),
+            "statement_timeout": None,
+            "lock_timeout": None,
+            "skipped": skipped,
+            "retries": 0,
+            "lock_timeouts": 0,
+            "lock_wait": 0.0,
+            "execution": 0.0,
+            "duration": 0.0,
+            "error": None,
+        }
+
+    def _emit_event(self, event):
+        if event is None:
+            return
+        for sink in self.EVENT_SINKS:
+            try:
+                sink(event)
+            except Exception:
+                # broken sink shouldn't break migration
+                logger.exception("event sink %r failed", sink)
+
+    @contextmanager
+    def _trace_statement(self, statement, lock):
+        """Measure statement duration and time spent in lock waits and emit statement event.
+
+        Lock waits are sampled from pg_stat_activity by separate thread and connection
+        with ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL, so short waits can be missed.
+        """
+        event = self._create_statement_event(statement, lock)
+        if event is None:
+            yield
+            return
+        self._start_lock_wait_sampler()
+        with self._lock_wait_sampler_lock:
+            self._statement_event = event
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            event["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            with self._lock_wait_sampler_lock:
+                self._statement_event = None
+            event["duration"] = time.monotonic() - start
+            event["lock_wait"] = min(event["lock_wait"], event["duration"])
+            event["execution"] = event["duration"] - event["lock_wait"]
+            self._emit_event(event)
+
+    def _start_lock_wait_sampler(self):
+        if self._lock_wait_sampler is None:
+            self._lock_wait_sampler = threading.Thread(
+                target=self._sample_lock_wait,
+                args=(self._get_backend_pid(), self._lock_wait_sampler_stop),
+                daemon=True,
+            )
+            self._lock_wait_sampler.start()
+
+    def _stop_lock_wait_sampler(self):
+        if self._lock_wait_sampler is not None:
+            self._lock_wait_sampler_stop.set()
+            self._lock_wait_sampler.join()
+            self._lock_wait_sampler = None
+            self._lock_wait_sampler_stop = threading.Event()
+
+    def _sample_lock_wait(self, pid, stop):
+        # connection is opened only when statement runs at sampling time and is reused for next statements
+        connection = None
+        try:
+            while not stop.wait(self.LOCK_BLOCKERS_POLL_INTERVAL):
+                event = self._statement_event
+                if event is None:
+                    continue
+                if connection is None:
+                    connection = self._copy_connection()
+                with connection.cursor() as cursor:
+                    cursor.execute(self._sql_get_backend_lock_wait, [pid])
+                    row = cursor.fetchone()
+                with self._lock_wait_sampler_lock:
+                    # statement can be finished while sampling, its wait isn't counted for next statement
+                    if row is not None and row[0] and self._statement_event is event:
+                        event["lock_wait"] += self.LOCK_BLOCKERS_POLL_INTERVAL
+        except DatabaseError:
+            logger.exception("lock wait sampler for migration pid %s failed", pid)
+        finally:
+            if connection is not None:
+                self._close_side_connection(connection)
+
+    def _estimate_statement(self, statement, lock_mode):
+        """Annotate statement for sqlmigrate with lock mode, table access and estimated duration
+        calculated from current table size and ZERO_DOWNTIME_MIGRATIONS_ESTIMATE_THROUGHPUT in bytes per second.
+
+        Scan reads table once, rewrite reads and writes table with indexes.
+        """
+        sql = str(statement)
+        annotation = f"-- [{lock_mode or 'UNKNOWN LOCK'}]"
+        table = self._get_statement_table(statement)
+        if table is not None:
+            annotation += f" {table}"
+        if sql in self._estimate_metadata_only_sql:
+            return f"{annotation}: metadata only"
+        if self._table_rewrite_regexp.search(sql):
+            access, size_index = "rewrite", 1
+        elif self._table_scan_regexp.search(sql):
+            access, size_index = "scan", 0
+        else:
+            return f"{annotation}: metadata only"
+        if table is not None and table not in self._estimate_table_sizes:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_get_table_sizes, [table, table])
+                self._estimate_table_sizes[table] = cursor.fetchone()
+        size = self._estimate_table_sizes.get(table, (None, None))[size_index]
+        if size is None:
+            return f"{annotation}: {access}, size unknown"
+        duration = size * (2 if access == "rewrite" else 1) / self.ESTIMATE_THROUGHPUT
+        self._estimate_total += duration
+        if lock_mode == PGAccessExclusive.lock_mode:
+            self._estimate_lock_total += duration
+        return f"{annotation}: {access} {size / 1024 / 1024:.1f}MB, estimated {duration:.1f}s"
+
+    @contextmanager
+    def _report_index_progress(self, statement):
+        """Report index build progress every ZERO_DOWNTIME_MIGRATIONS_INDEX_PROGRESS_INTERVAL seconds
+        from pg_stat_progress_create_index by separate thread and connection while statement is running.
+        """
+        if (
+            self.INDEX_PROGRESS_INTERVAL is None
+            or self.collect_sql
+            or not self._index_build_regexp.match(str(statement))
+        ):
+            yield
+            return
+        stop = threading.Event()
+        monitor = threading.Thread(
+            target=self._monitor_index_progress, args=(self._get_backend_pid(), stop, str(statement)), daemon=True,
+        )
+        monitor.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            monitor.join()
+
+    def _monitor_index_progress(self, pid, stop, sql):
+        # connection is opened only for index builds that run longer than report interval
+        connection = None
+        phase = phase_start = None
+        try:
+            while not stop.wait(self.INDEX_PROGRESS_INTERVAL):
+                if connection is None:
+                    connection = self._copy_connection()
+                with connection.cursor() as cursor:
+                    cursor.execute(self._sql_get_index_progress, [pid])
+                    row = cursor.fetchone()
+                if row is None:
+                    continue
+                index, table, current_phase, blocks_done, blocks_total, tuples_done, tuples_total = row
+                now = time.monotonic()
+                if current_phase != phase:
+                    phase, phase_start = current_phase, now
+                # eta is estimated for current phase only, index build has several phases with scans and sorts
+                done, total = (blocks_done, blocks_total) if blocks_total else (tuples_done, tuples_total)
+                eta = (now - phase_start) * (total - done) / done if done and total else None
+                logger.info(
+                    "index %s on %s: %s, blocks %s of %s, tuples %s of %s, phase eta %s",
+                    index, table, phase, blocks_done, blocks_total, tuples_done, tuples_total,
+                    "unknown" if eta is None else f"{eta:.1f}s",
+                )
+                if self.EVENT_SINKS:
+                    self._emit_event({
+                        "event": "index_progress",
+                        "timestamp": time.time(),
+                        "database": self.connection.alias,
+                        "sql": sql,
+                        "index": index,
+                        "table": table,
+                        "phase": phase,
+                        "blocks_done": blocks_done,
+                        "blocks_total": blocks_total,
+                        "tuples_done": tuples_done,
+                        "tuples_total": tuples_total,
+                        "eta": eta,
+                    })
+        except DatabaseError:
+            logger.exception("index progress monitor for migration pid %s failed", pid)
+        finally:
+            if connection is not None:
+                self._close_side_connection(connection)
+
+    def _execute_with_lock_retries(self, statement, params, lock_mode=None, journal_sql=None):
+        """Retry only current statement when it failed to acquire lock in lock_timeout,
+        so short lock can be taken between traffic bursts without rerunning whole migration.
+
+        Retry is safe as migrations run without transaction, so failed statement changes nothing.
+        """
+        attempt = 0
+        while True:
+            try:
+                self._wait_lock_blockers(statement, lock_mode)
+                return self._execute_with_journal(statement, params, journal_sql)
+            except OperationalError as e:
+                is_lock_timeout_error = self._is_lock_timeout_error(e)
+                if is_lock_timeout_error and self._statement_event is not None:
+                    self._statement_event["lock_timeouts"] += 1
+                if attempt >= self.LOCK_RETRIES or not is_lock_timeout_error:
+                    raise
+                delay = self._get_lock_retry_delay(attempt)
+                attempt += 1
+                if self._statement_event is not None:
+                    self._statement_event["retries"] = attempt
+                logger.warning(
+                    "lock is not available for statement, retry %s of %s in %.3fs: %s",
+                    attempt, self.LOCK_RETRIES, delay, statement,
+                )
+                time.sleep(delay)
+
+    def _wait_lock_blockers(self, statement, lock_mode=None):
+        """Check that no long transactions hold or wait locks conflicting with statement lock
+        on statement tables before lock request, as waiting lock request blocks all next conflicting queries.
+        Statement with unknown lock mode is checked as ACCESS EXCLUSIVE one.
+        Table of string statement with known lock mode (eg. django formats column statements with %)
+        is found by regexp.
+
+        Blockers are polled until they finished or ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_TIMEOUT exceeded,
+        so lock request doesn't join lock queue behind transaction that won't be finished in lock_timeout.
+        """
+        if self.LOCK_BLOCKERS_TIMEOUT is None or self.collect_sql:
+            return
+        if isinstance(statement, Statement):
+            tables = [(name, str(part)) for name, part in statement.parts.items() if isinstance(part, Table)]
+        elif lock_mode is not None:
+            table = self._get_statement_table(statement)
+            tables = [("table", table)] if table is not None else []
+        else:
+            return
+        lock_tables = []
+        lock_modes = []
+        for name, table in tables:
+            table_lock_mode = (
+                self._referenced_table_lock_mode if name == "to_table" else lock_mode or "ACCESS EXCLUSIVE"
+            )
+            for mode in self._lock_blockers_modes[table_lock_mode]:
+                lock_tables.append(table)
+                lock_modes.append(mode)
+        if not lock_tables:
+            return
+        tables = list(dict.fromkeys(lock_tables))
+        deadline = time.monotonic() + self.LOCK_BLOCKERS_TIMEOUT
+        while True:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_get_lock_blockers, [lock_tables, lock_modes, self.LOCK_BLOCKERS_MIN_AGE])
+                blockers = cursor.fetchall()
+            if not blockers:
+                return
+            description = ", ".join(
+                f"pid {pid} ({state}, transaction age {age:.1f}s)" for pid, state, age, xact_start in blockers
+            )
+            if time.monotonic() >= deadline:
+                raise LockBlockedException(f"{', '.join(tables)} locked by long transactions: {description}")
+            logger.info("wait long transactions on %s: %s", ", ".join(tables), description)
+            time.sleep(self.LOCK_BLOCKERS_POLL_INTERVAL)
+            with self._lock_wait_sampler_lock:
+                if self._statement_event is not None:
+                    # waiting for blockers before lock request is part of lock wait too
+                    self._statement_event["lock_wait"] += self.LOCK_BLOCKERS_POLL_INTERVAL
+
+    @contextmanager
+    def _cancel_blockers(self, enabled=True):
+        """Cancel queries or terminate idle in transaction sessions that block statement
+        longer than ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER seconds.
+
+        Blockers are found by pg_blocking_pids in separate thread and connection while statement is running,
+        it covers lock waits for ACCESS EXCLUSIVE statements and old snapshots waits for concurrent statements.
+        """
+        if not enabled or self.CANCEL_BLOCKERS_AFTER is None or self.collect_sql:
+            yield
+            return
+        if self._blockers_monitor is None:
+            self._blockers_monitor = threading.Thread(
+                target=self._monitor_blockers,
+                args=(self._get_backend_pid(), self._blockers_monitor_stop),
+                daemon=True,
+            )
+            self._blockers_monitor.start()
+        self._blockers_monitor_statement = object()
+        try:
+            yield
+        finally:
+            self._blockers_monitor_statement = None
+
+    def _stop_blockers_monitor(self):
+        if self._blockers_monitor is not None:
+            self._blockers_monitor_stop.set()
+            self._blockers_monitor.join()
+            self._blockers_monitor = None
+            self._blockers_monitor_stop = threading.Event()
+
+    def _get_backend_pid(self):
+        if self._backend_pid is None:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_get_backend_pid)
+                self._backend_pid = cursor.fetchone()[0]
+        return self._backend_pid
+
+    def _copy_connection(self):
+        """Open side connection and remember its backend pid, so it is never cancelled as blocker."""
+        connection = self.connection.copy()
+        with connection.cursor() as cursor:
+            cursor.execute(self._sql_get_backend_pid)
+            self._side_backend_pids[connection] = cursor.fetchone()[0]
+        return connection
+
+    def _close_side_connection(self, connection):
+        self._side_backend_pids.pop(connection, None)
+        connection.close()
+
+    def _monitor_blockers(self, pid, stop):
+        # connection is opened only when statement runs at polling time and is reused for next statements
+        connection = None
+        statement = None
+        first_seen = {}
+        try:
+            while not stop.wait(self.LOCK_BLOCKERS_POLL_INTERVAL):
+                if self._blockers_monitor_statement is not statement:
+                    statement = self._blockers_monitor_statement
+                    first_seen = {}
+                if statement is None:
+                    continue
+                if connection is None:
+                    connection = self._copy_connection()
+                with connection.cursor() as cursor:
+                    # sessions of other roles are cancelled only if role is explicitly allowed
+                    cursor.execute(self._sql_get_blocking_backends, [
+                        pid, list(self._side_backend_pids.values()), self.CANCEL_BLOCKERS_ROLES or None,
+                    ])
+                    blockers = cursor.fetchall()
+                    now = time.monotonic()
+                    first_seen = {blocker[0]: first_seen.get(blocker[0], now) for blocker in blockers}
+                    for blocker_pid, state, role, application_name, age, query in blockers:
+                        if self._blockers_monitor_statement is not statement:
+                            # statement is finished, so its blockers aren't blockers anymore
+                            break
+                        if now - first_seen[blocker_pid] < self.CANCEL_BLOCKERS_AFTER:
+                            continue
+                        if (
+                            self.CANCEL_BLOCKERS_APPLICATION_NAMES
+                            and application_name not in self.CANCEL_BLOCKERS_APPLICATION_NAMES
+                        ):
+                            continue
+                        # cancel doesn't affect idle in transaction session, so terminate it
+                        if (state or "").startswith("idle in transaction"):
+                            action, sql = "terminate", self._sql_terminate_backend
+                        else:
+                            action, sql = "cancel", self._sql_cancel_backend
+                        cursor.execute(sql, [blocker_pid])
+                        done = cursor.fetchone()[0]
+                        logger.warning(
+                            "%s backend pid %s blocking migration pid %s for %.1fs%s: "
+                            "role %s, application %r, state %r, transaction age %.1fs, query %r",
+                            action, blocker_pid, pid, now - first_seen[blocker_pid], "" if done else " failed",
+                            role, application_name, state, age or 0, query,
+                        )
+        except DatabaseError:
+            logger.exception("blockers monitor for migration pid %s failed", pid)
+        finally:
+            if connection is not None:
+                self._close_side_connection(connection)
+
+    def _is_lock_timeout_error(self, error: Exception) -> bool:
+        if self.collect_sql or self.connection.in_atomic_block:
+            return False
+        if isinstance(error, LockBlockedException):
+            return True
+        cause = error.__cause__
+        # psycopg 3 uses sqlstate, psycopg2 uses pgcode
+        code = getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)
+        return code == self.LOCK_NOT_AVAILABLE
+
+    def _get_lock_retry_delay(self, attempt: int) -> float:
+        delay = min(self.LOCK_RETRY_DELAY * 2 ** attempt, self.LOCK_RETRY_MAX_DELAY)
+        return max(delay * (1 + random.uniform(-self.LOCK_RETRY_JITTER, self.LOCK_RETRY_JITTER)), 0)
 
     def _skip_applied(self, idempotent_condition: Condition) -> bool:
         if idempotent_condition is None:
@@ -600,33 +2136,123 @@ class DatabaseSchemaEditorMixin:
             # but if IDEMPOTENT_SQL mode is disabled we need to skip this extra reindex sql
             return idempotent_condition.idempotent_mode_only
 
+        exists = self._conditions_cache.get(idempotent_condition.sql)
+        if exists is None:
+            with self.connection.cursor() as cursor:
+                cursor.execute(idempotent_condition.sql)
+                exists = cursor.fetchone() is not None
+        if idempotent_condition.exists:
+            return not exists
+        return exists
+
+    def _prefetch_conditions(self, sqls):
+        """Check idempotent conditions for all statements by one query instead of query per statement.
+
+        Prefetched results are valid until any statement applied, so for rerun of applied
+        or partially applied migrations most of statements will be skipped without extra queries.
+        """
+        if not self.IDEMPOTENT_SQL:
+            return
+        conditions = []
+        for sql in sqls:
+            if sql is DUMMY_SQL:
+                continue
+            for statement in self._split_statements(sql):
+                idempotent_condition = self._unpack_statement(statement)[3]
+                if (
+                    idempotent_condition is not None
+                    and idempotent_condition.sql not in self._conditions_cache
+                    and idempotent_condition.sql not in conditions
+                ):
+                    conditions.append(idempotent_condition.sql)
+        if len(conditions) < 2:
+            return
         with self.connection.cursor() as cursor:
-            cursor.execute(idempotent_condition.sql)
-            exists = cursor.fetchone() is not None
-            if idempotent_condition.exists:
-                return not exists
-            return exists
+            for i in range(0, len(conditions), self._conditions_batch_size):
+                batch = conditions[i:i + self._conditions_batch_size]
+                cursor.execute(self._sql_conditions_exist % {"conditions": ", ".join(
+                    self._sql_condition_exists % {"condition": condition} for condition in batch
+                )})
+                self._conditions_cache.update(zip(batch, cursor.fetchone()))
 
     @contextmanager
     def _set_operation_timeout(self, statement_timeout=None, lock_timeout=None):
         if self.collect_sql:
-            previous_statement_timeout = self.ZERO_TIMEOUT
-            previous_lock_timeout = self.ZERO_TIMEOUT
+            # keep explicit timeouts for each statement to make sqlmigrate output readable
+            if statement_timeout is not None:
+                super().execute(self._sql_set_statement_timeout % {"statement_timeout": statement_timeout})
+            if lock_timeout is not None:
+                super().execute(self._sql_set_lock_timeout % {"lock_timeout": lock_timeout})
+            yield
+            if statement_timeout is not None:
+                super().execute(self._sql_set_statement_timeout % {"statement_timeout": self.ZERO_TIMEOUT})
+            if lock_timeout is not None:
+                super().execute(self._sql_set_lock_timeout % {"lock_timeout": self.ZERO_TIMEOUT})
         else:
+            # timeouts are restored lazily: by next statement that requires other timeouts
+            # or by _restore_session_timeouts in the end of execute call
+            self._set_session_timeouts(statement_timeout, lock_timeout)
+            if self._statement_event is not None:
+                self._statement_event.update(statement_timeout=statement_timeout, lock_timeout=lock_timeout)
+            yield
+
+    def _track_session_timeouts(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not self._changing_session_timeouts:
+                self._forget_changed_session_timeouts(sql)
+
+    def _forget_changed_session_timeouts(self, sql):
+        if self._session_timeouts_change_regexp.search(str(sql)):
+            # timeouts changed outside of schema editor, so tracked state is not actual anymore
+            self._default_timeouts = None
+            self._session_timeouts = None
+
+    def _get_session_timeouts(self):
+        if self._session_timeouts is None:
             with self.connection.cursor() as cursor:
-                cursor.execute(self._sql_get_statement_timeout)
-                previous_statement_timeout, = cursor.fetchone()
-                cursor.execute(self._sql_get_lock_timeout)
-                previous_lock_timeout, = cursor.fetchone()
-        if statement_timeout is not None:
-            self.execute(self._sql_set_statement_timeout % {"statement_timeout": statement_timeout})
-        if lock_timeout is not None:
-            self.execute(self._sql_set_lock_timeout % {"lock_timeout": lock_timeout})
-        yield
-        if statement_timeout is not None:
-            self.execute(self._sql_set_statement_timeout % {"statement_timeout": previous_statement_timeout})
-        if lock_timeout is not None:
-            self.execute(self._sql_set_lock_timeout % {"lock_timeout": previous_lock_timeout})
+                cursor.execute(self._sql_get_timeouts)
+                statement_timeout, lock_timeout = cursor.fetchone()
+            self._default_timeouts = {"statement_timeout": statement_timeout, "lock_timeout": lock_timeout}
+            self._session_timeouts = dict(self._default_timeouts)
+        return self._session_timeouts
+
+    def _set_session_timeouts(self, statement_timeout=None, lock_timeout=None):
+        if statement_timeout is None and lock_timeout is None and self._session_timeouts is None:
+            # nothing changed yet, so session already has default timeouts
+            return
+        session_timeouts = self._get_session_timeouts()
+        for name, sql, value in (
+            ("statement_timeout", self._sql_set_statement_timeout, statement_timeout),
+            ("lock_timeout", self._sql_set_lock_timeout, lock_timeout),
+        ):
+            if value is None:
+                value = self._default_timeouts[name]
+            if self._normalize_timeout(session_timeouts[name]) != self._normalize_timeout(value):
+                self._changing_session_timeouts = True
+                try:
+                    super().execute(sql % {name: value})
+                finally:
+                    self._changing_session_timeouts = False
+                session_timeouts[name] = value
+
+    def _normalize_timeout(self, value):
+        match = self._timeout_regexp.match(str(value))
+        if match is None:
+            return str(value)
+        return float(match.group("value")) * self._timeout_units[match.group("unit") or "ms"]
+
+    def _restore_session_timeouts(self):
+        if self._session_timeouts is None:
+            return
+        try:
+            self._set_session_timeouts()
+        except DatabaseError:
+            # session state is unknown, eg. connection was lost, so it should be fetched again
+            self._default_timeouts = None
+            self._session_timeouts = None
+            raise
 
     def _flush_deferred_sql(self):
         """As some alternative sql use deferred sql and deferred sql run after all operations in migration module
@@ -639,19 +2265,235 @@ class DatabaseSchemaEditorMixin:
          # TODO: drop option to run deferred sql as soon as possible in future
          """
         if not self.DEFERRED_SQL:
-            for sql in self.deferred_sql:
-                self.execute(sql)
+            self._execute_deferred_sql(self.deferred_sql)
             self.deferred_sql.clear()
 
+    def _execute_deferred_sql(self, sqls):
+        """Run deferred sql, when ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS > 1
+        statements that don't take conflicting locks run in parallel using side connections.
+
+        Deferred statements are turned into dependency graph: statement depends on all previous statements
+        that take conflicting locks on same tables, so order of statements for same table is kept,
+        eg. index creation and constraint creation that uses this index.
+        Statements with unknown locks (eg. raw sql) wait all previous statements
+        and run in migration connection before any next statement.
+        """
+        self._prefetch_conditions(sqls)
+        if self.DEFERRED_SQL_WORKERS <= 1 or self.collect_sql or self.connection.in_atomic_block:
+            for index, sql in enumerate(sqls):
+                self._execute_deferred_statement(index, sql)
+            return
+        graph = []
+        for index, sql in enumerate(sqls):
+            locks = self._get_deferred_sql_locks(sql)
+            if locks is None:
+                self._execute_deferred_sql_graph(graph)
+                graph = []
+                self._execute_deferred_statement(index, sql)
+            else:
+                graph.append((index, sql, locks))
+        self._execute_deferred_sql_graph(graph)
+
+    def _execute_deferred_statement(self, index, sql):
+        self._journal_deferred_index = index
+        try:
+            self.execute(sql, None)
+        finally:
+            self._journal_deferred_index = None
+
+    def _get_deferred_sql_locks(self, sql):
+        if not isinstance(sql, Statement) or not isinstance(sql.parts.get("table"), Table):
+            return None
+        statements = sql.template if isinstance(sql.template, MultiStatementSQL) else [sql.template]
+        if not all(isinstance(statement, PGLock) and statement.lock_mode for statement in statements):
+            return None
+        locks = {sql.parts["table"].table: max(
+            (statement.lock_mode for statement in statements),
+            key=self._lock_modes_order.index,
+        )}
+        if isinstance(sql.parts.get("to_table"), Table):
+            to_table = sql.parts["to_table"].table
+            locks[to_table] = max(
+                locks.get(to_table, self._referenced_table_lock_mode),
+                self._referenced_table_lock_mode,
+                key=self._lock_modes_order.index,
+            )
+        return locks
+
+    def _locks_conflict(self, locks, other_locks):
+        return any(
+            other_locks[table] in self._lock_conflicts[lock_mode]
+            for table, lock_mode in locks.items()
+            if table in other_locks
+        )
+
+    def _execute_deferred_sql_graph(self, graph):
+        if len(graph) <= 1:
+            for index, sql, locks in graph:
+                self._execute_deferred_statement(index, sql)
+            return
+        dependencies = [
+            {i for i in range(j) if self._locks_conflict(graph[i][2], graph[j][2])}
+            for j in range(len(graph))
+        ]
+        logger.info(
+            "run %s deferred statements with %s workers", len(graph), self.DEFERRED_SQL_WORKERS,
+        )
+        editors = queue.SimpleQueue()
+        pending = list(range(len(graph)))
+        running = {}
+        done = set()
+        error = None
+        try:
+            with ThreadPoolExecutor(max_workers=self.DEFERRED_SQL_WORKERS) as executor:
+                while pending or running:
+                    # don't start new statements after failure, but wait already running statements
+                    if error is None:
+                        for j in [j for j in pending if dependencies[j] <= done]:
+                            if len(running) >= self.DEFERRED_SQL_WORKERS:
+                                break
+                            pending.remove(j)
+                            running[executor.submit(self._execute_in_side_connection, editors, *graph[j][:2])] = j
+                    if not running:
+                        break
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        j = running.pop(future)
+                        if future.exception() is None:
+                            done.add(j)
+                        elif error is None:
+                            error = future.exception()
+        finally:
+            while not editors.empty():
+                editor = editors.get_nowait()
+                editor._stop_lock_wait_sampler()
+                editor._stop_blockers_monitor()
+                self._close_side_connection(editor.connection)
+            # schema was changed by other connections
+            self._conditions_cache.clear()
+            self._introspection_cache.clear()
+        if error is not None:
+            raise error
+
+    def _execute_in_side_connection(self, editors, index, sql):
+        try:
+            editor = editors.get_nowait()
+        except queue.Empty:
+            connection = self._copy_connection()
+            # connection is reused by pool in other worker threads
+            connection.inc_thread_sharing()
+            editor = type(self)(connection)
+        editor._side_backend_pids = self._side_backend_pids
+        editor._index_models = self._index_models
+        # side editors journal deferred statements of the same migration
+        editor._journal_migration = self._journal_migration
+        editor._journal = self._journal
+        # occurrences are counted per deferred statement, so they don't depend on workers scheduling
+        editor._journal_occurrences = {}
+        try:
+            editor._execute_deferred_statement(index, sql)
+        finally:
+            editors.put(editor)
+
+    def _get_cached_introspection(self, kind, table, fetch):
+        key = (kind, table)
+        if key not in self._introspection_cache:
+            result, related_tables = fetch()
+            self._introspection_cache[key] = (result, {table} | related_tables)
+        return self._introspection_cache[key][0]
+
+    def _invalidate_introspection_cache(self, statement):
+        if not self._introspection_cache:
+            return
+        if not isinstance(statement, Statement) or not any(
+            hasattr(part, "references_table") for part in statement.parts.values()
+        ):
+            # raw sql can change any table
+            self._introspection_cache.clear()
+            return
+        relkind_changed = self._relkind_change_regexp.match(str(statement)) is not None
+        for key, (result, related_tables) in list(self._introspection_cache.items()):
+            if key[0] == "partitioned" and not relkind_changed:
+                continue
+            if any(statement.references_table(table) for table in related_tables):
+                del self._introspection_cache[key]
+
+    @contextmanager
+    def _cached_introspection(self):
+        """Serve django internals introspection from cache,
+        eg. alter_field calls _constraint_names many times for same table."""
+        introspection = self.connection.introspection
+        get_constraints = introspection.get_constraints
+
+        def get_cached_constraints(cursor, table_name):
+            def fetch():
+                constraints = get_constraints(cursor, table_name)
+                return constraints, {
+                    constraint["foreign_key"][0]
+                    for constraint in constraints.values()
+                    if constraint["foreign_key"]
+                }
+            return self._get_cached_introspection("django_constraints", table_name, fetch)
+
+        patched = "get_constraints" in vars(introspection)
+        introspection.get_constraints = get_cached_constraints
+        try:
+            yield
+        finally:
+            if patched:
+                introspection.get_constraints = get_constraints
+            else:
+                del introspection.get_constraints
+
+    def _constraint_names(self, model, *args, **kwargs):
+        with self._cached_introspection():
+            return super()._constraint_names(model, *args, **kwargs)
+
     def _get_constraints(self, cursor, model):
-        cursor.execute(self._sql_get_table_constraints_introspection, [model._meta.db_table, model._meta.db_table])
-        for constraint, kind, table, table_ref, columns, columns_ref in cursor.fetchall():
-            yield constraint, kind, table, table_ref, columns, columns_ref
+        def fetch():
+            cursor.execute(self._sql_get_table_constraints_introspection, [model._meta.db_table, model._meta.db_table])
+            constraints = cursor.fetchall()
+            return constraints, {
+                table
+                for constraint, kind, table, table_ref, columns, columns_ref in constraints
+                for table in (table, table_ref)
+                if table is not None
+            }
+        yield from self._get_cached_introspection("constraints", model._meta.db_table, fetch)
 
     def _get_indexes(self, cursor, model):
-        cursor.execute(self._sql_get_index_introspection, [model._meta.db_table])
-        for index, table, columns in cursor.fetchall():
-            yield index, table, columns
+        def fetch():
+            cursor.execute(self._sql_get_index_introspection, [model._meta.db_table])
+            return cursor.fetchall(), set()
+        yield from self._get_cached_introspection("indexes", model._meta.db_table, fetch)
+
+    def _unsafe(self, message, table=None):
+        """Report unsafe operation by warning or exception.
+
+        Operations that lock or rewrite table are allowed for tables smaller than
+        ZERO_DOWNTIME_MIGRATIONS_UNSAFE_TABLE_SIZE_THRESHOLD, as they take milliseconds.
+        """
+        if table is not None and self._is_small_table(table, message):
+            return
+        if self.RAISE_FOR_UNSAFE:
+            raise UnsafeOperationException(message)
+        else:
+            warnings.warn(UnsafeOperationWarning(message))
+
+    def _is_small_table(self, table, message):
+        if self.UNSAFE_TABLE_SIZE_THRESHOLD is None:
+            return False
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_table_size, [self.quote_name(table)])
+            size = cursor.fetchone()[0]
+        # size is unknown for table that doesn't exist yet, eg. for sqlmigrate
+        if size is None or size >= self.UNSAFE_TABLE_SIZE_THRESHOLD:
+            return False
+        logger.info(
+            "%s size %s bytes is less than unsafe table size threshold, allowed: %s",
+            table, size, message.splitlines()[0],
+        )
+        return True
 
     def _drop_collect_sql_introspection_related_duplicates(self, drop_constraint_queries):
         """
@@ -714,10 +2556,7 @@ class DatabaseSchemaEditorMixin:
 
     def add_constraint(self, model, constraint):
         if isinstance(constraint, ExclusionConstraint):
-            if self.RAISE_FOR_UNSAFE:
-                raise UnsafeOperationException(Unsafe.ADD_CONSTRAINT_EXCLUDE)
-            else:
-                warnings.warn(UnsafeOperationWarning(Unsafe.ADD_CONSTRAINT_EXCLUDE))
+            self._unsafe(Unsafe.ADD_CONSTRAINT_EXCLUDE, model._meta.db_table)
         super().add_constraint(model, constraint)
         self._flush_deferred_sql()
 
@@ -726,7 +2565,10 @@ class DatabaseSchemaEditorMixin:
         self._flush_deferred_sql()
 
     def add_field(self, model, field):
-        super().add_field(model, field)
+        if self._has_volatile_db_default(field):
+            self._add_field_with_volatile_db_default(model, field)
+        else:
+            super().add_field(model, field)
         self._flush_deferred_sql()
 
     def remove_field(self, model, field):
@@ -788,18 +2630,12 @@ class DatabaseSchemaEditorMixin:
     def alter_db_table(self, model, old_db_table, new_db_table):
         # Disregard cases where db_table is unchanged
         if old_db_table != new_db_table:
-            if self.RAISE_FOR_UNSAFE:
-                raise UnsafeOperationException(Unsafe.ALTER_TABLE_RENAME)
-            else:
-                warnings.warn(UnsafeOperationWarning(Unsafe.ALTER_TABLE_RENAME))
+            self._unsafe(Unsafe.ALTER_TABLE_RENAME)
         super().alter_db_table(model, old_db_table, new_db_table)
         self._flush_deferred_sql()
 
     def alter_db_tablespace(self, model, old_db_tablespace, new_db_tablespace):
-        if self.RAISE_FOR_UNSAFE:
-            raise UnsafeOperationException(Unsafe.ALTER_TABLE_SET_TABLESPACE)
-        else:
-            warnings.warn(UnsafeOperationWarning(Unsafe.ALTER_TABLE_SET_TABLESPACE))
+        self._unsafe(Unsafe.ALTER_TABLE_SET_TABLESPACE, model._meta.db_table)
         super().alter_db_tablespace(model, old_db_tablespace, new_db_tablespace)
         self._flush_deferred_sql()
 
@@ -808,10 +2644,7 @@ class DatabaseSchemaEditorMixin:
         self._flush_deferred_sql()
 
     def _rename_field_sql(self, table, old_field, new_field, new_type):
-        if self.RAISE_FOR_UNSAFE:
-            raise UnsafeOperationException(Unsafe.ALTER_TABLE_RENAME_COLUMN)
-        else:
-            warnings.warn(UnsafeOperationWarning(Unsafe.ALTER_TABLE_RENAME_COLUMN))
+        self._unsafe(Unsafe.ALTER_TABLE_RENAME_COLUMN)
         return super()._rename_field_sql(table, old_field, new_field, new_type)
 
     def _has_db_default(self, field):
@@ -823,20 +2656,65 @@ class DatabaseSchemaEditorMixin:
             return field.has_db_default()
         return field.db_default is not NOT_PROVIDED
 
+    def _has_volatile_db_default(self, field):
+        if django.VERSION < (5, 0) or not self._has_db_default(field):
+            return False
+        default_sql, _ = self.db_default_sql(field)
+        # unquoted function names are case insensitive, overloads are checked together
+        functions = sorted({name.lower() for name in self._function_call_regexp.findall(default_sql)})
+        if not functions:
+            return False
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_volatile_functions, [functions])
+            return cursor.fetchone() is not None
+
+    def _add_field_with_volatile_db_default(self, model, field):
+        """Add column with volatile database default, eg. gen_random_uuid() or clock_timestamp(),
+        without table rewrite under ACCESS EXCLUSIVE lock.
+
+        Column is added as nullable without default, then default is set for new rows,
+        existing rows are backfilled with default by batches and NOT NULL is set
+        with CHECK NOT VALID, VALIDATE, SET NOT NULL statements.
+        """
+        table = model._meta.db_table
+        if getattr(model._meta.pk, "column", None) is None:
+            # composite primary key can't be used for batches
+            self._unsafe(Unsafe.ADD_COLUMN_VOLATILE_DEFAULT, table)
+            super().add_field(model, field)
+            return
+        nullable_field = copy.copy(field)
+        nullable_field.null = True
+        nullable_field.default = NOT_PROVIDED
+        nullable_field.db_default = NOT_PROVIDED
+        super().add_field(model, nullable_field)
+        changes_sql, params = self._alter_column_database_default_sql(model, None, field)
+        self.execute(Statement(
+            self.sql_alter_column,
+            table=Table(table, self.quote_name),
+            changes=changes_sql,
+        ), params)
+        if self.collect_sql:
+            self.collected_sql.append("-- MIGRATION NOW PERFORMS OPERATION THAT CANNOT BE WRITTEN AS SQL")
+        else:
+            self._backfill_by_primary_key(model._meta.pk.column, self._sql_backfill_column_default, {
+                "table": Table(table, self.quote_name),
+                "column": self.quote_name(field.column),
+            })
+        if not field.null:
+            self._alter_column_set_not_null(model, field)
+
     def _add_column_not_null(self, model, field):
         if not self._has_db_default(field):
-            if self.RAISE_FOR_UNSAFE:
-                raise UnsafeOperationException(Unsafe.ADD_COLUMN_NOT_NULL)
-            else:
-                warnings.warn(UnsafeOperationWarning(Unsafe.ADD_COLUMN_NOT_NULL))
+            self._unsafe(Unsafe.ADD_COLUMN_NOT_NULL, model._meta.db_table)
         return "NOT NULL"
 
     def _add_column_primary_key(self, model, field):
-        self.deferred_sql.append(self.sql_create_pk % {
-            "table": self.quote_name(model._meta.db_table),
-            "name": self.quote_name(self._create_index_name(model._meta.db_table, [field.column], suffix="_pk")),
-            "columns": self.quote_name(field.column),
-        })
+        self.deferred_sql.append(Statement(
+            self.sql_create_pk,
+            table=Table(model._meta.db_table, self.quote_name),
+            name=self.quote_name(self._create_index_name(model._meta.db_table, [field.column], suffix="_pk")),
+            columns=self.quote_name(field.column),
+        ))
         return ""
 
     def _add_column_unique(self, model, field):
@@ -936,13 +2814,14 @@ class DatabaseSchemaEditorMixin:
             )
 
     def _alter_column_set_not_null(self, model, new_field):
-        self.deferred_sql.append(self._sql_column_not_null % {
-            "column": self.quote_name(new_field.column),
-            "table": self.quote_name(model._meta.db_table),
-            "name": self.quote_name(
+        self.deferred_sql.append(Statement(
+            self._sql_column_not_null,
+            column=self.quote_name(new_field.column),
+            table=Table(model._meta.db_table, self.quote_name),
+            name=self.quote_name(
                 self._create_index_name(model._meta.db_table, [new_field.column], suffix="_notnull")
             ),
-        })
+        ))
         return DUMMY_SQL, []
 
     def _alter_column_drop_not_null(self, model, new_field):
@@ -956,52 +2835,529 @@ class DatabaseSchemaEditorMixin:
         else:
             return self._alter_column_set_not_null(model, new_field)
 
-    def _immediate_type_cast(self, old_type, new_type):
-        if (
-            (old_type == new_type) or
-            (old_type == 'integer' and new_type == 'serial') or
-            (old_type == 'bigint' and new_type == 'bigserial') or
-            (old_type == 'smallint' and new_type == 'smallserial') or
-            (old_type == 'serial' and new_type == 'integer') or
-            (old_type == 'bigserial' and new_type == 'bigint') or
-            (old_type == 'smallserial' and new_type == 'smallint')
-        ):
-            return True
-        old_type_varchar_match = self._varchar_type_regexp.match(old_type)
-        if old_type_varchar_match:
-            if new_type == "text":
-                return True
-            new_type_varchar_match = self._varchar_type_regexp.match(new_type)
-            if new_type_varchar_match:
-                old_type_max_length = int(old_type_varchar_match.group("max_length"))
-                new_type_max_length = int(new_type_varchar_match.group("max_length"))
-                if new_type_max_length >= old_type_max_length:
-                    return True
-                else:
-                    return False
-        old_type_numeric_match = self._numeric_type_regexp.match(old_type)
-        if old_type_numeric_match:
-            new_type_numeric_match = self._numeric_type_regexp.match(new_type)
-            old_type_precision = int(old_type_numeric_match.group("precision"))
-            old_type_scale = int(old_type_numeric_match.group("scale"))
-            try:
-                new_type_precision = int(new_type_numeric_match.group("precision"))
-                new_type_scale = int(new_type_numeric_match.group("scale"))
-            except AttributeError:
-                return False
-            return new_type_precision >= old_type_precision and new_type_scale == old_type_scale
+    def _immediate_type_cast(self, old_type, new_type, table=None, column=None):
+        """Check that column type can be changed without table rewrite and scan.
+
+        ZERO_DOWNTIME_MIGRATIONS_SAFE_TYPE_CAST_RULES are asked in order, first rule that returns
+        True or False decides, rules return None for casts they don't know.
+        """
+        for rule in self.SAFE_TYPE_CAST_RULES:
+            safe = rule(self, old_type, new_type, table, column)
+            if safe is not None:
+                return safe
         return False
 
     def _alter_column_type_sql(self, model, old_field, new_field, new_type, old_collation, new_collation):
         old_db_params = old_field.db_parameters(connection=self.connection)
         old_type = old_db_params["type"]
-        if not self._immediate_type_cast(old_type, new_type):
-            if self.RAISE_FOR_UNSAFE:
-                raise UnsafeOperationException(Unsafe.ALTER_COLUMN_TYPE)
+        immediate_type_cast = self._immediate_type_cast(old_type, new_type, model._meta.db_table, old_field.column)
+        if (
+            not immediate_type_cast
+            and not self._is_small_table(model._meta.db_table, Unsafe.ALTER_COLUMN_TYPE)
+        ):
+            if self.SHADOW_COLUMN_TYPE_CHANGE:
+                shadow_column_info = self._get_shadow_column_info(model, old_field, new_field, old_type, new_type)
+                if shadow_column_info is not None:
+                    # original method also drops postgres specific like index for text columns
+                    fragment, other_actions = super()._alter_column_type_sql(
+                        model, old_field, new_field, new_type, old_collation, new_collation
+                    )
+                    self._alter_column_type_with_shadow_column(
+                        model, old_field, new_field, new_type, new_collation, shadow_column_info
+                    )
+                    return (DUMMY_SQL, []), other_actions
+            self._unsafe(Unsafe.ALTER_COLUMN_TYPE)
+        fragment, other_actions = super()._alter_column_type_sql(
+            model, old_field, new_field, new_type, old_collation, new_collation
+        )
+        if immediate_type_cast and self.collect_sql and self.ESTIMATE:
+            self._estimate_metadata_only_sql.add(str(self.sql_alter_column % {
+                "table": self.quote_name(model._meta.db_table),
+                "changes": fragment[0],
+            }))
+        return fragment, other_actions
+
+    def _get_shadow_column_info(self, model, old_field, new_field, old_type, new_type):
+        """Check that column type can be changed with shadow column and collect column state
+        that should be moved to shadow column: nullability, comment and indexes.
+
+        Columns that have other dependent objects (constraints, defaults, views, etc.),
+        primary keys and columns of tables without single column primary key are not supported.
+        """
+        table = model._meta.db_table
+        column = new_field.column
+        # trigger left by previous failed run is replaced with shadow column
+        trigger = self._create_index_name(table, [column], suffix="_shadow_trg")
+        auto_field_types = {"AutoField", "BigAutoField", "SmallAutoField"}
+        pk = model._meta.pk
+        reason = None
+        if {old_field.get_internal_type(), new_field.get_internal_type()} & auto_field_types:
+            reason = "identity column"
+        elif pk is None or pk.column is None or pk.column == column:
+            reason = "primary key column or table without single column primary key"
+        if reason is None:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_get_shadow_column_info, [trigger, self.quote_name(table), column])
+                row = cursor.fetchone()
+                indexes = []
+                if row is None:
+                    if not self.collect_sql:
+                        reason = "column not found"
+                    # sqlmigrate can be run before previous migrations applied, so model state is used
+                    row = (not old_field.null, None, True, True)
+                else:
+                    cursor.execute(self._sql_get_shadow_column_indexes, [self.quote_name(table), column])
+                    indexes = cursor.fetchall()
+            not_null, comment, plain_table, no_dependencies = row
+            # postgres specific like index is dropped by django before type change
+            like_index = (
+                self._create_index_name(table, [old_field.column], suffix="_like")
+                if (old_field.db_index or old_field.unique) and any(
+                    old_type.startswith(text_type) and not new_type.startswith(text_type)
+                    for text_type in ("varchar", "text", "citext")
+                ) else None
+            )
+            indexes = [index for index in indexes if index[0] != like_index]
+            if not plain_table:
+                reason = "partitioned or inherited table"
+            elif not no_dependencies:
+                reason = "column has dependent objects or privileges"
+            elif not all(rebuildable and self._indexdef_regexp.match(definition)
+                         for name, definition, quoted_column, rebuildable in indexes):
+                reason = "column is used in index expression, predicate or with custom operator class"
+        if reason is not None:
+            logger.info("column %s.%s type can't be changed with shadow column: %s", table, column, reason)
+            return None
+        return {
+            "not_null": not_null,
+            "comment": comment,
+            "indexes": [
+                (name, self._indexdef_regexp.match(definition), quoted_column)
+                for name, definition, quoted_column, rebuildable in indexes
+            ],
+        }
+
+    def _alter_column_type_with_shadow_column(self, model, old_field, new_field, new_type, new_collation, info):
+        """Change column type without table rewrite under ACCESS EXCLUSIVE lock:
+        add shadow column with new type, keep it in sync with trigger, backfill it by batches,
+        build indexes concurrently and replace original column in short metadata only transaction.
+
+        In idempotent mode column that was already swapped by previous run is skipped.
+        """
+        table = model._meta.db_table
+        if self._is_shadow_column_swapped(table, new_field.column, new_type):
+            logger.info("skip column %s.%s type change applied by previous run", table, new_field.column)
+            self.execute(Statement(
+                self._sql_drop_shadow_column_function,
+                function=self.quote_name(self._create_index_name(table, [new_field.column], suffix="_shadow_sync")),
+            ))
+            return
+        if self._field_data_type(old_field) != self._field_data_type(new_field):
+            cast = "%(column)s::" + new_type
+        else:
+            # assignment cast keeps ALTER COLUMN TYPE behaviour, eg. error for too long value instead of truncation
+            cast = "%(column)s"
+        parts, index_renames = self._prepare_shadow_column(
+            model._meta.db_table,
+            new_field.column,
+            new_type + (self._collate_sql(new_collation) if new_collation else ""),
+            cast,
+            info,
+            model._meta.pk.column,
+        )
+        swap = list(self._sql_swap_shadow_column) + index_renames
+        if info["not_null"]:
+            swap.extend(self._sql_swap_shadow_column_not_null)
+        if info["comment"] is not None:
+            swap.append(self._sql_swap_shadow_column_comment % {
+                "table": "%(table)s",
+                "column": "%(column)s",
+                "comment": self.quote_value(info["comment"]).replace("%", "%%"),
+            })
+        self.execute(Statement(
+            PGAccessExclusive(
+                "; ".join(swap),
+                idempotent_condition=Condition(self._sql_new_column_exists, True),
+            ),
+            **parts,
+        ), None)
+        self.execute(Statement(self._sql_drop_shadow_column_function, **parts))
+
+    def _prepare_shadow_column(self, table, column, definition, cast, info, pk_column):
+        """Add shadow column, keep it in sync with trigger, backfill it by batches, build indexes
+        and NOT NULL check constraint for it, so original column can be replaced by metadata only statements.
+
+        Return shadow column parts and statements that rename shadow indexes on swap.
+        In idempotent mode shadow column left by previous failed run is backfilled from first not synced row.
+        """
+        shadow_column = self._create_index_name(table, [column], suffix="_shadow")
+        parts = {
+            "table": Table(table, self.quote_name),
+            "column": self.quote_name(column),
+            "new_column": self.quote_name(shadow_column),
+            "trigger": self.quote_name(self._create_index_name(table, [column], suffix="_shadow_trg")),
+            "function": self.quote_name(self._create_index_name(table, [column], suffix="_shadow_sync")),
+            "name": self.quote_name(self._create_index_name(table, [column], suffix="_shadow_nn")),
+        }
+        resume = False
+        if self.IDEMPOTENT_SQL and not self.collect_sql:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_new_column_exists % parts)
+                resume = cursor.fetchone() is not None
+        self.execute(Statement(
+            self.sql_create_column,
+            table=parts["table"],
+            column=parts["new_column"],
+            definition=definition,
+        ))
+        self.execute(Statement(
+            self._sql_create_shadow_column_function,
+            cast=cast % {"column": "NEW." + parts["column"]},
+            **parts,
+        ))
+        self.execute(Statement(self._sql_create_shadow_column_trigger, **parts))
+        if self.collect_sql:
+            self.collected_sql.append("-- MIGRATION NOW PERFORMS OPERATION THAT CANNOT BE WRITTEN AS SQL")
+        else:
+            self._backfill_shadow_column(pk_column, cast % {"column": parts["column"]}, parts, resume)
+
+        index_renames = []
+        for name, match, quoted_column in info["indexes"]:
+            shadow_index = self.quote_name(self._create_index_name(table, [name], suffix="_shadow"))
+            using = self._rename_index_column(match.group("using"), quoted_column, parts["new_column"])
+            self.execute(Statement(
+                self._sql_create_shadow_index,
+                table=parts["table"],
+                name=shadow_index,
+                definition=f"CREATE {match.group('unique') or ''}INDEX CONCURRENTLY {shadow_index} "
+                           f"ON {match.group('table')} USING {using}",
+            ), None)
+            index_renames.append(self._sql_swap_shadow_column_rename_index % {
+                "old_name": shadow_index,
+                "new_name": self.quote_name(name),
+            })
+        if info["not_null"]:
+            self.execute(Statement(
+                self.sql_create_check,
+                table=parts["table"],
+                name=parts["name"],
+                check=f"{parts['new_column']} IS NOT NULL",
+            ))
+        return parts, index_renames
+
+    def _is_shadow_column_swapped(self, table, column, new_type):
+        if not self.IDEMPOTENT_SQL or self.collect_sql:
+            return False
+        with transaction.atomic(self.connection.alias), self.connection.cursor() as cursor:
+            cursor.execute(self._sql_create_type_probe_table % {"type": new_type})
+            cursor.execute(self._sql_shadow_column_swapped, [
+                self._create_index_name(table, [column], suffix="_shadow"),
+                self._create_index_name(table, [column], suffix="_shadow_trg"),
+                self.quote_name(table),
+                column,
+            ])
+            row = cursor.fetchone()
+            transaction.set_rollback(True, self.connection.alias)
+        return row is not None and row[0]
+
+    def _rename_index_column(self, using, column, new_column):
+        """Rename column in key and included columns lists of index definition part after USING.
+
+        Only list items that start with column name are renamed, column isn't used in expressions
+        and predicate of rebuilt index, so string literals and other names are kept as is.
+        """
+        tokens = self._indexdef_token_regexp.findall(using)
+        result = []
+        outer = ""
+        depth = 0
+        groups = 0
+        columns_list = item_start = False
+        for i, token in enumerate(tokens):
+            if token == "(":
+                if depth == 0:
+                    # key columns list follows access method, included columns list follows INCLUDE
+                    columns_list = groups == 0 or outer.rstrip().endswith(" INCLUDE")
+                    groups += 1
+                depth += 1
+                item_start = depth == 1
+            elif token == ")":
+                depth -= 1
+                item_start = False
+            elif token == ",":
+                item_start = depth == 1
+            elif depth == 0:
+                outer += token
+            elif item_start and token.strip():
+                item_start = False
+                name = token.lstrip()
+                next_token = tokens[i + 1] if i + 1 < len(tokens) else ""
+                if columns_list and next_token != "(" and (name == column or name.startswith(column + " ")):
+                    token = token[:len(token) - len(name)] + new_column + name[len(column):]
+            result.append(token)
+        return "".join(result)
+
+    def _alter_primary_key_type(self, model, new_type):
+        """Change type of single column primary key and of all foreign key columns that reference it,
+        eg. integer to bigint, without tables rewrite under ACCESS EXCLUSIVE lock.
+
+        Every column is replaced by shadow column like ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE does,
+        including primary key and unique indexes that are built concurrently, then all columns are swapped
+        in one metadata only transaction: foreign keys are dropped, identity or serial sequence is moved
+        to new primary key column with its current value, primary key and unique constraints are added
+        with USING INDEX and foreign keys are added as NOT VALID and validated after swap.
+        """
+        table = model._meta.db_table
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_primary_key_info, [self.quote_name(table)])
+            row = cursor.fetchone()
+            cursor.execute(self._sql_get_primary_key_references, [self.quote_name(table)])
+            references = cursor.fetchall()
+        if row is None:
+            if not self.collect_sql:
+                raise NotSupportedError(f"Table {table} doesn't exist or doesn't have single column primary key.")
+            # sqlmigrate can be run before previous migrations applied
+            self.collected_sql.append("-- MIGRATION NOW PERFORMS OPERATION THAT CANNOT BE WRITTEN AS SQL")
+            return
+        pk_column, pk_type, identity, sequence, default, _ = row
+        # columns to replace with their tables primary keys for keyset backfill
+        columns = [(table, pk_column, pk_column)] if pk_type != new_type else []
+        foreign_keys = []
+        for name, definition, ref_table, _, key_size, ref_column, ref_type, ref_pk in references:
+            if key_size != 1 or ref_pk is None or ref_pk == ref_column and ref_table != table:
+                raise NotSupportedError(
+                    f"Foreign key {name} of {ref_table} is multicolumn, part of primary key "
+                    f"or its table doesn't have single column primary key."
+                )
+            if ref_type != new_type and (ref_table, ref_column, ref_pk) not in columns:
+                columns.append((ref_table, ref_column, ref_pk))
+            if pk_type != new_type or ref_type != new_type:
+                foreign_keys.append((Table(ref_table, self.quote_name), self.quote_name(name), definition))
+        if not columns:
+            logger.info("primary key %s.%s and referencing columns are already %s", table, pk_column, new_type)
+            return
+        infos = [
+            self._get_primary_key_shadow_column_info(column_table, column, table)
+            for column_table, column, _ in columns
+        ]
+
+        swap = [self._sql_swap_primary_key_drop_foreign_key % {"table": ref_table, "name": name}
+                for ref_table, name, _ in foreign_keys]
+        all_parts = []
+        for (column_table, column, keyset_pk), info in zip(columns, infos):
+            parts, index_renames = self._prepare_shadow_column(
+                column_table, column, new_type, "%(column)s", info, keyset_pk,
+            )
+            all_parts.append(parts)
+            is_pk = column_table == table and column == pk_column
+            swap.append(self._sql_swap_shadow_column[0] % parts)
+            sequence_parts = {
+                **parts,
+                "sequence": self.quote_name(sequence) if sequence else None,
+                "new_sequence": self.quote_name(self._create_index_name(table, [pk_column], suffix="_shadow_seq")),
+                "identity": "ALWAYS" if identity == "a" else "BY DEFAULT",
+                "default": default,
+                "type": new_type,
+            }
+            sequence_parts["new_sequence_literal"] = self.quote_value(sequence_parts["new_sequence"])
+            if is_pk:
+                # identity requires NOT NULL column, new identity sequence continues old sequence
+                swap.extend(statement % parts for statement in self._sql_swap_primary_key_not_null)
+                if identity and sequence:
+                    swap.extend(statement % sequence_parts for statement in self._sql_swap_primary_key_identity)
+                elif sequence:
+                    swap.append(self._sql_swap_primary_key_serial % sequence_parts)
+            swap.extend(statement % parts for statement in self._sql_swap_shadow_column[1:])
+            if is_pk and identity and sequence:
+                swap.append(self._sql_swap_primary_key_identity_rename % sequence_parts)
+            elif is_pk and sequence:
+                swap.extend(statement % sequence_parts for statement in self._sql_swap_primary_key_serial_default)
+            swap.extend(index_renames)
+            if info["not_null"] and not is_pk:
+                swap.extend(statement % parts for statement in self._sql_swap_shadow_column_not_null)
+            for index_name, (name, constraint_type, deferrable) in info["constraints"].items():
+                swap.append(self._sql_swap_shadow_column_constraint % {
+                    "table": parts["table"],
+                    "name": self.quote_name(name),
+                    "type": constraint_type,
+                    "index": self.quote_name(index_name),
+                    "deferrable": deferrable,
+                })
+            if info["comment"] is not None:
+                swap.append(self._sql_swap_shadow_column_comment % {
+                    **parts, "comment": self.quote_value(info["comment"]),
+                })
+        swap.extend(
+            self._sql_swap_primary_key_add_foreign_key % {"table": ref_table, "name": name, "definition": definition}
+            for ref_table, name, definition in foreign_keys
+        )
+        self.execute(Statement(
+            PGAccessExclusive(
+                "; ".join(swap).replace("%", "%%"),
+                idempotent_condition=Condition(self._sql_new_column_exists, True),
+            ),
+            **all_parts[0],
+        ), None)
+        for ref_table, name, _ in foreign_keys:
+            self.execute(Statement(self._sql_validate_constraint, table=ref_table, name=name))
+        for parts in all_parts:
+            self.execute(Statement(self._sql_drop_shadow_column_function, **parts))
+
+    def _get_primary_key_shadow_column_info(self, table, column, referenced_table):
+        trigger = self._create_index_name(table, [column], suffix="_shadow_trg")
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_shadow_column_info, [trigger, self.quote_name(table), column])
+            not_null, comment, plain_table, _ = cursor.fetchone()
+            cursor.execute(self._sql_get_shadow_column_indexes, [self.quote_name(table), column])
+            indexes = cursor.fetchall()
+            cursor.execute(self._sql_get_primary_key_column_constraints, [
+                self.quote_name(referenced_table), self.quote_name(table), column,
+            ])
+            constraints = cursor.fetchall()
+        if not plain_table:
+            raise NotSupportedError(f"Column {table}.{column} of partitioned or inherited table isn't supported.")
+        if not all(rebuildable and self._indexdef_regexp.match(definition)
+                   for name, definition, quoted_column, rebuildable in indexes):
+            raise NotSupportedError(
+                f"Column {table}.{column} is used in index expression, predicate or with custom operator class."
+            )
+        constraint_types = {"p": "PRIMARY KEY", "u": "UNIQUE"}
+        for name, contype, index_name, deferrable, deferred, references_table in constraints:
+            if contype not in constraint_types and not (contype == "f" and references_table):
+                raise NotSupportedError(f"Column {table}.{column} is used in constraint {name}.")
+        return {
+            "not_null": not_null,
+            "comment": comment,
+            "indexes": [
+                (name, self._indexdef_regexp.match(definition), quoted_column)
+                for name, definition, quoted_column, rebuildable in indexes
+            ],
+            "constraints": {
+                index_name: (
+                    name,
+                    constraint_types[contype],
+                    (" DEFERRABLE INITIALLY DEFERRED" if deferred else " DEFERRABLE") if deferrable else "",
+                )
+                for name, contype, index_name, deferrable, deferred, references_table in constraints
+                if contype in constraint_types
+            },
+        }
+
+    def _backfill_shadow_column(self, pk_column, cast, parts, resume=False):
+        first_pk = None
+        if resume:
+            # rows after first not synced row can be synced by trigger, so max synced pk can't be used
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_get_shadow_column_backfill_start % {
+                    **parts,
+                    "pk": self.quote_name(pk_column),
+                })
+                first_pk = cursor.fetchone()[0]
+            if first_pk is None:
+                logger.info("skip backfill of %s.%s synced by previous run", parts["table"], parts["new_column"])
+                return
+        self._backfill_by_primary_key(pk_column, self._sql_backfill_shadow_column, {
+            **parts,
+            "column": parts["new_column"],
+            "old_column": parts["column"],
+            "cast": cast,
+        }, first_pk)
+
+    def _backfill_null_column(self, model, field, value, batch_size=None, sleep=None):
+        """Fill NULL values of column with value or expression supported by QuerySet.update, used by BackfillField."""
+        query = UpdateQuery(model)
+        compiler = query.get_compiler(connection=self.connection)
+        if hasattr(value, "resolve_expression"):
+            value_sql, value_params = compiler.compile(
+                value.resolve_expression(query, allow_joins=False, for_save=True)
+            )
+        else:
+            value_sql, value_params = "%s", [field.get_db_prep_save(value, connection=self.connection)]
+        parts = {
+            "table": Table(model._meta.db_table, self.quote_name),
+            "column": self.quote_name(field.column),
+            "pk": self.quote_name(model._meta.pk.column),
+        }
+        # rows before first NULL value are skipped, so rerun of failed migration doesn't scan them again
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._sql_get_null_column_backfill_start % parts)
+            first_pk = cursor.fetchone()[0]
+        if first_pk is None:
+            return
+        self._backfill_by_primary_key(
+            model._meta.pk.column,
+            self._sql_backfill_null_column,
+            {**parts, "value": value_sql},
+            first_pk,
+            value_params,
+            batch_size,
+            sleep,
+        )
+
+    def _backfill_by_primary_key(self, pk_column, sql, parts, first_pk=None, params=(), batch_size=None, sleep=None):
+        pk = self.quote_name(pk_column)
+        batch_size = self.BACKFILL_BATCH_SIZE if batch_size is None else batch_size
+        sleep = self.BACKFILL_BATCH_SLEEP if sleep is None else sleep
+        last_pk = None
+        updated = 0
+        while True:
+            if last_pk is None:
+                where, where_params = ("", []) if first_pk is None else (f" WHERE {pk} >= %s", [first_pk])
             else:
-                warnings.warn(UnsafeOperationWarning(Unsafe.ALTER_COLUMN_TYPE))
-        return super()._alter_column_type_sql(model, old_field, new_field, new_type, old_collation, new_collation)
+                where, where_params = (f" WHERE {pk} > %s", [last_pk])
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._sql_get_backfill_batch_end % {
+                    "table": parts["table"],
+                    "pk": pk,
+                    "where": where,
+                    "limit": int(batch_size),
+                }, where_params)
+                batch_end = cursor.fetchone()[0]
+                if batch_end is None:
+                    break
+                # migration connection is in autocommit mode, so each batch update is committed separately
+                cursor.execute(sql % {
+                    **parts,
+                    "pk": pk,
+                    "where": where.replace(" WHERE ", " AND "),
+                }, [*params, batch_end, *where_params])
+                updated += cursor.rowcount
+            last_pk = batch_end
+            logger.info(
+                "backfill %s.%s: %s rows updated, last pk %s",
+                parts["table"], parts["column"], updated, last_pk,
+            )
+            if sleep:
+                time.sleep(sleep)
 
 
 class DatabaseSchemaEditor(DatabaseSchemaEditorMixin, PostgresDatabaseSchemaEditor):
     pass
+
+
+_cleared_journal_plan = None
+
+
+def clear_migrations_journal(sender, using, plan=None, **kwargs):
+    """Clear ZERO_DOWNTIME_MIGRATIONS_JOURNAL of migrations applied or unapplied by migrate command,
+    as migration with deferred sql and unapplied migration are recorded after schema editor exit.
+
+    Signal is sent for each application with same plan, so journal is cleared once per plan.
+    """
+    global _cleared_journal_plan
+    if not plan or plan is _cleared_journal_plan or not getattr(settings, "ZERO_DOWNTIME_MIGRATIONS_JOURNAL", False):
+        return
+    connection = connections[using]
+    if not issubclass(connection.SchemaEditorClass, DatabaseSchemaEditorMixin):
+        return
+    _cleared_journal_plan = plan
+    migrations = [
+        f"{migration.app_label}.{migration.name}.{'unapply' if backwards else 'apply'}"
+        for migration, backwards in plan
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(DatabaseSchemaEditorMixin._sql_journal_exists)
+        if cursor.fetchone()[0]:
+            cursor.execute(DatabaseSchemaEditorMixin._sql_clear_migrations_journal, [migrations])
+
+
+post_migrate.connect(clear_migrations_journal, dispatch_uid="django_zero_downtime_migrations.clear_journal")
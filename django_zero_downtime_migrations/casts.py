@@ -0,0 +1,192 @@
+import functools
+import inspect
+import re
+
+from django.utils.module_loading import import_string
+
+_serial_aliases = {
+    ("integer", "serial"),
+    ("bigint", "bigserial"),
+    ("smallint", "smallserial"),
+    ("serial", "integer"),
+    ("bigserial", "bigint"),
+    ("smallserial", "smallint"),
+}
+_varchar_type_regexp = re.compile(r'^(varchar|character varying)(\((?P<max_length>\d+)\))?$')
+_numeric_type_regexp = re.compile(r'^(numeric|decimal)(\((?P<precision>\d+)(, *(?P<scale>\d+))?\))?$')
+_datetime_type_regexp = re.compile(
+    r'^(?P<type>timestamp|interval)(\((?P<precision>\d)\))?(?P<time_zone> with(out)? time zone)?$'
+)
+_utc_time_zones = {"UTC", "Etc/UTC", "UCT", "Etc/UCT", "GMT", "Etc/GMT", "Zulu", "Etc/Zulu", "Universal"}
+
+_sql_get_time_zone = "SELECT current_setting('TimeZone')"
+# binary coercible casts don't rewrite table, but indexes are rebuilt if operator family is changed
+_sql_get_binary_coercible_cast = r"""
+    SELECT
+        EXISTS (
+            SELECT 1 FROM pg_cast
+            WHERE castsource = to_regtype(%s) AND casttarget = to_regtype(%s) AND castmethod = 'b'
+        ),
+        EXISTS (
+            SELECT 1
+            FROM pg_index AS i
+            JOIN pg_attribute AS a ON a.attrelid = i.indrelid
+            WHERE i.indrelid = to_regclass(%s)
+            AND a.attname = %s
+            AND (
+                a.attnum = ANY(i.indkey)
+                OR COALESCE(i.indexprs::text, '') || COALESCE(i.indpred::text, '') ~ (':varattno ' || a.attnum || '\y')
+            )
+        )
+"""
+# domain is relabeled to its base type and base type to domain without constraints without table scan
+_sql_get_unconstrained_domain_cast = """
+    SELECT 1
+    FROM pg_type AS d
+    WHERE d.typtype = 'd'
+    AND (
+        d.oid = to_regtype(%s) AND d.typbasetype = to_regtype(%s) AND d.typtypmod = -1
+        AND NOT d.typnotnull
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE contypid = d.oid)
+        OR d.oid = to_regtype(%s) AND d.typbasetype = to_regtype(%s)
+    )
+"""
+
+
+def load_rule(rule):
+    """Get rule callable from ZERO_DOWNTIME_MIGRATIONS_SAFE_TYPE_CAST_RULES item.
+
+    Item can be callable or import path to callable or to class that is instantiated without arguments.
+    """
+    if isinstance(rule, str):
+        return _import_rule(rule)
+    return rule
+
+
+@functools.lru_cache(maxsize=None)
+def _import_rule(path):
+    rule = import_string(path)
+    if inspect.isclass(rule):
+        rule = rule()
+    return rule
+
+
+def same_type(editor, old_type, new_type, table, column):
+    if old_type == new_type:
+        return True
+    return None
+
+
+def serial_alias(editor, old_type, new_type, table, column):
+    if (old_type, new_type) in _serial_aliases:
+        return True
+    return None
+
+
+def varchar_length(editor, old_type, new_type, table, column):
+    """Increase of varchar length limit or removing it."""
+    old_type_match = _varchar_type_regexp.match(old_type)
+    if not old_type_match:
+        return None
+    if new_type == "text":
+        return True
+    new_type_match = _varchar_type_regexp.match(new_type)
+    if not new_type_match:
+        return None
+    if new_type_match.group("max_length") is None:
+        return True
+    if old_type_match.group("max_length") is None:
+        return False
+    return int(new_type_match.group("max_length")) >= int(old_type_match.group("max_length"))
+
+
+def numeric_precision(editor, old_type, new_type, table, column):
+    """Increase of numeric precision with same scale or removing precision and scale."""
+    old_type_match = _numeric_type_regexp.match(old_type)
+    if not old_type_match:
+        return None
+    new_type_match = _numeric_type_regexp.match(new_type)
+    if not new_type_match:
+        return None
+    if new_type_match.group("precision") is None:
+        return True
+    if old_type_match.group("precision") is None:
+        return False
+    return (
+        int(new_type_match.group("precision")) >= int(old_type_match.group("precision"))
+        and int(new_type_match.group("scale") or 0) == int(old_type_match.group("scale") or 0)
+    )
+
+
+def datetime_precision(editor, old_type, new_type, table, column):
+    """Increase of timestamp, timestamp with time zone or interval fractional seconds precision."""
+    old_type_match = _datetime_type_regexp.match(old_type)
+    new_type_match = _datetime_type_regexp.match(new_type)
+    if not old_type_match or not new_type_match:
+        return None
+    if old_type_match.group("type", "time_zone") != new_type_match.group("type", "time_zone"):
+        return None
+    # default precision is maximal precision
+    return int(new_type_match.group("precision") or 6) >= int(old_type_match.group("precision") or 6)
+
+
+def timestamp_time_zone(editor, old_type, new_type, table, column):
+    """Change between timestamp and timestamp with time zone for postgres 12+ when session time zone is UTC.
+
+    Time zone is checked for migration connection, so `sqlmigrate` output is safe only for sessions in UTC.
+    """
+    old_type_match = _datetime_type_regexp.match(old_type)
+    new_type_match = _datetime_type_regexp.match(new_type)
+    if (
+        editor.connection.pg_version < 120000
+        or not old_type_match or not new_type_match
+        or old_type_match.group("type") != "timestamp" or new_type_match.group("type") != "timestamp"
+        or old_type_match.group("precision") != new_type_match.group("precision")
+        or (old_type_match.group("time_zone") == " with time zone")
+        == (new_type_match.group("time_zone") == " with time zone")
+    ):
+        return None
+    with editor.connection.cursor() as cursor:
+        cursor.execute(_sql_get_time_zone)
+        if cursor.fetchone()[0] in _utc_time_zones:
+            return True
+    return None
+
+
+def binary_coercible(editor, old_type, new_type, table, column):
+    """Binary coercible cast from `pg_cast` to type without modifier for column without indexes,
+    eg. text to varchar, cidr to inet or types added by extensions.
+    """
+    if "(" in new_type:
+        return None
+    with editor.connection.cursor() as cursor:
+        cursor.execute(_sql_get_binary_coercible_cast, [
+            old_type, new_type, editor.quote_name(table) if table else None, column,
+        ])
+        binary, indexed = cursor.fetchone()
+    if binary and not indexed:
+        return True
+    return None
+
+
+def unconstrained_domain(editor, old_type, new_type, table, column):
+    """Change from base type to domain without constraints over it or from domain to its base type."""
+    if "(" in new_type:
+        return None
+    with editor.connection.cursor() as cursor:
+        cursor.execute(_sql_get_unconstrained_domain_cast, [new_type, old_type, old_type, new_type])
+        if cursor.fetchone() is not None:
+            return True
+    return None
+
+
+DEFAULT_SAFE_TYPE_CAST_RULES = [
+    same_type,
+    serial_alias,
+    varchar_length,
+    numeric_precision,
+    datetime_precision,
+    timestamp_time_zone,
+    binary_coercible,
+    unconstrained_domain,
+]
@@ -0,0 +1,57 @@
+import functools
+import inspect
+import json
+import logging
+import threading
+
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def load_sink(sink):
+    """Get sink callable from ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS item.
+
+    Item can be callable, import path to callable or to class that is instantiated without arguments
+    or `(path, kwargs)` tuple with import path to class that is instantiated with keyword arguments.
+    """
+    if isinstance(sink, str):
+        return _import_sink(sink)
+    if isinstance(sink, tuple):
+        path, kwargs = sink
+        return _import_sink(path, tuple(sorted(kwargs.items())))
+    return sink
+
+
+@functools.lru_cache(maxsize=None)
+def _import_sink(path, kwargs=None):
+    # sink is shared by all schema editors, so stateful sinks accumulate events of whole migrate run
+    sink = import_string(path)
+    if kwargs is not None:
+        return sink(**dict(kwargs))
+    if inspect.isclass(sink):
+        sink = sink()
+    return sink
+
+
+class LoggingSink:
+    """Log each event as json to django_zero_downtime_migrations.events logger."""
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def __call__(self, event):
+        logger.log(self.level, "%s", json.dumps(event, default=str))
+
+
+class JSONLinesSink:
+    """Append each event as json line to file, sink can be shared by deferred sql workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
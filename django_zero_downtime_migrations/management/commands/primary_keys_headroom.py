@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from django_zero_downtime_migrations.backends.postgres.schema import (
+    DatabaseSchemaEditorMixin
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "List integer primary keys and foreign keys that reference them with values left "
+        "until integer overflow, so they can be converted to bigint with ConvertPrimaryKeyToBigInt in time."
+    )
+
+    max_values = {
+        "smallint": 2 ** 15 - 1,
+        "integer": 2 ** 31 - 1,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to scan. Defaults to the "default" database.',
+        )
+        parser.add_argument(
+            "--threshold", type=float, default=0,
+            help="List only keys that used at least this percent of their type range.",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        with connection.schema_editor(atomic=False) as editor:
+            if not isinstance(editor, DatabaseSchemaEditorMixin):
+                raise CommandError(
+                    f"Database {options['database']} doesn't use django_zero_downtime_migrations backend."
+                )
+            with connection.cursor() as cursor:
+                cursor.execute(editor._sql_get_integer_keys)
+                keys = cursor.fetchall()
+                # foreign keys share value of primary key they reference
+                values = {}
+                for _, _, _, table, column, sequence in keys:
+                    if (table, column) in values:
+                        continue
+                    cursor.execute(editor._sql_get_key_value % {
+                        "table": table,
+                        "column": editor.quote_name(column),
+                        "sequence_value": editor._sql_sequence_last_value % {
+                            "sequence": editor.quote_value(sequence),
+                        } if sequence else "NULL",
+                    })
+                    values[table, column] = cursor.fetchone()[0] or 0
+
+        rows = []
+        for table, column, data_type, ref_table, ref_column, _ in keys:
+            value = values[ref_table, ref_column]
+            max_value = self.max_values[data_type]
+            percent = 100 * value / max_value
+            if percent >= options["threshold"]:
+                rows.append((percent, table, column, data_type, value, max_value, ref_table, ref_column))
+        if not rows:
+            self.stdout.write("No integer keys found.")
+            return
+        for percent, table, column, data_type, value, max_value, ref_table, ref_column in sorted(
+            rows, key=lambda row: (-row[0], row[1], row[2]),
+        ):
+            reference = "" if (table, column) == (ref_table, ref_column) else f" references {ref_table}.{ref_column}"
+            self.stdout.write(
+                f"{table}.{column} {data_type}{reference}: {value} of {max_value} used ({percent:.2f}%), "
+                f"{max_value - value} left"
+            )
@@ -0,0 +1,121 @@
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.ddl_references import Statement, Table
+from django.db.migrations import operations
+from django.db.migrations.loader import MigrationLoader
+
+from django_zero_downtime_migrations.backends.postgres.schema import (
+    DatabaseSchemaEditorMixin
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Find invalid indexes left by failed or cancelled concurrent index builds, "
+        "map them to models and migrations and rebuild or drop them concurrently."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to sweep. Defaults to the "default" database.',
+        )
+        parser.add_argument(
+            "--action", choices=["auto", "rebuild", "drop"], default="auto",
+            help="Rebuild or drop invalid indexes, auto drops REINDEX CONCURRENTLY leftovers and rebuilds others.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=1,
+            help="Maximum number of indexes of different tables processed in parallel.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Report invalid indexes and planned actions without changes.",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        with connection.schema_editor() as editor:
+            if not isinstance(editor, DatabaseSchemaEditorMixin):
+                raise CommandError(
+                    f"Database {options['database']} doesn't use django_zero_downtime_migrations backend."
+                )
+            with connection.cursor() as cursor:
+                cursor.execute(editor._sql_get_invalid_indexes)
+                indexes = cursor.fetchall()
+            if not indexes:
+                self.stdout.write("No invalid indexes found.")
+                return
+            owners = self._get_index_owners(editor, connection)
+            statements = []
+            for relname, name, table, size, definition in indexes:
+                action = options["action"]
+                if action == "auto":
+                    action = "drop" if editor._reindex_leftover_regexp.search(relname) else "rebuild"
+                self.stdout.write(
+                    f"{'Would ' + action if options['dry_run'] else action.capitalize()} {name} on {table} "
+                    f"({size}): {', '.join(owners.get(relname, ['unknown']))}\n  {definition}"
+                )
+                statements.append(Statement(
+                    editor._sql_rebuild_index if action == "rebuild" else editor.sql_delete_index,
+                    table=Table(table, editor.quote_name),
+                    name=name,
+                ))
+            if options["dry_run"]:
+                return
+            # statements for different tables don't take conflicting locks, so they are run in parallel
+            # by deferred sql scheduler, statements for same table are run one by one
+            editor.DEFERRED_SQL_WORKERS = options["workers"]
+            editor._execute_deferred_sql(statements)
+        self.stdout.write(f"Processed {len(statements)} invalid indexes.")
+
+    def _get_index_owners(self, editor, connection):
+        """Map index names to models fields, indexes and constraints and to migrations that create them."""
+        migrations = defaultdict(list)
+        loader = MigrationLoader(connection, ignore_no_migrations=True)
+        for (app_label, migration_name), migration in sorted(loader.disk_migrations.items()):
+            label = f"migration {app_label}.{migration_name}"
+            for operation in migration.operations:
+                if isinstance(operation, operations.CreateModel):
+                    model_name = operation.name_lower
+                    for field_name, _ in operation.fields:
+                        migrations[app_label, model_name, field_name].append(label)
+                    for obj in operation.options.get("indexes", []) + operation.options.get("constraints", []):
+                        migrations[obj.name].append(label)
+                elif isinstance(operation, (operations.AddField, operations.AlterField)):
+                    migrations[app_label, operation.model_name_lower, operation.name].append(label)
+                elif isinstance(operation, operations.AddIndex):
+                    migrations[operation.index.name].append(label)
+                elif isinstance(operation, operations.AddConstraint):
+                    migrations[operation.constraint.name].append(label)
+                elif isinstance(operation, operations.RenameIndex):
+                    migrations[operation.new_name].append(label)
+
+        owners = defaultdict(list)
+        for model in apps.get_models(include_auto_created=True):
+            meta = model._meta
+            for obj in meta.indexes + meta.constraints:
+                owners[obj.name].append(f"{meta.label} {obj.name}")
+                owners[obj.name].extend(migrations[obj.name])
+            for field in meta.local_fields:
+                if not (field.db_index or field.unique):
+                    continue
+                names = [editor._create_index_name(meta.db_table, [field.column], suffix="_like")]
+                if field.primary_key:
+                    names += [f"{meta.db_table}_pkey", editor._create_index_name(meta.db_table, [field.column], "_pk")]
+                elif field.unique:
+                    names.append(editor._create_index_name(meta.db_table, [field.column], suffix="_uniq"))
+                else:
+                    names.append(editor._create_index_name(meta.db_table, [field.column], suffix=""))
+                for name in names:
+                    owners[name].append(f"{meta.label}.{field.name}")
+                    owners[name].extend(migrations[meta.app_label, meta.model_name, field.name])
+            for fields in meta.unique_together:
+                columns = [meta.get_field(field).column for field in fields]
+                owners[editor._create_index_name(meta.db_table, columns, suffix="_uniq")].append(
+                    f"{meta.label} unique_together {', '.join(fields)}"
+                )
+        return owners
@@ -0,0 +1,145 @@
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class OpenMetricsSink:
+    """Aggregate schema editor statement events to counters and histograms.
+
+    Metrics are written to textfile for node-exporter textfile collector after each event
+    and/or served on http port while migrations are running.
+    """
+
+    OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+    TEXT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    metrics = {
+        "statement_duration_seconds": ("histogram", "Migration statement duration by lock class."),
+        "statement_lock_wait_seconds": ("histogram", "Migration statement lock wait duration by lock class."),
+        "statement_errors": ("counter", "Failed migration statements by lock class."),
+        "lock_timeouts": ("counter", "Migration statement attempts failed by lock timeout by lock class."),
+        "lock_retries": ("counter", "Migration statement retries after lock timeout by lock class."),
+        "skipped_statements": ("counter", "Migration statements skipped in idempotent mode by lock class."),
+        "index_build_duration_seconds": ("histogram", "Index build and rebuild duration by table."),
+    }
+    buckets = (0.01, 0.1, 1, 10, 60, 300, 1800, 3600)
+
+    _index_regexp = re.compile(r"^\s*(CREATE (UNIQUE )?INDEX|REINDEX)\b", re.IGNORECASE)
+
+    def __init__(self, textfile=None, port=None, addr="127.0.0.1", prefix="zero_downtime_migrations", buckets=None):
+        self.textfile = textfile
+        self.port = port
+        self.addr = addr
+        self.prefix = prefix
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self._values = {name: {} for name in self.metrics}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __call__(self, event):
+        if event["event"] != "statement":
+            return
+        labels = (("database", event["database"]), ("lock", event["lock"] or "unknown"))
+        with self._lock:
+            if event["skipped"]:
+                self._inc("skipped_statements", labels)
+            else:
+                self._observe("statement_duration_seconds", labels, event["duration"])
+                self._observe("statement_lock_wait_seconds", labels, event["lock_wait"])
+                self._inc("statement_errors", labels, int(event["error"] is not None))
+                self._inc("lock_timeouts", labels, event["lock_timeouts"])
+                self._inc("lock_retries", labels, event["retries"])
+                if self._index_regexp.match(event["sql"]):
+                    for table in event["tables"] or ["unknown"]:
+                        table_labels = (("database", event["database"]), ("table", table))
+                        self._observe("index_build_duration_seconds", table_labels, event["duration"])
+            if self.port is not None and self._server is None:
+                # server started by first event, not by settings import in every process
+                self._start_server()
+            if self.textfile is not None:
+                self._write_textfile(self.render())
+
+    def _inc(self, name, labels, value=1):
+        values = self._values[name]
+        values[labels] = values.get(labels, 0) + value
+
+    def _observe(self, name, labels, value):
+        values = self._values[name]
+        if labels not in values:
+            values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts, _, _ = histogram = values[labels]
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                counts[i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def render(self, openmetrics=False):
+        """Render metrics in prometheus text format or in OpenMetrics text format."""
+        lines = []
+        for name, (kind, description) in self.metrics.items():
+            family = f"{self.prefix}_{name}"
+            # prometheus text format has no counter families, so counter is described by sample name
+            family_name = f"{family}_total" if kind == "counter" and not openmetrics else family
+            lines.append(f"# HELP {family_name} {description}")
+            lines.append(f"# TYPE {family_name} {kind}")
+            for labels, value in sorted(self._values[name].items()):
+                if kind == "counter":
+                    lines.append(f"{family}_total{self._format_labels(labels)} {self._format_value(value)}")
+                    continue
+                counts, total, count = value
+                for le, bucket_count in zip(self.buckets, counts):
+                    bucket_labels = labels + (("le", self._format_value(float(le))),)
+                    lines.append(f"{family}_bucket{self._format_labels(bucket_labels)} {bucket_count}")
+                lines.append(f"{family}_bucket{self._format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{family}_sum{self._format_labels(labels)} {self._format_value(total)}")
+                lines.append(f"{family}_count{self._format_labels(labels)} {count}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def _format_labels(self, labels):
+        return "{" + ",".join(
+            '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+            for name, value in labels
+        ) + "}"
+
+    def _format_value(self, value):
+        return repr(value)
+
+    def _write_textfile(self, text):
+        # textfile collector can read file at any moment, so file is replaced atomically
+        tmp = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.textfile)
+
+    def _start_server(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                with sink._lock:
+                    body = sink.render(openmetrics).encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", sink.OPENMETRICS_CONTENT_TYPE if openmetrics else sink.TEXT_CONTENT_TYPE,
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.addr, self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
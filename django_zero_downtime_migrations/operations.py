@@ -0,0 +1,163 @@
+import logging
+import time
+
+from django.db import models
+from django.db.migrations.operations.fields import FieldOperation
+from django.db.migrations.operations.models import ModelOperation
+
+from django_zero_downtime_migrations.backends.postgres.schema import (
+    DatabaseSchemaEditorMixin
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillField(FieldOperation):
+    """Fill NULL values of nullable column by batches and set NOT NULL.
+
+    Batches are selected by primary key keyset pagination and every batch is committed separately,
+    so no long transactions hold row locks and rerun of failed migration continues with rows
+    that are still NULL. After backfill column is altered to NOT NULL with the same
+    CHECK NOT VALID, VALIDATE, SET NOT NULL statements as AlterField.
+
+    With django_zero_downtime_migrations backend backfill is done by schema editor the same way
+    as other backfills, other backends use QuerySet.update by batches.
+    """
+
+    def __init__(self, model_name, name, value, batch_size=1000, sleep=0):
+        self.value = value
+        self.batch_size = batch_size
+        self.sleep = sleep
+        super().__init__(model_name, name)
+
+    def deconstruct(self):
+        kwargs = {
+            "model_name": self.model_name,
+            "name": self.name,
+            "value": self.value,
+        }
+        if self.batch_size != 1000:
+            kwargs["batch_size"] = self.batch_size
+        if self.sleep != 0:
+            kwargs["sleep"] = self.sleep
+        return self.__class__.__name__, [], kwargs
+
+    def state_forwards(self, app_label, state):
+        field = state.models[app_label, self.model_name_lower].fields[self.name].clone()
+        field.null = False
+        state.alter_field(app_label, self.model_name_lower, self.name, field, True)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            from_model = from_state.apps.get_model(app_label, self.model_name)
+            from_field = from_model._meta.get_field(self.name)
+            to_field = to_model._meta.get_field(self.name)
+            if schema_editor.collect_sql:
+                schema_editor.collected_sql.append("-- MIGRATION NOW PERFORMS OPERATION THAT CANNOT BE WRITTEN AS SQL")
+            else:
+                self._backfill(schema_editor, from_model, from_field)
+            schema_editor.alter_field(from_model, from_field, to_field)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            from_model = from_state.apps.get_model(app_label, self.model_name)
+            from_field = from_model._meta.get_field(self.name)
+            to_field = to_model._meta.get_field(self.name)
+            schema_editor.alter_field(from_model, from_field, to_field)
+
+    def _backfill(self, schema_editor, model, field):
+        if isinstance(schema_editor, DatabaseSchemaEditorMixin):
+            schema_editor._backfill_null_column(model, field, self.value, self.batch_size, self.sleep)
+            return
+        using = schema_editor.connection.alias
+        nulls = model._base_manager.db_manager(using).filter(**{f"{field.attname}__isnull": True})
+        last_pk = None
+        updated = 0
+        while True:
+            batch = nulls if last_pk is None else nulls.filter(pk__gt=last_pk)
+            pks = list(batch.order_by("pk").values_list("pk", flat=True)[:self.batch_size])
+            if not pks:
+                break
+            # migration connection is in autocommit mode, so each batch update is committed separately
+            updated += nulls.filter(pk__gte=pks[0], pk__lte=pks[-1]).update(**{field.attname: self.value})
+            last_pk = pks[-1]
+            logger.info(
+                "backfill %s.%s: %s rows updated, last pk %s",
+                model._meta.db_table, field.column, updated, last_pk,
+            )
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def describe(self):
+        return f"Backfill {self.name} on {self.model_name} and set NOT NULL"
+
+    @property
+    def migration_name_fragment(self):
+        return f"backfill_{self.model_name_lower}_{self.name_lower}"
+
+
+class ConvertPrimaryKeyToBigInt(ModelOperation):
+    """Change integer primary key to bigint together with foreign key columns that reference it.
+
+    With django_zero_downtime_migrations backend every column is replaced by bigint shadow column
+    that is synced by trigger and backfilled by batches, unique and other indexes are built concurrently
+    and columns are swapped in one short transaction, see ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SIZE
+    and ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SLEEP for backfill settings.
+    Other backends alter primary key field as AlterField does.
+
+    Only AutoField, SmallAutoField, IntegerField and SmallIntegerField primary keys are supported,
+    eg. primary key that is foreign key (multi-table inheritance) is rejected.
+    """
+
+    big_field_classes = {
+        models.AutoField: models.BigAutoField,
+        models.SmallAutoField: models.BigAutoField,
+        models.IntegerField: models.BigIntegerField,
+        models.SmallIntegerField: models.BigIntegerField,
+    }
+
+    def deconstruct(self):
+        return self.__class__.__name__, [], {"name": self.name}
+
+    def state_forwards(self, app_label, state):
+        model_state = state.models[app_label, self.name_lower]
+        name, field = next((name, field) for name, field in model_state.fields.items() if field.primary_key)
+        field_class = self.big_field_classes.get(type(field))
+        if field_class is None:
+            raise ValueError(
+                f"ConvertPrimaryKeyToBigInt doesn't support {type(field).__name__} primary key "
+                f"{app_label}.{model_state.name}.{name}, only "
+                f"{', '.join(field_class.__name__ for field_class in self.big_field_classes)} are supported."
+            )
+        _, _, args, kwargs = field.deconstruct()
+        # foreign keys column types are derived from primary key, so related models are reloaded
+        state.alter_field(app_label, self.name_lower, name, field_class(*args, **kwargs), False)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        to_model = to_state.apps.get_model(app_label, self.name)
+        if self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            from_model = from_state.apps.get_model(app_label, self.name)
+            self._alter_primary_key(schema_editor, from_model, to_model)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self.database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def _alter_primary_key(self, schema_editor, from_model, to_model):
+        from django_zero_downtime_migrations.backends.postgres.schema import (
+            DatabaseSchemaEditorMixin
+        )
+
+        if isinstance(schema_editor, DatabaseSchemaEditorMixin):
+            new_type = to_model._meta.pk.db_parameters(connection=schema_editor.connection)["type"]
+            schema_editor._alter_primary_key_type(to_model, new_type)
+        else:
+            schema_editor.alter_field(from_model, from_model._meta.pk, to_model._meta.pk)
+
+    def describe(self):
+        return f"Convert primary key of {self.name} and referencing foreign keys to bigint"
+
+    @property
+    def migration_name_fragment(self):
+        return f"convert_{self.name_lower}_primary_key_to_bigint"
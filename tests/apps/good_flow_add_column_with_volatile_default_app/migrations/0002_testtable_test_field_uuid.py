@@ -0,0 +1,19 @@
+import django.contrib.postgres.functions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("good_flow_add_column_with_volatile_default_app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testtable",
+            name="test_field_uuid",
+            field=models.UUIDField(db_default=django.contrib.postgres.functions.RandomUUID()),
+        ),
+    ]
@@ -0,0 +1,7 @@
+from django.contrib.postgres.functions import RandomUUID
+from django.db import models
+
+
+class TestTable(models.Model):
+    test_field_int = models.IntegerField()
+    test_field_uuid = models.UUIDField(db_default=RandomUUID())
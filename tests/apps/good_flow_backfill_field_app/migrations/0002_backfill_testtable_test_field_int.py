@@ -0,0 +1,21 @@
+from django.db import migrations
+
+from django_zero_downtime_migrations.operations import BackfillField
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("good_flow_backfill_field_app", "0001_initial"),
+    ]
+
+    operations = [
+        BackfillField(
+            model_name="testtable",
+            name="test_field_int",
+            value=42,
+            batch_size=2,
+        ),
+    ]
@@ -0,0 +1,5 @@
+from django.db import models
+
+
+class TestTable(models.Model):
+    test_field_int = models.IntegerField()
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+from django_zero_downtime_migrations.operations import (
+    ConvertPrimaryKeyToBigInt
+)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("good_flow_bigint_primary_key_app", "0001_initial"),
+    ]
+
+    operations = [
+        ConvertPrimaryKeyToBigInt(name="testtable"),
+    ]
@@ -0,0 +1,11 @@
+from django.db import models
+
+
+class TestTable(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    test_field = models.IntegerField(null=True)
+
+
+class RelatedTable(models.Model):
+    test_table = models.ForeignKey(TestTable, on_delete=models.CASCADE)
+    test_table_one = models.OneToOneField(TestTable, null=True, on_delete=models.CASCADE, related_name="+")
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("good_flow_shadow_column_type_change_app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="testtable",
+            name="test_field_int",
+            field=models.BigIntegerField(db_index=True, db_comment="test comment"),
+        ),
+        migrations.AlterField(
+            model_name="testtable",
+            name="test_field_str",
+            field=models.CharField(max_length=20, null=True),
+        ),
+    ]
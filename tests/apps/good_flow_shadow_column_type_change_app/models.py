@@ -0,0 +1,6 @@
+from django.db import models
+
+
+class TestTable(models.Model):
+    test_field_int = models.BigIntegerField(db_index=True, db_comment="test comment")
+    test_field_str = models.CharField(max_length=20, null=True)
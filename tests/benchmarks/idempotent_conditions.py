@@ -0,0 +1,97 @@
+"""
+Compare idempotent conditions latency for information_schema and pg_catalog based queries.
+
+Benchmark creates many tables in separate schema to emulate big catalog, eg:
+
+    export DJANGO_SETTINGS_MODULE=tests.settings
+    python -m tests.benchmarks.idempotent_conditions --tables 10000
+"""
+import argparse
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+from django_zero_downtime_migrations.backends.postgres.schema import (  # noqa: E402
+    DatabaseSchemaEditorMixin
+)
+
+SCHEMA = 'zdm_benchmark'
+
+INFORMATION_SCHEMA_CONDITIONS = {
+    '_sql_column_exists': (
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = TRIM('\"' FROM '%(table)s') "
+        "AND column_name = TRIM('\"' FROM '%(column)s')"
+    ),
+    '_sql_identity_exists': (
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = TRIM('\"' FROM '%(table)s') "
+        "AND column_name = TRIM('\"' FROM '%(column)s')"
+        "AND is_identity = 'YES'"
+    ),
+    '_sql_constraint_exists': (
+        "SELECT 1 FROM information_schema.table_constraints "
+        "WHERE table_name = TRIM('\"' FROM '%(table)s') "
+        "AND constraint_name = TRIM('\"' FROM '%(name)s')"
+    ),
+}
+PARAMS = {
+    'table': '"tbl_0"',
+    'column': '"value"',
+    'new_column': '"value"',
+    'name': '"tbl_0_pk"',
+}
+
+
+def measure(cursor, sql, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql)
+        cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tables', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+        cursor.execute(f'SET search_path TO {SCHEMA}, public')
+        try:
+            for i in range(args.tables):
+                # each table adds table, primary key index and sequence relations to catalog
+                cursor.execute(
+                    f'CREATE TABLE tbl_{i} ('
+                    f'id integer GENERATED BY DEFAULT AS IDENTITY CONSTRAINT tbl_{i}_pk PRIMARY KEY, '
+                    f'value integer)'
+                )
+            cursor.execute('ANALYZE')
+            print(f'{"condition":<28}{"information_schema, ms":>24}{"pg_catalog, ms":>18}')
+            for name, old_sql in INFORMATION_SCHEMA_CONDITIONS.items():
+                new_sql = getattr(DatabaseSchemaEditorMixin, name)
+                old_time = measure(cursor, old_sql % PARAMS, args.repeat)
+                new_time = measure(cursor, new_sql % PARAMS, args.repeat)
+                print(f'{name:<28}{old_time:>24.3f}{new_time:>18.3f}')
+        finally:
+            # drop tables one by one to not exhaust max_locks_per_transaction
+            for i in range(args.tables):
+                cursor.execute(f'DROP TABLE IF EXISTS tbl_{i}')
+            cursor.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+            cursor.execute('RESET search_path')
+
+
+if __name__ == '__main__':
+    main()
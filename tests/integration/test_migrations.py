@@ -1,3 +1,4 @@
+import io
 import os
 import textwrap
 
@@ -10,7 +11,7 @@ from django.test import modify_settings, override_settings
 import pytest
 
 from django_zero_downtime_migrations.backends.postgres.schema import (
-    UnsafeOperationException
+    DatabaseSchemaEditorMixin, UnsafeOperationException
 )
 from tests import skip_for_default_django_backend
 from tests.integration import (
@@ -52,6 +53,25 @@ def test_good_flow():
     call_command("migrate", "good_flow_app", "zero")
 
 
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_app"})
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_good_flow_with_journal():
+    # forward
+    call_command("migrate", "good_flow_app")
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM zero_downtime_migrations_journal")
+        assert cursor.fetchone() == (0,)
+
+    # backward
+    call_command("migrate", "good_flow_app", "zero")
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM zero_downtime_migrations_journal")
+        assert cursor.fetchone() == (0,)
+        cursor.execute("DROP TABLE zero_downtime_migrations_journal")
+
+
 @pytest.mark.django_db(transaction=True)
 @modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_app_concurrently"})
 @override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
@@ -2310,3 +2330,524 @@ def test_idempotency_add_auto_field_old():
         cursor.execute(_drop_sequence_sql)
     call_command("migrate", "idempotency_add_auto_field_app", "0001")
     assert pg_dump("idempotency_add_auto_field_app_relatedtesttable") == old_schema
+
+
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_backfill_field_app"})
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
+def test_good_flow_backfill_field(mocker):
+    call_command("migrate", "good_flow_backfill_field_app", "0001")
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO "good_flow_backfill_field_app_testtable" ("test_field_int")
+            VALUES (1), (NULL), (NULL), (2), (NULL), (NULL)
+        """)
+
+    # forward
+    backfill_by_primary_key = mocker.spy(DatabaseSchemaEditorMixin, "_backfill_by_primary_key")
+    call_command("migrate", "good_flow_backfill_field_app")
+    mocker.stopall()
+    # rows before first NULL value are skipped, batch size of operation is used
+    assert [call.args[4:] for call in backfill_by_primary_key.call_args_list] == [(2, [42], 2, 0)]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT "test_field_int" FROM "good_flow_backfill_field_app_testtable" ORDER BY "id"')
+        assert cursor.fetchall() == [(1,), (42,), (42,), (2,), (42,), (42,)]
+        cursor.execute("""
+            SELECT is_nullable FROM information_schema.columns
+            WHERE table_name = 'good_flow_backfill_field_app_testtable' AND column_name = 'test_field_int'
+        """)
+        assert cursor.fetchone() == ("NO",)
+
+    # backward
+    call_command("migrate", "good_flow_backfill_field_app", "0001")
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT is_nullable FROM information_schema.columns
+            WHERE table_name = 'good_flow_backfill_field_app_testtable' AND column_name = 'test_field_int'
+        """)
+        assert cursor.fetchone() == ("YES",)
+    call_command("migrate", "good_flow_backfill_field_app", "zero")
+
+
+@skip_for_default_django_backend
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_backfill_field_app"})
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
+def test_sqlmigrate_backfill_field():
+    migration_sql = call_command("sqlmigrate", "good_flow_backfill_field_app", "0002")
+    assert split_sql_queries(migration_sql) == [
+        one_line_sql("""
+            ALTER TABLE "good_flow_backfill_field_app_testtable"
+            ADD CONSTRAINT "good_flow_backfill_fie_test_field_int_f1022048_notnull"
+            CHECK ("test_field_int" IS NOT NULL) NOT VALID;
+        """),
+        one_line_sql("""
+            ALTER TABLE "good_flow_backfill_field_app_testtable"
+            VALIDATE CONSTRAINT "good_flow_backfill_fie_test_field_int_f1022048_notnull";
+        """),
+        one_line_sql("""
+            ALTER TABLE "good_flow_backfill_field_app_testtable"
+            ALTER COLUMN "test_field_int" SET NOT NULL;
+        """),
+        one_line_sql("""
+            ALTER TABLE "good_flow_backfill_field_app_testtable"
+            DROP CONSTRAINT "good_flow_backfill_fie_test_field_int_f1022048_notnull";
+        """),
+    ]
+
+
+@skip_for_default_django_backend
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_shadow_column_type_change_app"})
+@override_settings(
+    ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+    ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE=True,
+    ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_BATCH_SIZE=2,
+)
+def test_good_flow_shadow_column_type_change(mocker):
+    table = "good_flow_shadow_column_type_change_app_testtable"
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "0001")
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO "{table}" ("test_field_int", "test_field_str")
+            VALUES (1, 10), (2, NULL), (3, 30), (4, NULL), (5, 50)
+        """)
+        # string literal equal to column name in predicate is kept by index rebuild
+        cursor.execute(
+            f'CREATE INDEX "{table}_partial" ON "{table}" ("test_field_int") WHERE "id"::text <> \'test_field_int\''
+        )
+        cursor.execute(f"SELECT indexname FROM pg_indexes WHERE tablename = '{table}' ORDER BY indexname")
+        indexes = cursor.fetchall()
+        cursor.execute(f"SELECT pg_get_indexdef('{table}_partial'::regclass)")
+        partial_indexdef = cursor.fetchone()
+
+    def get_columns():
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT column_name, data_type, is_nullable, col_description('{table}'::regclass, ordinal_position)
+                FROM information_schema.columns
+                WHERE table_name = '{table}'
+                ORDER BY column_name
+            """)
+            return cursor.fetchall()
+
+    backfill_shadow_column = DatabaseSchemaEditorMixin._backfill_shadow_column
+
+    def write_and_backfill_shadow_column(self, *args, **kwargs):
+        # rows changed after trigger creation are synced by trigger
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO "{table}" ("test_field_int", "test_field_str") VALUES (6, 60)')
+            cursor.execute(f'UPDATE "{table}" SET "test_field_int" = 10, "test_field_str" = 100 WHERE "id" = 1')
+        return backfill_shadow_column(self, *args, **kwargs)
+
+    mocker.patch.object(DatabaseSchemaEditorMixin, "_backfill_shadow_column", write_and_backfill_shadow_column)
+
+    # forward
+    call_command("migrate", "good_flow_shadow_column_type_change_app")
+    mocker.stopall()
+    assert get_columns() == [
+        ("id", "integer", "NO", None),
+        ("test_field_int", "bigint", "NO", "test comment"),
+        ("test_field_str", "character varying", "YES", None),
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT "id", "test_field_int", "test_field_str" FROM "{table}" ORDER BY "id"')
+        assert cursor.fetchall() == [
+            (1, 10, "100"), (2, 2, None), (3, 3, "30"), (4, 4, None), (5, 5, "50"), (6, 6, "60"), (7, 6, "60"),
+        ]
+        cursor.execute(f"""
+            SELECT indexname FROM pg_indexes
+            JOIN pg_index ON indexrelid = to_regclass(indexname)
+            WHERE tablename = '{table}' AND indisvalid
+            ORDER BY indexname
+        """)
+        assert cursor.fetchall() == indexes
+        cursor.execute(f"SELECT pg_get_indexdef('{table}_partial'::regclass)")
+        assert cursor.fetchone() == partial_indexdef
+        cursor.execute(f"SELECT tgname FROM pg_trigger WHERE tgrelid = '{table}'::regclass")
+        assert cursor.fetchall() == []
+        cursor.execute("SELECT proname FROM pg_proc WHERE proname LIKE '%%shadow_sync'")
+        assert cursor.fetchall() == []
+        cursor.execute(f"SELECT conname FROM pg_constraint WHERE conrelid = '{table}'::regclass AND contype = 'c'")
+        assert cursor.fetchall() == []
+
+    # backward
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "0001")
+    assert get_columns() == [
+        ("id", "integer", "NO", None),
+        ("test_field_int", "integer", "NO", "test comment"),
+        ("test_field_str", "integer", "YES", None),
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT "id", "test_field_int", "test_field_str" FROM "{table}" ORDER BY "id"')
+        assert cursor.fetchall() == [
+            (1, 10, 100), (2, 2, None), (3, 3, 30), (4, 4, None), (5, 5, 50), (6, 6, 60), (7, 6, 60),
+        ]
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "zero")
+
+
+@skip_for_default_django_backend
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_shadow_column_type_change_app"})
+@override_settings(
+    ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+    ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE=True,
+)
+def test_sqlmigrate_shadow_column_type_change():
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "0001")
+    migration_sql = call_command("sqlmigrate", "good_flow_shadow_column_type_change_app", "0002")
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "zero")
+    table = '"good_flow_shadow_column_type_change_app_testtable"'
+    int_shadow = '"good_flow_shadow_column_test_field_int_a6dc919b_shadow"'
+    int_function = '"good_flow_shadow_col_test_field_int_a6dc919b_shadow_sync"'
+    int_trigger = '"good_flow_shadow_colu_test_field_int_a6dc919b_shadow_trg"'
+    int_check = '"good_flow_shadow_colu_test_field_int_a6dc919b_shadow_nn"'
+    int_index = '"good_flow_shadow_column_good_flow_shadow_column_96e291e4_shadow"'
+    str_shadow = '"good_flow_shadow_column_test_field_str_e2c228c6_shadow"'
+    str_function = '"good_flow_shadow_col_test_field_str_e2c228c6_shadow_sync"'
+    str_trigger = '"good_flow_shadow_colu_test_field_str_e2c228c6_shadow_trg"'
+    assert split_sql_queries(migration_sql) == [
+        f'ALTER TABLE {table} ADD COLUMN {int_shadow} bigint;',
+        one_line_sql(f"""
+            CREATE OR REPLACE FUNCTION {int_function}() RETURNS trigger AS $$
+            BEGIN NEW.{int_shadow} := NEW."test_field_int"::bigint; RETURN NEW; END
+            $$ LANGUAGE plpgsql;
+        """),
+        one_line_sql(f"""
+            CREATE TRIGGER {int_trigger} BEFORE INSERT OR UPDATE OF "test_field_int" ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {int_function}();
+        """),
+        one_line_sql(f"""
+            CREATE INDEX CONCURRENTLY {int_index}
+            ON public.good_flow_shadow_column_type_change_app_testtable USING btree ({int_shadow});
+        """),
+        f'ALTER TABLE {table} ADD CONSTRAINT {int_check} CHECK ({int_shadow} IS NOT NULL) NOT VALID;',
+        f'ALTER TABLE {table} VALIDATE CONSTRAINT {int_check};',
+        one_line_sql(f"""
+            DROP TRIGGER {int_trigger} ON {table};
+            ALTER TABLE {table} DROP COLUMN "test_field_int";
+            ALTER TABLE {table} RENAME COLUMN {int_shadow} TO "test_field_int";
+            ALTER INDEX {int_index} RENAME TO "good_flow_shadow_column_ty_test_field_int_a6dc919b";
+            ALTER TABLE {table} ALTER COLUMN "test_field_int" SET NOT NULL;
+            ALTER TABLE {table} DROP CONSTRAINT {int_check};
+            COMMENT ON COLUMN {table}."test_field_int" IS 'test comment';
+        """),
+        f'DROP FUNCTION IF EXISTS {int_function}();',
+        f'ALTER TABLE {table} ADD COLUMN {str_shadow} varchar(20);',
+        one_line_sql(f"""
+            CREATE OR REPLACE FUNCTION {str_function}() RETURNS trigger AS $$
+            BEGIN NEW.{str_shadow} := NEW."test_field_str"::varchar(20); RETURN NEW; END
+            $$ LANGUAGE plpgsql;
+        """),
+        one_line_sql(f"""
+            CREATE TRIGGER {str_trigger} BEFORE INSERT OR UPDATE OF "test_field_str" ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {str_function}();
+        """),
+        one_line_sql(f"""
+            DROP TRIGGER {str_trigger} ON {table};
+            ALTER TABLE {table} DROP COLUMN "test_field_str";
+            ALTER TABLE {table} RENAME COLUMN {str_shadow} TO "test_field_str";
+        """),
+        f'DROP FUNCTION IF EXISTS {str_function}();',
+    ]
+
+
+@skip_for_default_django_backend
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_shadow_column_type_change_app"})
+@override_settings(
+    ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+    ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE=True,
+    ZERO_DOWNTIME_MIGRATIONS_IDEMPOTENT_SQL=True,
+)
+def test_idempotency_shadow_column_type_change(mocker):
+    table = "good_flow_shadow_column_type_change_app_testtable"
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "0001")
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO "{table}" ("test_field_int", "test_field_str") VALUES (1, 10), (2, NULL)')
+
+    # migration failed after shadow column and trigger creation
+    mocker.patch.object(DatabaseSchemaEditorMixin, "_backfill_shadow_column", side_effect=RuntimeError)
+    with pytest.raises(RuntimeError):
+        call_command("migrate", "good_flow_shadow_column_type_change_app")
+    mocker.stopall()
+
+    # rerun
+    call_command("migrate", "good_flow_shadow_column_type_change_app")
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_name = '{table}'
+            ORDER BY column_name
+        """)
+        assert cursor.fetchall() == [
+            ("id", "integer"),
+            ("test_field_int", "bigint"),
+            ("test_field_str", "character varying"),
+        ]
+        cursor.execute(f'SELECT "id", "test_field_int", "test_field_str" FROM "{table}" ORDER BY "id"')
+        assert cursor.fetchall() == [(1, 1, "10"), (2, 2, None)]
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "zero")
+
+
+@skip_for_default_django_backend
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_shadow_column_type_change_app"})
+@override_settings(
+    ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+    ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE=True,
+    ZERO_DOWNTIME_MIGRATIONS_IDEMPOTENT_SQL=True,
+    ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SIZE=2,
+)
+def test_idempotency_shadow_column_type_change_resume(mocker):
+    table = "good_flow_shadow_column_type_change_app_testtable"
+    int_shadow = "good_flow_shadow_column_test_field_int_a6dc919b_shadow"
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "0001")
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO "{table}" ("test_field_int", "test_field_str")
+            VALUES (1, 10), (2, NULL), (3, 30), (4, NULL), (5, 50)
+        """)
+
+    # migration failed after first rows of first column were backfilled
+    def backfill_partially(self, pk_column, cast, parts, resume=False):
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE "{table}" SET "{int_shadow}" = "test_field_int" WHERE "id" <= 2')
+        raise RuntimeError
+
+    mocker.patch.object(DatabaseSchemaEditorMixin, "_backfill_shadow_column", backfill_partially)
+    with pytest.raises(RuntimeError):
+        call_command("migrate", "good_flow_shadow_column_type_change_app")
+    mocker.stopall()
+
+    # rerun resumed first column backfill and failed on second column after first column swap
+    backfill_shadow_column = DatabaseSchemaEditorMixin._backfill_shadow_column
+
+    def fail_second_column(self, pk_column, cast, parts, resume=False):
+        if parts["column"] == '"test_field_str"':
+            raise RuntimeError
+        return backfill_shadow_column(self, pk_column, cast, parts, resume)
+
+    mocker.patch.object(DatabaseSchemaEditorMixin, "_backfill_shadow_column", fail_second_column)
+    backfill_by_primary_key = mocker.spy(DatabaseSchemaEditorMixin, "_backfill_by_primary_key")
+    with pytest.raises(RuntimeError):
+        call_command("migrate", "good_flow_shadow_column_type_change_app")
+    mocker.stopall()
+    assert [call.args[-1] for call in backfill_by_primary_key.call_args_list] == [3]
+
+    # rerun skipped swapped first column and resumed second column
+    prepare_shadow_column = mocker.spy(DatabaseSchemaEditorMixin, "_prepare_shadow_column")
+    call_command("migrate", "good_flow_shadow_column_type_change_app")
+    mocker.stopall()
+    assert [call.args[2] for call in prepare_shadow_column.call_args_list] == ["test_field_str"]
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_name = '{table}'
+            ORDER BY column_name
+        """)
+        assert cursor.fetchall() == [
+            ("id", "integer"),
+            ("test_field_int", "bigint"),
+            ("test_field_str", "character varying"),
+        ]
+        cursor.execute(f'SELECT "id", "test_field_int", "test_field_str" FROM "{table}" ORDER BY "id"')
+        assert cursor.fetchall() == [(1, 1, "10"), (2, 2, None), (3, 3, "30"), (4, 4, None), (5, 5, "50")]
+        cursor.execute("SELECT proname FROM pg_proc WHERE proname LIKE '%%shadow_sync'")
+        assert cursor.fetchall() == []
+    call_command("migrate", "good_flow_shadow_column_type_change_app", "zero")
+
+
+@skip_for_default_django_backend
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.idempotency_add_index_meta_app"})
+def test_sweep_invalid_indexes():
+    table = "idempotency_add_index_meta_app_relatedtesttable"
+    call_command("migrate", "idempotency_add_index_meta_app")
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE INDEX "relatedtesttable_idx_ccnew" ON "{table}" ("test_field_int")')
+    make_index_invalid(table, "relatedtesttable_idx")
+    make_index_invalid(table, "relatedtesttable_idx_ccnew")
+
+    # dry run
+    stdout = io.StringIO()
+    call_command("sweep_invalid_indexes", "--dry-run", stdout=stdout)
+    assert stdout.getvalue() == textwrap.dedent(f"""\
+        Would rebuild relatedtesttable_idx on {table} (8192 bytes): \
+idempotency_add_index_meta_app.RelatedTestTable relatedtesttable_idx, \
+migration idempotency_add_index_meta_app.0002_relatedtesttable_relatedtesttable_idx
+          CREATE INDEX relatedtesttable_idx ON public.{table} USING btree (test_field_int, test_field_str)
+        Would drop relatedtesttable_idx_ccnew on {table} (8192 bytes): unknown
+          CREATE INDEX relatedtesttable_idx_ccnew ON public.{table} USING btree (test_field_int)
+    """)
+    assert not is_valid_index(table, "relatedtesttable_idx")
+
+    # sweep
+    stdout = io.StringIO()
+    call_command("sweep_invalid_indexes", "--workers", "2", stdout=stdout)
+    assert stdout.getvalue().endswith("Processed 2 invalid indexes.\n")
+    assert is_valid_index(table, "relatedtesttable_idx")
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('relatedtesttable_idx_ccnew')")
+        assert cursor.fetchone() == (None,)
+
+    stdout = io.StringIO()
+    call_command("sweep_invalid_indexes", stdout=stdout)
+    assert stdout.getvalue() == "No invalid indexes found.\n"
+    call_command("migrate", "idempotency_add_index_meta_app", "zero")
+
+
+@skip_for_default_django_backend
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_bigint_primary_key_app"})
+@override_settings(
+    ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+    ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SIZE=2,
+)
+def test_good_flow_bigint_primary_key(mocker):
+    table = "good_flow_bigint_primary_key_app_testtable"
+    related_table = "good_flow_bigint_primary_key_app_relatedtable"
+    call_command("migrate", "good_flow_bigint_primary_key_app", "0001")
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO "{table}" ("test_field") VALUES (1), (2), (3), (4), (5)')
+        cursor.execute(f"""
+            INSERT INTO "{related_table}" ("test_table_id", "test_table_one_id")
+            VALUES (1, 1), (1, NULL), (3, 3), (5, NULL)
+        """)
+
+    def get_schema():
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT table_name, column_name, data_type, is_nullable, is_identity
+                FROM information_schema.columns
+                WHERE table_name IN ('{table}', '{related_table}')
+                ORDER BY table_name, column_name
+            """)
+            columns = cursor.fetchall()
+            cursor.execute(f"""
+                SELECT conrelid::regclass::text, conname, contype, convalidated, condeferrable
+                FROM pg_constraint
+                WHERE conrelid IN ('{table}'::regclass, '{related_table}'::regclass)
+                ORDER BY conrelid::regclass::text, conname
+            """)
+            constraints = cursor.fetchall()
+            cursor.execute(f"""
+                SELECT indexname FROM pg_indexes
+                JOIN pg_index ON indexrelid = to_regclass(indexname)
+                WHERE tablename IN ('{table}', '{related_table}') AND indisvalid
+                ORDER BY indexname
+            """)
+            indexes = cursor.fetchall()
+        return columns, constraints, indexes
+
+    columns, constraints, indexes = get_schema()
+    assert [column[:3] for column in columns] == [
+        (related_table, "id", "integer"),
+        (related_table, "test_table_id", "integer"),
+        (related_table, "test_table_one_id", "integer"),
+        (table, "id", "integer"),
+        (table, "test_field", "integer"),
+    ]
+
+    backfill_shadow_column = DatabaseSchemaEditorMixin._backfill_shadow_column
+
+    def write_and_backfill_shadow_column(self, *args, **kwargs):
+        # rows inserted after trigger creation get primary key from old identity sequence and are synced by trigger
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO "{table}" ("test_field") VALUES (6)')
+            cursor.execute(f'UPDATE "{related_table}" SET "test_table_id" = 2 WHERE "id" = 2')
+        return backfill_shadow_column(self, *args, **kwargs)
+
+    mocker.patch.object(DatabaseSchemaEditorMixin, "_backfill_shadow_column", write_and_backfill_shadow_column)
+
+    # forward
+    call_command("migrate", "good_flow_bigint_primary_key_app")
+    mocker.stopall()
+    assert get_schema() == (
+        [
+            (related_table, "id", "integer", "NO", "YES"),
+            (related_table, "test_table_id", "bigint", "NO", "NO"),
+            (related_table, "test_table_one_id", "bigint", "YES", "NO"),
+            (table, "id", "bigint", "NO", "YES"),
+            (table, "test_field", "integer", "YES", "NO"),
+        ],
+        constraints,
+        indexes,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO "{table}" ("test_field") VALUES (9) RETURNING "id"')
+        assert cursor.fetchone() == (9,)
+        cursor.execute(f'SELECT "id", "test_field" FROM "{table}" ORDER BY "id"')
+        assert cursor.fetchall() == [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 6), (7, 6), (8, 6), (9, 9)]
+        cursor.execute(f'SELECT "id", "test_table_id", "test_table_one_id" FROM "{related_table}" ORDER BY "id"')
+        assert cursor.fetchall() == [(1, 1, 1), (2, 2, None), (3, 3, 3), (4, 5, None)]
+        cursor.execute("SELECT proname FROM pg_proc WHERE proname LIKE '%%shadow_sync'")
+        assert cursor.fetchall() == []
+
+    # backward
+    call_command("migrate", "good_flow_bigint_primary_key_app", "0001")
+    assert get_schema() == (columns, constraints, indexes)
+    call_command("migrate", "good_flow_bigint_primary_key_app", "zero")
+
+
+@skip_for_default_django_backend
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_bigint_primary_key_app"})
+def test_primary_keys_headroom():
+    table = "good_flow_bigint_primary_key_app_testtable"
+    related_table = "good_flow_bigint_primary_key_app_relatedtable"
+    call_command("migrate", "good_flow_bigint_primary_key_app", "0001")
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO "{table}" ("id") VALUES (2147483000)')
+
+    stdout = io.StringIO()
+    call_command("primary_keys_headroom", "--threshold", "50", stdout=stdout)
+    assert stdout.getvalue() == textwrap.dedent(f"""\
+        {related_table}.test_table_id integer references {table}.id: \
+2147483000 of 2147483647 used (100.00%), 647 left
+        {related_table}.test_table_one_id integer references {table}.id: \
+2147483000 of 2147483647 used (100.00%), 647 left
+        {table}.id integer: 2147483000 of 2147483647 used (100.00%), 647 left
+    """)
+
+    call_command("migrate", "good_flow_bigint_primary_key_app")
+    stdout = io.StringIO()
+    call_command("primary_keys_headroom", "--threshold", "50", stdout=stdout)
+    assert stdout.getvalue() == "No integer keys found.\n"
+    call_command("migrate", "good_flow_bigint_primary_key_app", "zero")
+
+
+@skip_for_default_django_backend
+@pytest.mark.skipif(django.VERSION[:2] < (5, 0), reason="functionality provided in django 5.0")
+@pytest.mark.django_db(transaction=True)
+@modify_settings(INSTALLED_APPS={"append": "tests.apps.good_flow_add_column_with_volatile_default_app"})
+@override_settings(
+    ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+    ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SIZE=2,
+)
+def test_good_flow_add_column_with_volatile_default():
+    table = "good_flow_add_column_with_volatile_default_app_testtable"
+    call_command("migrate", "good_flow_add_column_with_volatile_default_app", "0001")
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO "{table}" ("test_field_int") VALUES (1), (2), (3), (4), (5)')
+        cursor.execute(f"SELECT relfilenode FROM pg_class WHERE oid = '{table}'::regclass")
+        relfilenode = cursor.fetchone()
+
+    # forward
+    call_command("migrate", "good_flow_add_column_with_volatile_default_app")
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT relfilenode FROM pg_class WHERE oid = '{table}'::regclass")
+        assert cursor.fetchone() == relfilenode
+        cursor.execute(f'INSERT INTO "{table}" ("test_field_int") VALUES (6)')
+        cursor.execute(f'SELECT count(DISTINCT "test_field_uuid"), count(*) FROM "{table}"')
+        assert cursor.fetchone() == (6, 6)
+        cursor.execute(f"""
+            SELECT is_nullable, column_default FROM information_schema.columns
+            WHERE table_name = '{table}' AND column_name = 'test_field_uuid'
+        """)
+        assert cursor.fetchone() == ("NO", "gen_random_uuid()")
+        cursor.execute(f"SELECT conname FROM pg_constraint WHERE conrelid = '{table}'::regclass AND contype = 'c'")
+        assert cursor.fetchall() == []
+
+    # backward
+    call_command("migrate", "good_flow_add_column_with_volatile_default_app", "zero")
@@ -0,0 +1,117 @@
+from django.db import connection
+
+import pytest
+
+from django_zero_downtime_migrations.casts import (
+    binary_coercible, datetime_precision, load_rule, numeric_precision,
+    same_type, serial_alias, timestamp_time_zone, unconstrained_domain,
+    varchar_length
+)
+
+TABLE = 'tests_casts'
+
+
+@pytest.fixture
+def editor():
+    with connection.schema_editor(collect_sql=True) as editor:
+        yield editor
+
+
+@pytest.fixture
+def table():
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {TABLE} (plain text, indexed text, expression text)')
+        cursor.execute(f'CREATE INDEX ON {TABLE} (indexed)')
+        cursor.execute(f'CREATE INDEX ON {TABLE} (lower(expression))')
+        cursor.execute('CREATE DOMAIN tests_casts_text AS text')
+        cursor.execute("CREATE DOMAIN tests_casts_not_empty_text AS text CHECK (VALUE <> '')")
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE {TABLE}')
+        cursor.execute('DROP DOMAIN tests_casts_text')
+        cursor.execute('DROP DOMAIN tests_casts_not_empty_text')
+
+
+@pytest.mark.parametrize('rule, old_type, new_type, safe', [
+    (same_type, 'integer', 'integer', True),
+    (same_type, 'integer', 'bigint', None),
+    (serial_alias, 'integer', 'serial', True),
+    (serial_alias, 'bigserial', 'bigint', True),
+    (serial_alias, 'integer', 'bigserial', None),
+    (varchar_length, 'varchar(40)', 'varchar(80)', True),
+    (varchar_length, 'varchar(40)', 'varchar(20)', False),
+    (varchar_length, 'varchar(40)', 'varchar', True),
+    (varchar_length, 'varchar', 'varchar(40)', False),
+    (varchar_length, 'varchar(40)', 'text', True),
+    (varchar_length, 'varchar(40)', 'integer', None),
+    (varchar_length, 'text', 'varchar', None),
+    (numeric_precision, 'numeric(10, 2)', 'numeric(20, 2)', True),
+    (numeric_precision, 'numeric(10, 2)', 'numeric(5, 2)', False),
+    (numeric_precision, 'numeric(10, 2)', 'numeric(10, 3)', False),
+    (numeric_precision, 'numeric(10, 2)', 'numeric', True),
+    (numeric_precision, 'numeric', 'numeric(10, 2)', False),
+    (numeric_precision, 'numeric(10, 2)', 'double precision', None),
+    (datetime_precision, 'timestamp(3) with time zone', 'timestamp(6) with time zone', True),
+    (datetime_precision, 'timestamp(3) with time zone', 'timestamp with time zone', True),
+    (datetime_precision, 'timestamp with time zone', 'timestamp(3) with time zone', False),
+    (datetime_precision, 'timestamp(3)', 'timestamp(3) with time zone', None),
+    (datetime_precision, 'interval(3)', 'interval', True),
+    (datetime_precision, 'timestamp with time zone', 'interval', None),
+])
+def test_static_rule__ok(rule, old_type, new_type, safe):
+    assert rule(None, old_type, new_type, TABLE, 'plain') is safe
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('time_zone, old_type, new_type, safe', [
+    ('UTC', 'timestamp', 'timestamp with time zone', True),
+    ('UTC', 'timestamp with time zone', 'timestamp without time zone', True),
+    ('UTC', 'timestamp(3)', 'timestamp with time zone', None),
+    ('UTC', 'timestamp with time zone', 'timestamp with time zone', None),
+    ('Europe/Berlin', 'timestamp', 'timestamp with time zone', None),
+])
+def test_timestamp_time_zone__ok(editor, time_zone, old_type, new_type, safe):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT current_setting(%s)', ['TimeZone'])
+        current_time_zone = cursor.fetchone()[0]
+        cursor.execute('SET TimeZone TO %s', [time_zone])
+    try:
+        assert timestamp_time_zone(editor, old_type, new_type, TABLE, 'plain') is safe
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SET TimeZone TO %s', [current_time_zone])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('old_type, new_type, column, safe', [
+    ('text', 'varchar', 'plain', True),
+    ('varchar(40)', 'text', 'plain', True),
+    ('cidr', 'inet', 'plain', True),
+    ('text', 'varchar(40)', 'plain', None),
+    ('integer', 'bigint', 'plain', None),
+    ('text', 'varchar', 'indexed', None),
+    ('text', 'varchar', 'expression', None),
+])
+def test_binary_coercible__ok(editor, table, old_type, new_type, column, safe):
+    assert binary_coercible(editor, old_type, new_type, TABLE, column) is safe
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('old_type, new_type, safe', [
+    ('text', 'tests_casts_text', True),
+    ('tests_casts_text', 'text', True),
+    ('text', 'tests_casts_not_empty_text', None),
+    ('tests_casts_not_empty_text', 'text', True),
+    ('integer', 'tests_casts_text', None),
+    ('text', 'varchar', None),
+])
+def test_unconstrained_domain__ok(editor, table, old_type, new_type, safe):
+    assert unconstrained_domain(editor, old_type, new_type, TABLE, 'plain') is safe
+
+
+def test_load_rule__ok():
+    def rule(editor, old_type, new_type, table, column):
+        return None
+
+    assert load_rule(rule) is rule
+    assert load_rule('django_zero_downtime_migrations.casts.same_type') is same_type
@@ -0,0 +1,166 @@
+from urllib.request import Request, urlopen
+
+from django_zero_downtime_migrations.metrics import OpenMetricsSink
+
+
+def statement_event(sql, lock, tables, duration, lock_wait=0.0, skipped=False, retries=0, lock_timeouts=0,
+                    error=None):
+    return {
+        'event': 'statement',
+        'database': 'default',
+        'sql': sql,
+        'lock': lock,
+        'tables': tables,
+        'skipped': skipped,
+        'retries': retries,
+        'lock_timeouts': lock_timeouts,
+        'lock_wait': lock_wait,
+        'duration': duration,
+        'error': error,
+    }
+
+
+EVENTS = [
+    statement_event('ALTER TABLE "tests_model" ADD COLUMN "field" integer NULL', 'PGAccessExclusive',
+                    ['tests_model'], 2.5, lock_wait=2.0, retries=1, lock_timeouts=1),
+    statement_event('ALTER TABLE "tests_model" ADD COLUMN "field" integer NULL', 'PGAccessExclusive',
+                    ['tests_model'], 0.0, skipped=True),
+    statement_event('CREATE INDEX CONCURRENTLY "tests_model_idx" ON "tests_model" ("field")',
+                    'PGShareUpdateExclusive', ['tests_model'], 0.05),
+    statement_event('SELECT 1', None, [], 0.5, error='OperationalError: canceling statement'),
+]
+
+
+def test_render__ok():
+    sink = OpenMetricsSink(buckets=[1, 0.1])
+    for event in EVENTS:
+        sink(event)
+    assert sink.render() == '\n'.join([
+        '# HELP zero_downtime_migrations_statement_duration_seconds Migration statement duration by lock class.',
+        '# TYPE zero_downtime_migrations_statement_duration_seconds histogram',
+        'zero_downtime_migrations_statement_duration_seconds_bucket'
+        '{database="default",lock="PGAccessExclusive",le="0.1"} 0',
+        'zero_downtime_migrations_statement_duration_seconds_bucket'
+        '{database="default",lock="PGAccessExclusive",le="1.0"} 0',
+        'zero_downtime_migrations_statement_duration_seconds_bucket'
+        '{database="default",lock="PGAccessExclusive",le="+Inf"} 1',
+        'zero_downtime_migrations_statement_duration_seconds_sum{database="default",lock="PGAccessExclusive"} 2.5',
+        'zero_downtime_migrations_statement_duration_seconds_count{database="default",lock="PGAccessExclusive"} 1',
+        'zero_downtime_migrations_statement_duration_seconds_bucket'
+        '{database="default",lock="PGShareUpdateExclusive",le="0.1"} 1',
+        'zero_downtime_migrations_statement_duration_seconds_bucket'
+        '{database="default",lock="PGShareUpdateExclusive",le="1.0"} 1',
+        'zero_downtime_migrations_statement_duration_seconds_bucket'
+        '{database="default",lock="PGShareUpdateExclusive",le="+Inf"} 1',
+        'zero_downtime_migrations_statement_duration_seconds_sum'
+        '{database="default",lock="PGShareUpdateExclusive"} 0.05',
+        'zero_downtime_migrations_statement_duration_seconds_count'
+        '{database="default",lock="PGShareUpdateExclusive"} 1',
+        'zero_downtime_migrations_statement_duration_seconds_bucket{database="default",lock="unknown",le="0.1"} 0',
+        'zero_downtime_migrations_statement_duration_seconds_bucket{database="default",lock="unknown",le="1.0"} 1',
+        'zero_downtime_migrations_statement_duration_seconds_bucket{database="default",lock="unknown",le="+Inf"} 1',
+        'zero_downtime_migrations_statement_duration_seconds_sum{database="default",lock="unknown"} 0.5',
+        'zero_downtime_migrations_statement_duration_seconds_count{database="default",lock="unknown"} 1',
+        '# HELP zero_downtime_migrations_statement_lock_wait_seconds '
+        'Migration statement lock wait duration by lock class.',
+        '# TYPE zero_downtime_migrations_statement_lock_wait_seconds histogram',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket'
+        '{database="default",lock="PGAccessExclusive",le="0.1"} 0',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket'
+        '{database="default",lock="PGAccessExclusive",le="1.0"} 0',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket'
+        '{database="default",lock="PGAccessExclusive",le="+Inf"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_sum{database="default",lock="PGAccessExclusive"} 2.0',
+        'zero_downtime_migrations_statement_lock_wait_seconds_count{database="default",lock="PGAccessExclusive"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket'
+        '{database="default",lock="PGShareUpdateExclusive",le="0.1"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket'
+        '{database="default",lock="PGShareUpdateExclusive",le="1.0"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket'
+        '{database="default",lock="PGShareUpdateExclusive",le="+Inf"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_sum'
+        '{database="default",lock="PGShareUpdateExclusive"} 0.0',
+        'zero_downtime_migrations_statement_lock_wait_seconds_count'
+        '{database="default",lock="PGShareUpdateExclusive"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket{database="default",lock="unknown",le="0.1"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket{database="default",lock="unknown",le="1.0"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_bucket{database="default",lock="unknown",le="+Inf"} 1',
+        'zero_downtime_migrations_statement_lock_wait_seconds_sum{database="default",lock="unknown"} 0.0',
+        'zero_downtime_migrations_statement_lock_wait_seconds_count{database="default",lock="unknown"} 1',
+        '# HELP zero_downtime_migrations_statement_errors_total Failed migration statements by lock class.',
+        '# TYPE zero_downtime_migrations_statement_errors_total counter',
+        'zero_downtime_migrations_statement_errors_total{database="default",lock="PGAccessExclusive"} 0',
+        'zero_downtime_migrations_statement_errors_total{database="default",lock="PGShareUpdateExclusive"} 0',
+        'zero_downtime_migrations_statement_errors_total{database="default",lock="unknown"} 1',
+        '# HELP zero_downtime_migrations_lock_timeouts_total '
+        'Migration statement attempts failed by lock timeout by lock class.',
+        '# TYPE zero_downtime_migrations_lock_timeouts_total counter',
+        'zero_downtime_migrations_lock_timeouts_total{database="default",lock="PGAccessExclusive"} 1',
+        'zero_downtime_migrations_lock_timeouts_total{database="default",lock="PGShareUpdateExclusive"} 0',
+        'zero_downtime_migrations_lock_timeouts_total{database="default",lock="unknown"} 0',
+        '# HELP zero_downtime_migrations_lock_retries_total '
+        'Migration statement retries after lock timeout by lock class.',
+        '# TYPE zero_downtime_migrations_lock_retries_total counter',
+        'zero_downtime_migrations_lock_retries_total{database="default",lock="PGAccessExclusive"} 1',
+        'zero_downtime_migrations_lock_retries_total{database="default",lock="PGShareUpdateExclusive"} 0',
+        'zero_downtime_migrations_lock_retries_total{database="default",lock="unknown"} 0',
+        '# HELP zero_downtime_migrations_skipped_statements_total '
+        'Migration statements skipped in idempotent mode by lock class.',
+        '# TYPE zero_downtime_migrations_skipped_statements_total counter',
+        'zero_downtime_migrations_skipped_statements_total{database="default",lock="PGAccessExclusive"} 1',
+        '# HELP zero_downtime_migrations_index_build_duration_seconds Index build and rebuild duration by table.',
+        '# TYPE zero_downtime_migrations_index_build_duration_seconds histogram',
+        'zero_downtime_migrations_index_build_duration_seconds_bucket'
+        '{database="default",table="tests_model",le="0.1"} 1',
+        'zero_downtime_migrations_index_build_duration_seconds_bucket'
+        '{database="default",table="tests_model",le="1.0"} 1',
+        'zero_downtime_migrations_index_build_duration_seconds_bucket'
+        '{database="default",table="tests_model",le="+Inf"} 1',
+        'zero_downtime_migrations_index_build_duration_seconds_sum{database="default",table="tests_model"} 0.05',
+        'zero_downtime_migrations_index_build_duration_seconds_count{database="default",table="tests_model"} 1',
+    ]) + '\n'
+
+
+def test_render__skip_other_events__ok():
+    sink = OpenMetricsSink()
+    sink({'event': 'index_progress', 'database': 'default', 'phase': 'building index: scanning table'})
+    assert sink.render() == OpenMetricsSink().render()
+
+
+def test_render__openmetrics__ok():
+    sink = OpenMetricsSink(prefix='migrations')
+    sink(EVENTS[1])
+    text = sink.render(openmetrics=True)
+    assert '# TYPE migrations_skipped_statements counter\n' in text
+    assert 'migrations_skipped_statements_total{database="default",lock="PGAccessExclusive"} 1\n' in text
+    assert text.endswith('\n# EOF\n')
+
+
+def test_render__escape_labels__ok():
+    sink = OpenMetricsSink()
+    sink(statement_event('REINDEX INDEX CONCURRENTLY "idx"', None, ['a"b\\c'], 1.0))
+    assert 'table="a\\"b\\\\c"' in sink.render()
+
+
+def test_textfile__ok(tmp_path):
+    path = tmp_path / 'migrations.prom'
+    sink = OpenMetricsSink(textfile=str(path))
+    for event in EVENTS:
+        sink(event)
+    assert path.read_text() == sink.render()
+    assert [p.name for p in tmp_path.iterdir()] == ['migrations.prom']
+
+
+def test_server__ok():
+    sink = OpenMetricsSink(port=0)
+    try:
+        sink(EVENTS[0])
+        url = 'http://{}:{}/metrics'.format(*sink._server.server_address)
+        with urlopen(url) as response:
+            assert response.headers['Content-Type'] == OpenMetricsSink.TEXT_CONTENT_TYPE
+            assert response.read().decode() == sink.render()
+        with urlopen(Request(url, headers={'Accept': 'application/openmetrics-text'})) as response:
+            assert response.headers['Content-Type'] == OpenMetricsSink.OPENMETRICS_CONTENT_TYPE
+            assert response.read().decode() == sink.render(openmetrics=True)
+    finally:
+        sink.close()
@@ -0,0 +1,86 @@
+from django.db import models
+from django.db.migrations.state import ModelState, ProjectState
+
+import pytest
+
+from django_zero_downtime_migrations.operations import (
+    BackfillField, ConvertPrimaryKeyToBigInt
+)
+
+
+def test_backfill_field__deconstruct__ok():
+    operation = BackfillField('testtable', 'field', value=0, batch_size=100, sleep=0.5)
+    assert operation.deconstruct() == ('BackfillField', [], {
+        'model_name': 'testtable',
+        'name': 'field',
+        'value': 0,
+        'batch_size': 100,
+        'sleep': 0.5,
+    })
+    assert BackfillField('testtable', 'field', value=0).deconstruct() == ('BackfillField', [], {
+        'model_name': 'testtable',
+        'name': 'field',
+        'value': 0,
+    })
+
+
+def test_backfill_field__state_forwards__ok():
+    state = ProjectState()
+    state.add_model(ModelState('tests', 'TestTable', [
+        ('id', models.AutoField(primary_key=True)),
+        ('field', models.IntegerField(null=True)),
+    ]))
+    operation = BackfillField('testtable', 'field', value=0)
+    new_state = state.clone()
+    operation.state_forwards('tests', new_state)
+    assert state.models['tests', 'testtable'].fields['field'].null is True
+    assert new_state.models['tests', 'testtable'].fields['field'].null is False
+    assert operation.describe() == 'Backfill field on testtable and set NOT NULL'
+    assert operation.migration_name_fragment == 'backfill_testtable_field'
+
+
+def test_convert_primary_key_to_bigint__deconstruct__ok():
+    operation = ConvertPrimaryKeyToBigInt('testtable')
+    assert operation.deconstruct() == ('ConvertPrimaryKeyToBigInt', [], {'name': 'testtable'})
+
+
+def test_convert_primary_key_to_bigint__state_forwards__ok():
+    state = ProjectState()
+    state.add_model(ModelState('tests', 'TestTable', [
+        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+    ]))
+    state.add_model(ModelState('tests', 'OtherTable', [
+        ('code', models.IntegerField(primary_key=True)),
+    ]))
+    new_state = state.clone()
+    ConvertPrimaryKeyToBigInt('testtable').state_forwards('tests', new_state)
+    operation = ConvertPrimaryKeyToBigInt('othertable')
+    operation.state_forwards('tests', new_state)
+    field = new_state.models['tests', 'testtable'].fields['id']
+    assert type(field) is models.BigAutoField
+    assert field.deconstruct()[3] == {
+        'auto_created': True, 'primary_key': True, 'serialize': False, 'verbose_name': 'ID',
+    }
+    assert type(new_state.models['tests', 'othertable'].fields['code']) is models.BigIntegerField
+    assert type(state.models['tests', 'othertable'].fields['code']) is models.IntegerField
+    assert operation.describe() == 'Convert primary key of othertable and referencing foreign keys to bigint'
+    assert operation.migration_name_fragment == 'convert_othertable_primary_key_to_bigint'
+
+
+def test_convert_primary_key_to_bigint__state_forwards__not_supported__raise():
+    state = ProjectState()
+    state.add_model(ModelState('tests', 'TestTable', [
+        ('id', models.AutoField(primary_key=True)),
+    ]))
+    state.add_model(ModelState('tests', 'ChildTable', [
+        ('testtable_ptr', models.OneToOneField(
+            'tests.TestTable', models.CASCADE, parent_link=True, primary_key=True, serialize=False,
+        )),
+    ]))
+    state.add_model(ModelState('tests', 'CodeTable', [
+        ('code', models.CharField(max_length=10, primary_key=True)),
+    ]))
+    with pytest.raises(ValueError, match="doesn't support OneToOneField primary key tests.ChildTable.testtable_ptr"):
+        ConvertPrimaryKeyToBigInt('childtable').state_forwards('tests', state.clone())
+    with pytest.raises(ValueError, match="doesn't support CharField primary key tests.CodeTable.code"):
+        ConvertPrimaryKeyToBigInt('codetable').state_forwards('tests', state.clone())
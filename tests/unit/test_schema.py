@@ -1,22 +1,39 @@
+import time
 from functools import partial
 
 import django
 from django.conf import settings
 from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.functions import RandomUUID
 from django.contrib.postgres.indexes import (
     BrinIndex, BTreeIndex, GinIndex, GistIndex, HashIndex, SpGistIndex
 )
+from django.core.exceptions import ImproperlyConfigured
 from django.db import connection, models
+from django.db.backends.ddl_references import Statement, Table
 from django.db.backends.postgresql.schema import (
     DatabaseSchemaEditor as CoreDatabaseSchemaEditor
 )
+from django.db.migrations import Migration, RunPython, RunSQL
+from django.db.migrations.state import ModelState, ProjectState
+from django.db.models import Func
+from django.db.models.functions import Now
+from django.db.utils import DatabaseError, OperationalError
 from django.test import override_settings
 from django.utils.module_loading import import_string
 
 import pytest
 
 from django_zero_downtime_migrations.backends.postgres.schema import (
-    UnsafeOperationException, UnsafeOperationWarning
+    LockBlockedException, MultiStatementSQL, RedundantIndexWarning,
+    UnsafeOperationException, UnsafeOperationWarning, clear_migrations_journal
+)
+from django_zero_downtime_migrations.casts import (
+    DEFAULT_SAFE_TYPE_CAST_RULES, binary_coercible, timestamp_time_zone,
+    unconstrained_domain
+)
+from django_zero_downtime_migrations.events import (
+    JSONLinesSink, LoggingSink, load_sink
 )
 
 DatabaseSchemaEditor = import_string(settings.DATABASES['default']['ENGINE'] + '.schema.DatabaseSchemaEditor')
@@ -37,6 +54,12 @@ END_FLEXIBLE_STATEMENT_TIMEOUT = [
     'SET statement_timeout TO \'0ms\';',
 ]
 
+# rules without catalog queries for tests with mocked cursor results
+STATIC_SAFE_TYPE_CAST_RULES = [
+    rule for rule in DEFAULT_SAFE_TYPE_CAST_RULES
+    if rule not in (timestamp_time_zone, binary_coercible, unconstrained_domain)
+]
+
 
 def timeouts(statements):
     if isinstance(statements, str):
@@ -59,6 +82,11 @@ class Model2(models.Model):
     pass
 
 
+class BlockedModel(models.Model):
+    class Meta:
+        db_table = 'tests_blocked'
+
+
 schema_editor = partial(DatabaseSchemaEditor, connection=connection, collect_sql=True)
 
 
@@ -222,6 +250,38 @@ def test_change_model_tablespace__raise():
     ]
 
 
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_UNSAFE_TABLE_SIZE_THRESHOLD=1024 * 1024)
+def test_change_model_tablespace__small_table__ok(mocker, cursor):
+    mocker.patch.object(cursor, 'fetchone', return_value=(8192,))
+    with cmp_schema_editor() as editor:
+        editor.alter_db_tablespace(Model, 'old_tablespace', 'new_tablespace')
+    assert editor.collected_sql == timeouts(editor.django_sql)
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" SET TABLESPACE "new_tablespace";',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_UNSAFE_TABLE_SIZE_THRESHOLD=1024 * 1024)
+def test_change_model_tablespace__big_table__raise(mocker, cursor):
+    mocker.patch.object(cursor, 'fetchone', return_value=(1024 * 1024,))
+    with cmp_schema_editor() as editor:
+        with pytest.raises(UnsafeOperationException, match='ALTER TABLE SET TABLESPACE is unsafe operation'):
+            editor.alter_db_tablespace(Model, 'old_tablespace', 'new_tablespace')
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_UNSAFE_TABLE_SIZE_THRESHOLD=1024 * 1024)
+def test_change_model_tablespace__table_not_exists__raise():
+    with cmp_schema_editor() as editor:
+        with pytest.raises(UnsafeOperationException, match='ALTER TABLE SET TABLESPACE is unsafe operation'):
+            editor.alter_db_tablespace(Model, 'old_tablespace', 'new_tablespace')
+
+
 @pytest.mark.django_db
 @pytest.mark.skipif(django.VERSION[:2] < (4, 2), reason='functionality provided in django 4.2')
 @override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
@@ -374,6 +434,74 @@ def test_add_field_with_code_default_db_default_not_null__ok():
     ]
 
 
+@pytest.mark.django_db
+@pytest.mark.skipif(django.VERSION[:2] < (5, 0), reason='functionality provided in django 5.0')
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
+def test_add_field_with_stable_db_default_not_null__ok():
+    with cmp_schema_editor() as editor:
+        field = models.DateTimeField(db_default=Now(), null=False)
+        field.set_attributes_from_name('field')
+        field.model = Model
+        editor.add_field(Model, field)
+    assert editor.collected_sql == timeouts(editor.django_sql)
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" ADD COLUMN "field" timestamp with time zone DEFAULT (STATEMENT_TIMESTAMP()) '
+        'NOT NULL;',
+    ]
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(django.VERSION[:2] < (5, 0), reason='functionality provided in django 5.0')
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
+def test_add_field_with_volatile_db_default_null__ok():
+    with cmp_schema_editor() as editor:
+        field = models.UUIDField(db_default=RandomUUID(), null=True)
+        field.set_attributes_from_name('field')
+        field.model = Model
+        editor.add_field(Model, field)
+    assert editor.collected_sql == timeouts(
+        'ALTER TABLE "tests_model" ADD COLUMN "field" uuid NULL;',
+    ) + timeouts(
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" SET DEFAULT (GEN_RANDOM_UUID());',
+    ) + [
+        '-- MIGRATION NOW PERFORMS OPERATION THAT CANNOT BE WRITTEN AS SQL',
+    ]
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" ADD COLUMN "field" uuid DEFAULT (GEN_RANDOM_UUID()) NULL;',
+    ]
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(django.VERSION[:2] < (5, 0), reason='functionality provided in django 5.0')
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
+def test_add_field_with_volatile_db_default_not_null__ok():
+    with cmp_schema_editor() as editor:
+        field = models.DateTimeField(db_default=Func(function='CLOCK_TIMESTAMP'), null=False)
+        field.set_attributes_from_name('field')
+        field.model = Model
+        editor.add_field(Model, field)
+    assert editor.collected_sql == timeouts(
+        'ALTER TABLE "tests_model" ADD COLUMN "field" timestamp with time zone NULL;',
+    ) + timeouts(
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" SET DEFAULT (CLOCK_TIMESTAMP());',
+    ) + [
+        '-- MIGRATION NOW PERFORMS OPERATION THAT CANNOT BE WRITTEN AS SQL',
+    ] + timeouts(
+        'ALTER TABLE "tests_model" ADD CONSTRAINT "tests_model_field_0a53d95f_notnull" '
+        'CHECK ("field" IS NOT NULL) NOT VALID;',
+    ) + [
+        'ALTER TABLE "tests_model" VALIDATE CONSTRAINT "tests_model_field_0a53d95f_notnull";',
+    ] + timeouts(
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" SET NOT NULL;'
+    ) + timeouts(
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "tests_model_field_0a53d95f_notnull";'
+    )
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" ADD COLUMN "field" timestamp with time zone DEFAULT (CLOCK_TIMESTAMP()) '
+        'NOT NULL;',
+    ]
+
+
 @pytest.mark.django_db
 def test_add_field_with_not_null__warning():
     with cmp_schema_editor() as editor:
@@ -848,6 +976,68 @@ def test_alter_field_type_varchar40_to_text__ok():
     ]
 
 
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
+def test_alter_field_type_varchar40_to_varchar__ok():
+    with cmp_schema_editor() as editor:
+        old_field = models.CharField(max_length=40)
+        old_field.set_attributes_from_name('field')
+        new_field = models.CharField()
+        new_field.set_attributes_from_name('field')
+        editor.alter_field(Model, old_field, new_field)
+    assert editor.collected_sql == timeouts(editor.django_sql)
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" TYPE varchar;',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
+def test_alter_field_type_text_to_varchar__ok():
+    with cmp_schema_editor() as editor:
+        old_field = models.TextField()
+        old_field.set_attributes_from_name('field')
+        new_field = models.CharField()
+        new_field.set_attributes_from_name('field')
+        editor.alter_field(Model, old_field, new_field)
+    assert editor.collected_sql == timeouts(editor.django_sql)
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" TYPE varchar USING "field"::varchar;',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_SAFE_TYPE_CAST_RULES=[
+                       'django_zero_downtime_migrations.casts.same_type',
+                       lambda editor, old_type, new_type, table, column: new_type == 'bigint' or None,
+                   ])
+def test_alter_field_type_custom_safe_type_cast_rule__ok():
+    with cmp_schema_editor() as editor:
+        old_field = models.IntegerField()
+        old_field.set_attributes_from_name('field')
+        new_field = models.BigIntegerField()
+        new_field.set_attributes_from_name('field')
+        editor.alter_field(Model, old_field, new_field)
+    assert editor.collected_sql == timeouts(editor.django_sql)
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" TYPE bigint USING "field"::bigint;',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_SAFE_TYPE_CAST_RULES=[])
+def test_alter_field_type_without_safe_type_cast_rules__raise():
+    with cmp_schema_editor() as editor:
+        with pytest.raises(UnsafeOperationException, match='ALTER COLUMN TYPE is unsafe operation'):
+            old_field = models.CharField(max_length=40)
+            old_field.set_attributes_from_name('field')
+            new_field = models.TextField()
+            new_field.set_attributes_from_name('field')
+            editor.alter_field(Model, old_field, new_field)
+
+
 @pytest.mark.django_db
 def test_alter_field_type_decimal10_2_to_decimal5_2__warning():
     with cmp_schema_editor() as editor:
@@ -953,6 +1143,99 @@ def test_alter_field_type_decimal10_2_to_decimal10_1__raise():
     ]
 
 
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_UNSAFE_TABLE_SIZE_THRESHOLD=1024 * 1024,
+                   ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_SAFE_TYPE_CAST_RULES=STATIC_SAFE_TYPE_CAST_RULES)
+def test_alter_field_type_integer_to_bigint_small_table__ok(mocker, cursor):
+    mocker.patch.object(cursor, 'fetchone', return_value=(8192,))
+    with cmp_schema_editor() as editor:
+        old_field = models.IntegerField()
+        old_field.set_attributes_from_name('field')
+        new_field = models.BigIntegerField()
+        new_field.set_attributes_from_name('field')
+        editor.alter_field(Model, old_field, new_field)
+    assert editor.collected_sql == timeouts(editor.django_sql)
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" TYPE bigint USING "field"::bigint;',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE=True)
+def test_alter_field_type_integer_to_bigint_shadow_column__ok():
+    with cmp_schema_editor() as editor:
+        old_field = models.IntegerField()
+        old_field.set_attributes_from_name('field')
+        new_field = models.BigIntegerField()
+        new_field.set_attributes_from_name('field')
+        editor.alter_field(Model, old_field, new_field)
+    assert editor.collected_sql == timeouts(
+        'ALTER TABLE "tests_model" ADD COLUMN "tests_model_field_0a53d95f_shadow" bigint;',
+    ) + [
+        'CREATE OR REPLACE FUNCTION "tests_model_field_0a53d95f_shadow_sync"() RETURNS trigger AS $$ '
+        'BEGIN NEW."tests_model_field_0a53d95f_shadow" := NEW."field"::bigint; RETURN NEW; END '
+        '$$ LANGUAGE plpgsql;',
+    ] + timeouts(
+        'CREATE TRIGGER "tests_model_field_0a53d95f_shadow_trg" BEFORE INSERT OR UPDATE OF "field" '
+        'ON "tests_model" FOR EACH ROW EXECUTE FUNCTION "tests_model_field_0a53d95f_shadow_sync"();',
+    ) + [
+        '-- MIGRATION NOW PERFORMS OPERATION THAT CANNOT BE WRITTEN AS SQL',
+    ] + timeouts(
+        'ALTER TABLE "tests_model" ADD CONSTRAINT "tests_model_field_0a53d95f_shadow_nn" '
+        'CHECK ("tests_model_field_0a53d95f_shadow" IS NOT NULL) NOT VALID;',
+    ) + [
+        'ALTER TABLE "tests_model" VALIDATE CONSTRAINT "tests_model_field_0a53d95f_shadow_nn";',
+    ] + timeouts(
+        'DROP TRIGGER "tests_model_field_0a53d95f_shadow_trg" ON "tests_model"; '
+        'ALTER TABLE "tests_model" DROP COLUMN "field"; '
+        'ALTER TABLE "tests_model" RENAME COLUMN "tests_model_field_0a53d95f_shadow" TO "field"; '
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" SET NOT NULL; '
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "tests_model_field_0a53d95f_shadow_nn";',
+    ) + [
+        'DROP FUNCTION IF EXISTS "tests_model_field_0a53d95f_shadow_sync"();',
+    ]
+    assert editor.django_sql == [
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" TYPE bigint USING "field"::bigint;',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_TYPE_CHANGE=True)
+def test_alter_field_type_primary_key_shadow_column__raise():
+    with cmp_schema_editor() as editor:
+        with pytest.raises(UnsafeOperationException, match='ALTER COLUMN TYPE is unsafe operation'):
+            old_field = models.IntegerField(primary_key=True)
+            old_field.set_attributes_from_name('id')
+            old_field.model = Model
+            new_field = models.BigIntegerField(primary_key=True)
+            new_field.set_attributes_from_name('id')
+            new_field.model = Model
+            editor.alter_field(Model, old_field, new_field)
+
+
+@pytest.mark.django_db
+def test_alter_field_type_shadow_column_rename_index_column__ok():
+    editor = DatabaseSchemaEditor(connection=connection)
+    assert editor._rename_index_column(
+        "btree (code DESC NULLS LAST, lower(status)) INCLUDE (v, code) WITH (fillfactor='70') "
+        "WHERE (status = 'code'::text)",
+        'code', '"code_shadow"',
+    ) == (
+        "btree (\"code_shadow\" DESC NULLS LAST, lower(status)) INCLUDE (v, \"code_shadow\") WITH (fillfactor='70') "
+        "WHERE (status = 'code'::text)"
+    )
+    assert editor._rename_index_column(
+        'btree ("Code" COLLATE "C", code, codes)', '"Code"', '"Code_shadow"',
+    ) == 'btree ("Code_shadow" COLLATE "C", code, codes)'
+    assert editor._rename_index_column('btree (lower(x), lower)', 'lower', '"lower_shadow"') == (
+        'btree (lower(x), "lower_shadow")'
+    )
+
+
 @pytest.mark.django_db
 @override_settings(ZERO_DOWNTIME_MIGRATIONS_RAISE_FOR_UNSAFE=True)
 def test_alter_field_set_not_null__ok():
@@ -1189,10 +1472,6 @@ def test_remove_field_with_foreign_key_backref__ok(cursor, mocker):
 def test_remove_field_with_unique_constraint__ok(cursor, mocker):
     mocker.patch.object(cursor, 'execute')
     mocker.patch.object(cursor, 'fetchall').side_effect = [
-        [
-            ('tests_model_field2_field_uniq', 'u', 'tests_model', None, ['field2', 'field'], []),
-            ('tests_model_field2_field3_uniq', 'u', 'tests_model', None, ['field2', 'field3'], []),
-        ],
         [
             ('tests_model_field2_field_uniq', 'u', 'tests_model', None, ['field2', 'field'], []),
             ('tests_model_field2_field3_uniq', 'u', 'tests_model', None, ['field2', 'field3'], []),
@@ -1218,7 +1497,6 @@ def test_remove_field_with_unique_constraint__ok(cursor, mocker):
 def test_remove_field_with_index__ok(cursor, mocker):
     mocker.patch.object(cursor, 'execute')
     mocker.patch.object(cursor, 'fetchall').side_effect = [
-        [],
         [],
         [
             ('tests_model_field2_field_idx', 'tests_model', ['field2', 'field']),
@@ -1245,7 +1523,6 @@ def test_remove_field_with_index__ok(cursor, mocker):
 def test_remove_field_with_index__with_flexible_timeout__ok(cursor, mocker):
     mocker.patch.object(cursor, 'execute')
     mocker.patch.object(cursor, 'fetchall').side_effect = [
-        [],
         [],
         [
             ('tests_model_field2_field_idx', 'tests_model', ['field2', 'field']),
@@ -2431,3 +2708,1616 @@ def test_add_meta_spgist_index__with_flexible_timeout__ok():
     assert editor.django_sql == [
         'CREATE INDEX "tests_model_field1_9b60dc_idx" ON "tests_model" USING spgist ("field1");',
     ]
+
+
+class LockNotAvailable(Exception):
+    sqlstate = pgcode = '55P03'
+
+
+class QueryCanceled(Exception):
+    sqlstate = pgcode = '57014'
+
+
+def db_error(cause):
+    error = OperationalError(str(cause))
+    error.__cause__ = cause
+    return error
+
+
+def fail_statement(statement, *errors):
+    errors = list(errors)
+
+    def execute(sql, params=None):
+        if sql == statement and errors:
+            raise errors.pop(0)
+    return execute
+
+
+def executed_sql(cursor):
+    return [call.args[0] for call in cursor.execute.call_args_list]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRIES=2)
+def test_execute_lock_timeout__retry__ok(cursor, mocker):
+    sleep = mocker.patch('django_zero_downtime_migrations.backends.postgres.schema.time.sleep')
+    mocker.patch.object(cursor, 'fetchone').return_value = ('1s', '1s')
+    mocker.patch.object(cursor, 'execute').side_effect = fail_statement(
+        'ALTER TABLE "tests_model" ADD COLUMN "field" varchar(40) NULL',
+        db_error(LockNotAvailable()),
+        db_error(LockNotAvailable()),
+    )
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        field = models.CharField(max_length=40, null=True)
+        field.set_attributes_from_name('field')
+        editor.add_field(Model, field)
+    assert sleep.call_count == 2
+    assert executed_sql(cursor) == [
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        "SET statement_timeout TO '0'",
+        "SET lock_timeout TO '0'",
+    ] + [
+        'ALTER TABLE "tests_model" ADD COLUMN "field" varchar(40) NULL',
+    ] * 3 + [
+        "SET statement_timeout TO '1s'",
+        "SET lock_timeout TO '1s'",
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRIES=1)
+def test_execute_lock_timeout__retries_exceeded__raise(cursor, mocker):
+    sleep = mocker.patch('django_zero_downtime_migrations.backends.postgres.schema.time.sleep')
+    mocker.patch.object(cursor, 'fetchone').return_value = ('0ms', '0ms')
+    mocker.patch.object(cursor, 'execute').side_effect = fail_statement(
+        'ALTER TABLE "tests_model" ADD COLUMN "field" varchar(40) NULL',
+        db_error(LockNotAvailable()),
+        db_error(LockNotAvailable()),
+    )
+    with pytest.raises(OperationalError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            field = models.CharField(max_length=40, null=True)
+            field.set_attributes_from_name('field')
+            editor.add_field(Model, field)
+    assert sleep.call_count == 1
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRIES=2)
+def test_execute_statement_timeout__no_retry__raise(cursor, mocker):
+    sleep = mocker.patch('django_zero_downtime_migrations.backends.postgres.schema.time.sleep')
+    mocker.patch.object(cursor, 'fetchone').return_value = ('0ms', '0ms')
+    mocker.patch.object(cursor, 'execute').side_effect = fail_statement(
+        'ALTER TABLE "tests_model" ADD COLUMN "field" varchar(40) NULL',
+        db_error(QueryCanceled()),
+    )
+    with pytest.raises(OperationalError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            field = models.CharField(max_length=40, null=True)
+            field.set_attributes_from_name('field')
+            editor.add_field(Model, field)
+    assert sleep.call_count == 0
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRIES=3)
+def test_execute_lock_timeout__retry_only_failed_step__ok(cursor, mocker):
+    mocker.patch('django_zero_downtime_migrations.backends.postgres.schema.time.sleep')
+    mocker.patch.object(cursor, 'fetchone').return_value = ('0ms', '0ms')
+    mocker.patch.object(cursor, 'execute').side_effect = fail_statement(
+        'ALTER TABLE "tests_model" ADD CONSTRAINT "field1_uniq" UNIQUE USING INDEX "field1_uniq"',
+        db_error(LockNotAvailable()),
+    )
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.add_constraint(Model, models.UniqueConstraint(fields=['field1'], name='field1_uniq'))
+    assert executed_sql(cursor).count(
+        'CREATE UNIQUE INDEX CONCURRENTLY "field1_uniq" ON "tests_model" ("field1")'
+    ) == 1
+    assert executed_sql(cursor).count(
+        'ALTER TABLE "tests_model" ADD CONSTRAINT "field1_uniq" UNIQUE USING INDEX "field1_uniq"'
+    ) == 2
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_DELAY=1,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_MAX_DELAY=5,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_JITTER=0)
+def test_lock_retry_delay__exponential_backoff():
+    editor = DatabaseSchemaEditor(connection=connection)
+    assert [editor._get_lock_retry_delay(attempt) for attempt in range(5)] == [1, 2, 4, 5, 5]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_DELAY=1,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_JITTER=0.5)
+def test_lock_retry_delay__jitter():
+    editor = DatabaseSchemaEditor(connection=connection)
+    for _ in range(100):
+        assert 2 <= editor._get_lock_retry_delay(2) <= 6
+
+
+@pytest.mark.django_db(transaction=True)
+def test_execute_session_timeouts__skip_redundant_set__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').return_value = ('1s', '1s')
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        field = models.CharField(max_length=40, null=False, default='x')
+        field.set_attributes_from_name('field1')
+        editor.alter_field(Model, Model._meta.get_field('field1'), field)
+    assert executed_sql(cursor) == [
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        "SET statement_timeout TO '0'",
+        "SET lock_timeout TO '0'",
+        'ALTER TABLE "tests_model" ALTER COLUMN "field1" TYPE varchar(40) USING "field1"::varchar(40)',
+        "SET statement_timeout TO '1s'",
+        "SET lock_timeout TO '1s'",
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_TIMEOUT='0ms', ZERO_DOWNTIME_MIGRATIONS_STATEMENT_TIMEOUT='0ms')
+def test_execute_session_timeouts__same_as_default__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').return_value = ('0ms', '0ms')
+    mocker.patch.object(cursor, 'fetchall').return_value = []
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        field = models.CharField(max_length=40, null=True)
+        field.set_attributes_from_name('field')
+        editor.add_field(Model, field)
+        editor.remove_field(Model, field)
+    assert executed_sql(cursor) == [
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        'ALTER TABLE "tests_model" ADD COLUMN "field" varchar(40) NULL',
+        mocker.ANY,  # constraints introspection
+        mocker.ANY,  # indexes introspection
+        'ALTER TABLE "tests_model" DROP COLUMN "field" CASCADE',
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_execute_session_timeouts__multi_statement__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').return_value = ('1s', '1s')
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check1"'})
+        editor.execute(MultiStatementSQL(
+            editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check2"'},
+            editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check3"'},
+        ))
+    assert executed_sql(cursor) == [
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        "SET statement_timeout TO '0'",
+        "SET lock_timeout TO '0'",
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "check1"',
+        "SET statement_timeout TO '1s'",
+        "SET lock_timeout TO '1s'",
+        "SET statement_timeout TO '0'",
+        "SET lock_timeout TO '0'",
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "check2"',
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "check3"',
+        "SET statement_timeout TO '1s'",
+        "SET lock_timeout TO '1s'",
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_execute_session_timeouts__restore_on_error__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').return_value = ('1s', '1s')
+    mocker.patch.object(cursor, 'execute').side_effect = fail_statement(
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "check1"',
+        db_error(QueryCanceled()),
+    )
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        with pytest.raises(OperationalError):
+            editor.execute(editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check1"'})
+    assert executed_sql(cursor)[-2:] == [
+        "SET statement_timeout TO '1s'",
+        "SET lock_timeout TO '1s'",
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_execute_session_timeouts__restore_failed_on_error__raise_original(cursor, mocker, caplog):
+    mocker.patch.object(cursor, 'fetchone').return_value = ('1s', '1s')
+    errors = {
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "check1"': db_error(QueryCanceled('statement failed')),
+        "SET statement_timeout TO '1s'": OperationalError('connection lost'),
+    }
+
+    def execute(sql, params=None):
+        if sql in errors:
+            raise errors.pop(sql)
+    mocker.patch.object(cursor, 'execute').side_effect = execute
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        with pytest.raises(OperationalError, match='statement failed'):
+            editor.execute(editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check1"'})
+    assert 'restore session timeouts after failed statement failed' in caplog.text
+    assert editor._session_timeouts is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_execute_session_timeouts__restore_failed__raise(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').return_value = ('1s', '1s')
+    mocker.patch.object(cursor, 'execute').side_effect = fail_statement(
+        "SET statement_timeout TO '1s'",
+        OperationalError('connection lost'),
+    )
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        with pytest.raises(OperationalError, match='connection lost'):
+            editor.execute(editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check1"'})
+    assert editor._session_timeouts is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_execute_session_timeouts__same_value_other_unit__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').return_value = ('0', '0ms')
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check1"'})
+    assert executed_sql(cursor) == [
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "check1"',
+    ]
+
+
+@pytest.mark.django_db
+def test_backfill_batch_settings__ok():
+    editor = DatabaseSchemaEditor(connection=connection)
+    assert (editor.BACKFILL_BATCH_SIZE, editor.BACKFILL_BATCH_SLEEP) == (1000, 0)
+    with override_settings(ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_BATCH_SIZE=10,
+                           ZERO_DOWNTIME_MIGRATIONS_SHADOW_COLUMN_BATCH_SLEEP=1):
+        editor = DatabaseSchemaEditor(connection=connection)
+        assert (editor.BACKFILL_BATCH_SIZE, editor.BACKFILL_BATCH_SLEEP) == (10, 1)
+        with override_settings(ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SIZE=20,
+                               ZERO_DOWNTIME_MIGRATIONS_BACKFILL_BATCH_SLEEP=2):
+            editor = DatabaseSchemaEditor(connection=connection)
+            assert (editor.BACKFILL_BATCH_SIZE, editor.BACKFILL_BATCH_SLEEP) == (20, 2)
+
+
+@pytest.mark.django_db
+def test_backfill_null_column__expression__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'execute')
+    mocker.patch.object(cursor, 'fetchone').side_effect = [(3,), (4,), (None,)]
+    mocker.patch.object(cursor, 'rowcount', 2)
+    editor = DatabaseSchemaEditor(connection=connection)
+    editor._backfill_null_column(Model, Model._meta.get_field('field1'), models.F('field2') + 1, 2, 0)
+    assert executed_sql(cursor) == [
+        'SELECT min("id") FROM "tests_model" WHERE "field1" IS NULL',
+        'SELECT max("id") FROM (SELECT "id" FROM "tests_model" WHERE "id" >= %s ORDER BY "id" LIMIT 2) AS batch',
+        'UPDATE "tests_model" SET "field1" = ("tests_model"."field2" + %s) '
+        'WHERE "id" <= %s AND "id" >= %s AND "field1" IS NULL',
+        'SELECT max("id") FROM (SELECT "id" FROM "tests_model" WHERE "id" > %s ORDER BY "id" LIMIT 2) AS batch',
+    ]
+    assert [call.args[1:] for call in cursor.execute.call_args_list[1:]] == [([3],), ([1, 4, 3],), ([4],)]
+
+
+@pytest.mark.django_db
+def test_normalize_timeout__ok():
+    editor = DatabaseSchemaEditor(connection=connection)
+    assert editor._normalize_timeout(0) == editor._normalize_timeout('0ms') == editor._normalize_timeout('0')
+    assert editor._normalize_timeout('2s') == editor._normalize_timeout(2000) == editor._normalize_timeout('2000ms')
+    assert editor._normalize_timeout('1min') == editor._normalize_timeout('60s')
+    assert editor._normalize_timeout('1h') != editor._normalize_timeout('1min')
+    assert editor._normalize_timeout('unknown') == 'unknown'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_execute_session_timeouts__changed_by_raw_sql__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').side_effect = [('0ms', '0ms'), ('5s', '5s')]
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check1"'})
+        editor.execute("SET lock_timeout TO '5s'")
+        editor.execute(editor.sql_delete_check % {'table': '"tests_model"', 'name': '"check2"'})
+    assert executed_sql(cursor)[-7:] == [
+        "SET lock_timeout TO '5s'",
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        "SET statement_timeout TO '0'",
+        "SET lock_timeout TO '0'",
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "check2"',
+        "SET statement_timeout TO '5s'",
+        "SET lock_timeout TO '5s'",
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_TIMEOUT='1s')
+def test_execute_session_timeouts__changed_by_raw_cursor__ok(blocked_table):
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(add_blocked_column_statement(editor))
+        try:
+            # eg. RunPython that uses connection cursor instead of schema editor
+            with connection.cursor() as cursor:
+                cursor.execute("SET lock_timeout TO '5s'")
+            editor.execute(Statement(
+                editor.sql_delete_column, table=Table('tests_blocked', editor.quote_name), column='"field"',
+            ))
+            with connection.cursor() as cursor:
+                cursor.execute('SHOW lock_timeout')
+                assert cursor.fetchone() == ('5s',)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('SET lock_timeout TO DEFAULT')
+    assert editor._track_session_timeouts not in connection.execute_wrappers
+
+
+@pytest.mark.django_db
+def test_execute_session_timeouts__change_regexp__ok():
+    regexp = DatabaseSchemaEditor._session_timeouts_change_regexp
+    assert regexp.search("SET lock_timeout TO '5s'")
+    assert regexp.search("SELECT 1; SET statement_timeout = 0")
+    assert regexp.search("SELECT 1;\nset local lock_timeout = 0")
+    assert regexp.search("RESET ALL")
+    assert regexp.search("SELECT set_config('lock_timeout', '5s', false)")
+    assert not regexp.search('UPDATE "tests_model" SET "lock_timeout" = 1')
+    assert not regexp.search("SET search_path TO public")
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_IDEMPOTENT_SQL=True)
+def test_execute_idempotent_conditions__batch__all_applied__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').return_value = (True, True, True)
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.add_constraint(Model, models.UniqueConstraint(fields=['field1'], name='field1_uniq'))
+    assert len(executed_sql(cursor)) == 1
+    assert executed_sql(cursor)[0].startswith('SELECT EXISTS (SELECT 1 WHERE to_regclass(')
+    assert executed_sql(cursor)[0].count('EXISTS (') == 3
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_IDEMPOTENT_SQL=True)
+def test_execute_idempotent_conditions__batch__partially_applied__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').side_effect = [(True, True, False), ('1s', '1s')]
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.add_constraint(Model, models.UniqueConstraint(fields=['field1'], name='field1_uniq'))
+    assert executed_sql(cursor)[1:] == [
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        "SET statement_timeout TO '0'",
+        "SET lock_timeout TO '0'",
+        'ALTER TABLE "tests_model" ADD CONSTRAINT "field1_uniq" UNIQUE USING INDEX "field1_uniq"',
+        "SET statement_timeout TO '1s'",
+        "SET lock_timeout TO '1s'",
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_IDEMPOTENT_SQL=True)
+def test_execute_idempotent_conditions__batch__not_applied__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').side_effect = [(False, False, False), (1,), None, ('1s', '1s')]
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.add_constraint(Model, models.UniqueConstraint(fields=['field1'], name='field1_uniq'))
+    assert executed_sql(cursor)[1:] == [
+        'CREATE UNIQUE INDEX CONCURRENTLY "field1_uniq" ON "tests_model" ("field1")',
+        'SELECT 1 FROM pg_index '
+        'WHERE indrelid = to_regclass(\'"tests_model"\') '
+        'AND indexrelid = to_regclass(\'"field1_uniq"\') '
+        'AND indisvalid',
+        mocker.ANY,  # constraint exists check
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        "SET statement_timeout TO '0'",
+        "SET lock_timeout TO '0'",
+        'ALTER TABLE "tests_model" ADD CONSTRAINT "field1_uniq" UNIQUE USING INDEX "field1_uniq"',
+        "SET statement_timeout TO '1s'",
+        "SET lock_timeout TO '1s'",
+    ]
+
+
+@pytest.mark.django_db
+def test_idempotent_conditions__ignore_other_schemas__ok(cursor):
+    cursor.execute('CREATE SCHEMA "tests_other"')
+    cursor.execute(
+        'CREATE TABLE "tests_other"."tests_condition" ("id" integer CONSTRAINT "tests_condition_pk" PRIMARY KEY)'
+    )
+    editor = DatabaseSchemaEditor(connection=connection)
+    column_condition = editor.sql_create_column.idempotent_condition % {'table': '"tests_condition"', 'column': '"id"'}
+    constraint_condition = editor.sql_delete_pk.idempotent_condition % {
+        'table': '"tests_condition"',
+        'name': '"tests_condition_pk"',
+    }
+
+    for condition in [column_condition, constraint_condition]:
+        cursor.execute(condition.sql)
+        assert cursor.fetchone() is None
+
+    cursor.execute('CREATE TABLE "tests_condition" ("id" integer CONSTRAINT "tests_condition_pk" PRIMARY KEY)')
+    for condition in [column_condition, constraint_condition]:
+        cursor.execute(condition.sql)
+        assert cursor.fetchone() == (1,)
+
+
+@pytest.mark.django_db
+def test_introspection_cache__constraint_names__ok(mocker):
+    get_constraints = mocker.patch.object(connection.introspection, 'get_constraints', return_value={})
+    with schema_editor() as editor:
+        editor._constraint_names(Model, ['field1'])
+        editor._constraint_names(Model, ['field2'])
+        assert get_constraints.call_count == 1
+        editor.execute(Statement(editor.sql_delete_check, table=Table('tests_model2', editor.quote_name), name='"c"'))
+        editor._constraint_names(Model)
+        assert get_constraints.call_count == 1
+        editor.execute(Statement(editor.sql_delete_check, table=Table('tests_model', editor.quote_name), name='"c"'))
+        editor._constraint_names(Model)
+        assert get_constraints.call_count == 2
+        editor.execute('SELECT 1')
+        editor._constraint_names(Model)
+        assert get_constraints.call_count == 3
+
+
+@pytest.mark.django_db
+def test_introspection_cache__related_table_changed__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'execute')
+    fetchall = mocker.patch.object(cursor, 'fetchall', return_value=[
+        ('tests_model2_model_fk', 'f', 'tests_model2', 'tests_model', ['model_id'], ['id']),
+    ])
+    with schema_editor() as editor:
+        list(editor._get_constraints(cursor, Model))
+        list(editor._get_constraints(cursor, Model))
+        assert fetchall.call_count == 1
+        editor.execute(Statement(editor.sql_delete_check, table=Table('tests_model2', editor.quote_name), name='"c"'))
+        list(editor._get_constraints(cursor, Model))
+        assert fetchall.call_count == 2
+
+
+def create_index_statement(editor, table, column, name=None):
+    return Statement(
+        editor.sql_create_index,
+        table=Table(table, editor.quote_name),
+        name=editor.quote_name(name or f'{table}_{column}_idx'),
+        using='',
+        columns=editor.quote_name(column),
+        extra='',
+        condition='',
+        include='',
+    )
+
+
+@pytest.mark.django_db
+def test_deferred_sql_locks__ok():
+    editor = DatabaseSchemaEditor(connection=connection)
+    assert editor._get_deferred_sql_locks(create_index_statement(editor, 'tests_a', 'field1')) == {
+        'tests_a': 'SHARE UPDATE EXCLUSIVE',
+    }
+    assert editor._get_deferred_sql_locks(Statement(
+        editor.sql_create_fk,
+        table=Table('tests_a', editor.quote_name),
+        name='"tests_a_fk"',
+        column='"b_id"',
+        to_table=Table('tests_b', editor.quote_name),
+        to_column='"id"',
+        deferrable='',
+    )) == {
+        'tests_a': 'ACCESS EXCLUSIVE',
+        'tests_b': 'SHARE ROW EXCLUSIVE',
+    }
+    assert editor._get_deferred_sql_locks('SELECT 1') is None
+    assert editor._get_deferred_sql_locks(Statement('SELECT 1 FROM %(table)s', table=Table('tests_a', None))) is None
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS=2)
+def test_deferred_sql_workers__schedule__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'execute')
+    mocker.patch.object(cursor, 'fetchone', return_value=None)
+    events = []
+
+    def execute_in_side_connection(editors, index, sql):
+        name = sql.parts['name']
+        events.append(('start', name))
+        if name == '"tests_a_field1_idx"':
+            time.sleep(0.2)
+        events.append(('end', name))
+
+    mocker.patch.object(DatabaseSchemaEditor, '_execute_in_side_connection', side_effect=execute_in_side_connection)
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.deferred_sql.extend([
+            create_index_statement(editor, 'tests_a', 'field1'),
+            create_index_statement(editor, 'tests_a', 'field2'),
+            create_index_statement(editor, 'tests_b', 'field1'),
+            create_index_statement(editor, 'tests_b', 'field2'),
+            'SELECT 1',
+            create_index_statement(editor, 'tests_c', 'field1'),
+        ])
+    # tests_b statements don't wait slow tests_a statement, but statements for same table run one by one
+    assert events == [
+        ('start', '"tests_a_field1_idx"'),
+        ('start', '"tests_b_field1_idx"'),
+        ('end', '"tests_b_field1_idx"'),
+        ('start', '"tests_b_field2_idx"'),
+        ('end', '"tests_b_field2_idx"'),
+        ('end', '"tests_a_field1_idx"'),
+        ('start', '"tests_a_field2_idx"'),
+        ('end', '"tests_a_field2_idx"'),
+    ]
+    assert executed_sql(cursor) == [
+        'SELECT 1',
+        DatabaseSchemaEditor._sql_is_partitioned_table,
+        'CREATE INDEX CONCURRENTLY "tests_c_field1_idx" ON "tests_c" ("field1")',
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS=2)
+def test_deferred_sql_workers__statement_failed__raise(cursor, mocker):
+    mocker.patch.object(cursor, 'execute')
+    executed = []
+
+    def execute_in_side_connection(editors, index, sql):
+        if sql.parts['table'].table == 'tests_b':
+            raise OperationalError('index build failed')
+        time.sleep(0.1)
+        executed.append(sql.parts['name'])
+
+    mocker.patch.object(DatabaseSchemaEditor, '_execute_in_side_connection', side_effect=execute_in_side_connection)
+    with pytest.raises(OperationalError, match='index build failed'):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            editor.deferred_sql.extend([
+                create_index_statement(editor, 'tests_a', 'field1'),
+                create_index_statement(editor, 'tests_b', 'field1'),
+                create_index_statement(editor, 'tests_a', 'field2'),
+                'SELECT 1',
+            ])
+    # running statement completed, but next statements are not started
+    assert executed == ['"tests_a_field1_idx"']
+    assert executed_sql(cursor) == []
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS=2)
+def test_deferred_sql_workers__side_connections__ok():
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE "tests_a" ("field1" integer, "field2" integer)')
+        cursor.execute('CREATE TABLE "tests_b" ("field1" integer)')
+    try:
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            editor.deferred_sql.extend([
+                create_index_statement(editor, 'tests_a', 'field1'),
+                create_index_statement(editor, 'tests_b', 'field1'),
+                create_index_statement(editor, 'tests_a', 'field2'),
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexrelid::regclass::text FROM pg_index "
+                "WHERE indrelid IN ('tests_a'::regclass, 'tests_b'::regclass) AND indisvalid "
+                "ORDER BY 1"
+            )
+            assert cursor.fetchall() == [('tests_a_field1_idx',), ('tests_a_field2_idx',), ('tests_b_field1_idx',)]
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE "tests_a", "tests_b"')
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_TIMEOUT=5)
+def test_lock_blockers__wait__ok(cursor, mocker):
+    sleep = mocker.patch('django_zero_downtime_migrations.backends.postgres.schema.time.sleep')
+    mocker.patch.object(cursor, 'fetchone').return_value = ('1s', '1s')
+    mocker.patch.object(cursor, 'fetchall').side_effect = [
+        [(42, 'idle in transaction', 10.0, None)],
+        [],
+    ]
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(Statement(editor.sql_delete_check, table=Table('tests_model', editor.quote_name), name='"c"'))
+    assert sleep.call_count == 1
+    assert executed_sql(cursor) == [
+        "SELECT current_setting('statement_timeout'), current_setting('lock_timeout')",
+        "SET statement_timeout TO '0'",
+        "SET lock_timeout TO '0'",
+        editor._sql_get_lock_blockers,
+        editor._sql_get_lock_blockers,
+        'ALTER TABLE "tests_model" DROP CONSTRAINT "c"',
+        "SET statement_timeout TO '1s'",
+        "SET lock_timeout TO '1s'",
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_TIMEOUT=0,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRIES=1)
+def test_lock_blockers__timeout__retry_and_raise(cursor, mocker):
+    sleep = mocker.patch('django_zero_downtime_migrations.backends.postgres.schema.time.sleep')
+    mocker.patch.object(cursor, 'fetchone').return_value = ('0ms', '0ms')
+    mocker.patch.object(cursor, 'fetchall').return_value = [(42, 'idle in transaction', 10.0, None)]
+    mocker.patch.object(cursor, 'execute')
+    with pytest.raises(LockBlockedException, match='pid 42'):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            editor.execute(
+                Statement(editor.sql_delete_check, table=Table('tests_model', editor.quote_name), name='"c"')
+            )
+    assert sleep.call_count == 1
+    assert 'ALTER TABLE "tests_model" DROP CONSTRAINT "c"' not in executed_sql(cursor)
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_TIMEOUT=0,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_MIN_AGE=0)
+def test_lock_blockers__detect_transaction__ok():
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE "tests_blocked" ("id" integer)')
+    blocker = connection.copy()
+    try:
+        editor = DatabaseSchemaEditor(connection=connection)
+        statement = Statement(editor.sql_delete_check, table=Table('tests_blocked', editor.quote_name), name='"c"')
+        editor._wait_lock_blockers(statement)
+
+        blocker.set_autocommit(False)
+        with blocker.cursor() as cursor:
+            cursor.execute('SELECT * FROM "tests_blocked"')
+        with pytest.raises(LockBlockedException, match='idle in transaction'):
+            editor._wait_lock_blockers(statement)
+        with pytest.raises(LockBlockedException, match='idle in transaction'):
+            editor._wait_lock_blockers(statement, 'ACCESS EXCLUSIVE')
+        # ACCESS SHARE lock doesn't conflict with SHARE UPDATE EXCLUSIVE and SHARE locks
+        editor._wait_lock_blockers(statement, 'SHARE UPDATE EXCLUSIVE')
+        editor._wait_lock_blockers(statement, 'SHARE')
+
+        with blocker.cursor() as cursor:
+            cursor.execute('INSERT INTO "tests_blocked" VALUES (1)')
+        editor._wait_lock_blockers(statement, 'SHARE UPDATE EXCLUSIVE')
+        with pytest.raises(LockBlockedException, match='idle in transaction'):
+            editor._wait_lock_blockers(statement, 'SHARE')
+
+        blocker.rollback()
+        editor._wait_lock_blockers(statement)
+    finally:
+        blocker.close()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE "tests_blocked"')
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_TIMEOUT=0,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_MIN_AGE=0)
+def test_lock_blockers__add_field__raise(blocked_table):
+    with blocked_table.cursor() as cursor:
+        cursor.execute('SELECT * FROM "tests_blocked"')
+    field = models.IntegerField(null=True)
+    field.set_attributes_from_name('field')
+    with pytest.raises(LockBlockedException, match='"tests_blocked" locked by long transactions'):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            editor.add_field(BlockedModel, field)
+    blocked_table.rollback()
+    with connection.cursor() as cursor:
+        cursor.execute(editor._sql_column_exists % {'table': '"tests_blocked"', 'column': '"field"'})
+        assert cursor.fetchone() is None
+
+
+@pytest.fixture
+def blocked_table():
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE "tests_blocked" ("id" integer)')
+    blocker = connection.copy()
+    with blocker.cursor() as cursor:
+        cursor.execute("SET application_name = 'blocker'")
+    blocker.set_autocommit(False)
+    try:
+        yield blocker
+    finally:
+        blocker.close()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE "tests_blocked"')
+
+
+def add_blocked_column_statement(editor):
+    return Statement(
+        editor.sql_create_column,
+        table=Table('tests_blocked', editor.quote_name),
+        column='"field"',
+        definition='integer NULL',
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER=0,
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES=['blocker'],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.1)
+def test_cancel_blockers__terminate_idle_in_transaction__ok(blocked_table, caplog):
+    with blocked_table.cursor() as cursor:
+        cursor.execute('SELECT * FROM "tests_blocked"')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(add_blocked_column_statement(editor))
+    assert 'terminate backend pid' in caplog.text
+    with connection.cursor() as cursor:
+        cursor.execute(editor._sql_column_exists % {'table': '"tests_blocked"', 'column': '"field"'})
+        assert cursor.fetchone() == (1,)
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER=0,
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES=['worker'],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.1,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_TIMEOUT='1s')
+def test_cancel_blockers__not_allowed__raise(blocked_table, caplog):
+    with blocked_table.cursor() as cursor:
+        cursor.execute('SELECT * FROM "tests_blocked"')
+    with pytest.raises(OperationalError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            editor.execute(add_blocked_column_statement(editor))
+    assert 'backend pid' not in caplog.text
+    blocked_table.rollback()
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER=0,
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_ROLES=['other'],
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES=['blocker'],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.1,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_TIMEOUT='1s')
+def test_cancel_blockers__role_not_allowed__raise(blocked_table, caplog):
+    with blocked_table.cursor() as cursor:
+        cursor.execute('SELECT * FROM "tests_blocked"')
+    with pytest.raises(OperationalError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            editor.execute(add_blocked_column_statement(editor))
+    assert 'backend pid' not in caplog.text
+    blocked_table.rollback()
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER=0,
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES=['blocker'],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.1,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_TIMEOUT='1s')
+def test_cancel_blockers__side_connection__raise(blocked_table, caplog):
+    with blocked_table.cursor() as cursor:
+        cursor.execute('SELECT pg_backend_pid()')
+        blocker_pid = cursor.fetchone()[0]
+        cursor.execute('SELECT * FROM "tests_blocked"')
+    with pytest.raises(OperationalError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            editor._side_backend_pids[blocked_table] = blocker_pid
+            editor.execute(add_blocked_column_statement(editor))
+    assert 'backend pid' not in caplog.text
+    blocked_table.rollback()
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER=0,
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES=['blocker'],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.5)
+def test_cancel_blockers__monitor_reused__ok(blocked_table, mocker):
+    copy_connection = mocker.spy(DatabaseSchemaEditor, '_copy_connection')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(add_blocked_column_statement(editor))
+        monitor = editor._blockers_monitor
+        editor.execute(Statement(
+            editor.sql_delete_column, table=Table('tests_blocked', editor.quote_name), column='"field"',
+        ))
+        assert editor._blockers_monitor is monitor
+    assert editor._blockers_monitor is None
+    assert not monitor.is_alive()
+    # statements finished before first poll, so side connection isn't opened
+    assert copy_connection.call_count == 0
+    assert editor._side_backend_pids == {}
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER=10)
+def test_cancel_blockers__without_allow_lists__raise():
+    with pytest.raises(ImproperlyConfigured, match='CANCEL_BLOCKERS_ROLES'):
+        DatabaseSchemaEditor(connection=connection)
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER=0,
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES=['blocker'],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.1)
+def test_cancel_blockers__concurrent_index_old_snapshot__ok(blocked_table, caplog):
+    with blocked_table.cursor() as cursor:
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        cursor.execute('SELECT 1')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_index_statement(editor, 'tests_blocked', 'id'))
+    assert 'terminate backend pid' in caplog.text
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_ESTIMATE=True,
+                   ZERO_DOWNTIME_MIGRATIONS_SAFE_TYPE_CAST_RULES=STATIC_SAFE_TYPE_CAST_RULES)
+def test_estimate__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone', return_value=(100 * 1024 * 1024, 300 * 1024 * 1024))
+    with pytest.warns(UnsafeOperationWarning, match='ALTER COLUMN TYPE is unsafe operation'):
+        with schema_editor() as editor:
+            old_field = models.IntegerField()
+            old_field.set_attributes_from_name('field')
+            new_field = models.BigIntegerField(db_index=True)
+            new_field.set_attributes_from_name('field')
+            editor.alter_field(Model, old_field, new_field)
+            field = models.IntegerField(null=True)
+            field.set_attributes_from_name('field2')
+            editor.add_field(Model, field)
+    assert editor.collected_sql == [
+        '-- [ACCESS EXCLUSIVE] "tests_model": rewrite 300.0MB, estimated 6.0s',
+    ] + timeouts(
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" TYPE bigint USING "field"::bigint;',
+    ) + [
+        '-- [SHARE UPDATE EXCLUSIVE] "tests_model": scan 100.0MB, estimated 1.0s',
+        'CREATE INDEX CONCURRENTLY "tests_model_field_0a53d95f" ON "tests_model" ("field");',
+        '-- [ACCESS EXCLUSIVE] "tests_model": metadata only',
+    ] + timeouts(
+        'ALTER TABLE "tests_model" ADD COLUMN "field2" integer NULL;',
+    ) + [
+        '-- estimated total 7.0s, with ACCESS EXCLUSIVE lock 6.0s',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_ESTIMATE=True)
+def test_estimate__table_not_exists__ok():
+    with schema_editor() as editor:
+        editor.execute(editor._create_index_sql(Model, fields=[Model._meta.get_field('field1')]))
+        editor.execute('UPDATE "tests_model" SET "field1" = 1')
+    assert editor.collected_sql == [
+        '-- [SHARE UPDATE EXCLUSIVE] "tests_model": scan, size unknown',
+        'CREATE INDEX CONCURRENTLY "tests_model_field1_60971c63" ON "tests_model" ("field1");',
+        '-- [UNKNOWN LOCK] "tests_model": scan, size unknown',
+        'UPDATE "tests_model" SET "field1" = 1;',
+        '-- estimated total 0.0s, with ACCESS EXCLUSIVE lock 0.0s',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_ESTIMATE=True)
+def test_estimate__metadata_only__ok():
+    with schema_editor() as editor:
+        old_field = models.CharField(max_length=40)
+        old_field.set_attributes_from_name('field')
+        new_field = models.CharField(max_length=80, db_comment='comment')
+        new_field.set_attributes_from_name('field')
+        editor.alter_field(Model, old_field, new_field)
+        editor.execute('COMMENT ON TABLE "tests_model" IS \'comment\'')
+    assert editor.collected_sql == [
+        '-- [ACCESS EXCLUSIVE] "tests_model": metadata only',
+    ] + timeouts(
+        'ALTER TABLE "tests_model" ALTER COLUMN "field" TYPE varchar(80);',
+    ) + [
+        '-- [SHARE UPDATE EXCLUSIVE] "tests_model": metadata only',
+        'COMMENT ON COLUMN "tests_model"."field" IS \'comment\';',
+        '-- [UNKNOWN LOCK] "tests_model": metadata only',
+        'COMMENT ON TABLE "tests_model" IS \'comment\';',
+        '-- estimated total 0.0s, with ACCESS EXCLUSIVE lock 0.0s',
+    ]
+    assert editor._get_statement_tables('COMMENT ON COLUMN "tests_model"."field" IS NULL') == ['tests_model']
+    assert editor._get_statement_tables('COMMENT ON TABLE tests_model IS NULL') == ['tests_model']
+
+
+EVENTS = []
+
+
+@pytest.fixture
+def events():
+    EVENTS.clear()
+    yield EVENTS
+    EVENTS.clear()
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS=[EVENTS.append],
+                   ZERO_DOWNTIME_MIGRATIONS_IDEMPOTENT_SQL=True,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_TIMEOUT='1s')
+def test_events__ok(blocked_table, events):
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(add_blocked_column_statement(editor))
+        editor.execute(add_blocked_column_statement(editor))
+        editor.execute('SELECT 1 FROM "tests_blocked"')
+    assert [
+        (event['sql'], event['lock'], event['lock_mode'], event['tables'], event['skipped'], event['error'])
+        for event in events
+    ] == [
+        ('ALTER TABLE "tests_blocked" ADD COLUMN "field" integer NULL', 'PGAccessExclusive', 'ACCESS EXCLUSIVE',
+         ['tests_blocked'], False, None),
+        ('ALTER TABLE "tests_blocked" ADD COLUMN "field" integer NULL', 'PGAccessExclusive', 'ACCESS EXCLUSIVE',
+         ['tests_blocked'], True, None),
+        ('SELECT 1 FROM "tests_blocked"', None, None, [], False, None),
+    ]
+    assert (events[0]['statement_timeout'], events[0]['lock_timeout']) == (0, '1s')
+    assert (events[2]['statement_timeout'], events[2]['lock_timeout']) == (None, None)
+    assert events[0]['duration'] == events[0]['lock_wait'] + events[0]['execution']
+    assert events[1]['duration'] == 0
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS=[EVENTS.append],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.1,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRIES=1,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_RETRY_DELAY=0,
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_TIMEOUT='1s')
+def test_events__lock_wait__ok(blocked_table, events):
+    with blocked_table.cursor() as cursor:
+        cursor.execute('SELECT * FROM "tests_blocked"')
+    with pytest.raises(OperationalError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            editor.execute(add_blocked_column_statement(editor))
+    blocked_table.rollback()
+    assert len(events) == 1
+    assert events[0]['retries'] == 1
+    assert events[0]['lock_timeouts'] == 2
+    assert events[0]['error'].startswith('OperationalError: ')
+    assert events[0]['lock_wait'] > 1
+    assert events[0]['execution'] < 1
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS=[EVENTS.append])
+def test_events__sqlmigrate__ok(events):
+    with schema_editor() as editor:
+        editor.execute(add_blocked_column_statement(editor))
+    assert events == []
+
+
+@pytest.mark.django_db
+def test_events__json_lines_sink__ok(tmp_path):
+    path = tmp_path / 'events.jsonl'
+    sink = JSONLinesSink(path)
+    sink({'sql': 'SELECT 1', 'timestamp': 1})
+    sink({'sql': 'SELECT 2', 'timestamp': 2})
+    assert path.read_text() == '{"sql": "SELECT 1", "timestamp": 1}\n{"sql": "SELECT 2", "timestamp": 2}\n'
+
+
+@pytest.mark.django_db
+def test_events__load_sink__ok():
+    assert isinstance(load_sink('django_zero_downtime_migrations.events.LoggingSink'), LoggingSink)
+    assert load_sink('django_zero_downtime_migrations.events.load_sink') is load_sink
+    assert load_sink(EVENTS.append) == EVENTS.append
+    sink = load_sink(('django_zero_downtime_migrations.events.JSONLinesSink', {'path': '/tmp/events.jsonl'}))
+    assert isinstance(sink, JSONLinesSink)
+    assert sink.path == '/tmp/events.jsonl'
+    assert load_sink(('django_zero_downtime_migrations.events.JSONLinesSink', {'path': '/tmp/events.jsonl'})) is sink
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS=[EVENTS.append],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.01)
+def test_events__lock_wait_sampler_reused__ok(events, mocker):
+    copy_connection = mocker.spy(DatabaseSchemaEditor, '_copy_connection')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute('SELECT pg_sleep(0.05)')
+        sampler = editor._lock_wait_sampler
+        editor.execute('SELECT pg_sleep(0.05)')
+        assert editor._lock_wait_sampler is sampler
+    assert editor._lock_wait_sampler is None
+    assert not sampler.is_alive()
+    assert copy_connection.call_count == 1
+    assert len(events) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS=[EVENTS.append],
+                   ZERO_DOWNTIME_MIGRATIONS_INDEX_PROGRESS_INTERVAL=0.05,
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_AFTER=0.5,
+                   ZERO_DOWNTIME_MIGRATIONS_CANCEL_BLOCKERS_APPLICATION_NAMES=['blocker'],
+                   ZERO_DOWNTIME_MIGRATIONS_LOCK_BLOCKERS_POLL_INTERVAL=0.1)
+def test_index_progress__ok(blocked_table, events, caplog):
+    caplog.set_level('INFO')
+    with blocked_table.cursor() as cursor:
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        cursor.execute('SELECT 1')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_index_statement(editor, 'tests_blocked', 'id'))
+    progress = [event for event in events if event['event'] == 'index_progress']
+    assert progress
+    assert {
+        (event['index'], event['table'], event['sql']) for event in progress
+    } == {
+        ('tests_blocked_id_idx', 'tests_blocked',
+         'CREATE INDEX CONCURRENTLY "tests_blocked_id_idx" ON "tests_blocked" ("id")'),
+    }
+    assert 'waiting for old snapshots' in {event['phase'] for event in progress}
+    assert 'index tests_blocked_id_idx on tests_blocked: waiting for old snapshots' in caplog.text
+    assert [event['event'] for event in events][-1] == 'statement'
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_INDEX_PROGRESS_INTERVAL=0.05)
+def test_index_progress__sqlmigrate__ok(mocker):
+    monitor = mocker.patch.object(DatabaseSchemaEditor, '_monitor_index_progress')
+    with schema_editor() as editor:
+        editor.execute(create_index_statement(editor, 'tests_blocked', 'id'))
+    monitor.assert_not_called()
+
+
+def journal_migration(*sqls):
+    migration = Migration('0001_initial', 'tests')
+    migration.operations = [RunSQL(sql) for sql in sqls]
+    return migration
+
+
+@pytest.fixture
+def journal_table():
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS "tests_journal"')
+        cursor.execute('DROP TABLE IF EXISTS "zero_downtime_migrations_journal"')
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True,
+                   ZERO_DOWNTIME_MIGRATIONS_EVENT_SINKS=[EVENTS.append])
+def test_journal__rerun__ok(journal_table, events, caplog):
+    caplog.set_level('INFO')
+    create_table = 'CREATE TABLE "tests_journal" ("id" integer)'
+    add_column = 'ALTER TABLE "tests_journal" ADD COLUMN "field" integer'
+    with pytest.raises(DatabaseError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            journal_migration(create_table, add_column, 'SELECT 1/0', add_column).apply(
+                ProjectState(), editor,
+            )
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT migration, outcome, sql FROM "zero_downtime_migrations_journal" ORDER BY applied_at')
+        assert cursor.fetchall() == [
+            ('tests.0001_initial.apply', 'applied', create_table),
+            ('tests.0001_initial.apply', 'applied', add_column),
+        ]
+    events.clear()
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        journal_migration(create_table, add_column, 'SELECT 1', 'SELECT 2').apply(ProjectState(), editor)
+    assert [(event['sql'], event['skipped']) for event in events] == [
+        (create_table, True),
+        (add_column, True),
+        ('SELECT 1', False),
+        ('SELECT 2', False),
+    ]
+    assert 'skip statement applied by previous run of tests.0001_initial.apply' in caplog.text
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM "zero_downtime_migrations_journal"')
+        assert cursor.fetchone() == (0,)
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_journal__same_statements__ok(journal_table):
+    add_column = 'ALTER TABLE "tests_journal" ADD COLUMN "field" integer'
+    drop_column = 'ALTER TABLE "tests_journal" DROP COLUMN "field"'
+    with pytest.raises(DatabaseError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            journal_migration(
+                'CREATE TABLE "tests_journal" ("id" integer)', add_column, drop_column, add_column, 'SELECT 1/0',
+            ).apply(ProjectState(), editor)
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        journal_migration(
+            'CREATE TABLE "tests_journal" ("id" integer)', add_column, drop_column, add_column, 'SELECT 1',
+        ).apply(ProjectState(), editor)
+    with connection.cursor() as cursor:
+        cursor.execute(editor._sql_column_exists % {'table': '"tests_journal"', 'column': '"field"'})
+        assert cursor.fetchone() == (1,)
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_journal__sqlmigrate__ok():
+    with schema_editor() as editor:
+        journal_migration('SELECT 1').apply(ProjectState(), editor)
+    assert editor._journal_migration is None
+
+
+def get_journal():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT migration, outcome, sql FROM "zero_downtime_migrations_journal" ORDER BY applied_at')
+        return cursor.fetchall()
+
+
+def journal_add_column(deferred_sql=None):
+    def add_column(apps, editor):
+        editor.execute(add_journal_column_statement(editor))
+        if deferred_sql is not None:
+            editor.deferred_sql.append(deferred_sql)
+    return RunPython(add_column)
+
+
+def add_journal_column_statement(editor):
+    return Statement(
+        editor.sql_create_column,
+        table=Table('tests_journal', editor.quote_name),
+        column='"field"',
+        definition='integer NULL',
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_journal__record_sent_with_statement__ok(journal_table, cursor, mocker):
+    mocker.spy(cursor, 'execute')
+    migration = journal_migration('CREATE TABLE "tests_journal" ("id" integer)', 'SELECT 1/0')
+    migration.operations.insert(1, journal_add_column())
+    with pytest.raises(DatabaseError):
+        with DatabaseSchemaEditor(connection=connection) as editor:
+            migration.apply(ProjectState(), editor)
+    add_column = 'ALTER TABLE "tests_journal" ADD COLUMN "field" integer NULL'
+    journal_queries = [sql for sql in executed_sql(cursor) if 'INSERT INTO zero_downtime_migrations_journal' in sql]
+    assert len(journal_queries) == 2
+    assert journal_queries[0] == editor._sql_journal_statement
+    assert journal_queries[1].startswith(f'{add_column};\nINSERT INTO zero_downtime_migrations_journal')
+    assert get_journal() == [
+        ('tests.0001_initial.apply', 'applied', 'CREATE TABLE "tests_journal" ("id" integer)'),
+        ('tests.0001_initial.apply', 'applied', add_column),
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_journal__deferred_sql__cleared_after_migrate__ok(journal_table):
+    migration = journal_migration('CREATE TABLE "tests_journal" ("id" integer)')
+    migration.operations.append(journal_add_column(deferred_sql='SELECT 1'))
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        migration.apply(ProjectState(), editor)
+    # migration executor records migration with deferred sql after schema editor exit
+    assert len(get_journal()) == 3
+    clear_migrations_journal(sender=None, using='default', plan=[(migration, False)])
+    assert get_journal() == []
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_journal__unapply__cleared_after_migrate__ok(journal_table):
+    migration = journal_migration('CREATE TABLE "tests_journal" ("id" integer)')
+    migration.operations = [RunSQL(RunSQL.noop, 'CREATE TABLE "tests_journal" ("id" integer)')]
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        migration.unapply(ProjectState(), editor)
+    # migration executor records unapplied migration after schema editor exit
+    assert get_journal() == [('tests.0001_initial.unapply', 'applied', 'CREATE TABLE "tests_journal" ("id" integer)')]
+    clear_migrations_journal(sender=None, using='default', plan=[(migration, False)])
+    assert len(get_journal()) == 1
+    clear_migrations_journal(sender=None, using='default', plan=[(migration, True)])
+    assert get_journal() == []
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_journal__unapply_after_failed_migrate__reapply__ok(journal_table):
+    create_table = 'CREATE TABLE "tests_journal" ("id" integer)'
+    migration = journal_migration()
+    migration.operations = [
+        RunSQL(create_table, 'DROP TABLE "tests_journal"'),
+        RunPython(journal_add_column(deferred_sql='SELECT 1').code, RunPython.noop),
+    ]
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        migration.apply(ProjectState(), editor)
+    # post_migrate isn't sent when next migration of migrate run failed, so journal isn't cleared
+    assert len(get_journal()) == 3
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        migration.unapply(ProjectState(), editor)
+    assert get_journal() == [('tests.0001_initial.unapply', 'applied', 'DROP TABLE "tests_journal"')]
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        migration.apply(ProjectState(), editor)
+    assert [row[0] for row in get_journal()] == ['tests.0001_initial.apply'] * 3
+    with connection.cursor() as cursor:
+        cursor.execute(editor._sql_column_exists % {'table': '"tests_journal"', 'column': '"field"'})
+        assert cursor.fetchone() == (1,)
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_journal__deferred_sql__stable_keys__ok():
+    editor = DatabaseSchemaEditor(connection=connection)
+    editor._journal_migration = 'tests.0001_initial.apply'
+    editor._journal = set()
+    editor._journal_occurrences = {}
+    editor._journal_deferred_index = 1
+    keys = list(editor._get_journal_keys(['SELECT 1'], None).values())
+    # same deferred statement has same key regardless of statements executed before by other workers
+    editor._journal_deferred_index = 0
+    assert list(editor._get_journal_keys(['SELECT 1'], None).values()) != keys
+    editor._journal_occurrences = {}
+    editor._journal_deferred_index = 1
+    assert list(editor._get_journal_keys(['SELECT 1'], None).values()) == keys
+    editor._journal_deferred_index = None
+    assert list(editor._get_journal_keys(['SELECT 1'], None).values()) != keys
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_JOURNAL=True)
+def test_journal__outside_migration__skip(journal_table):
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute('CREATE TABLE "tests_journal" ("id" integer)')
+    assert editor._journal_migration is None
+    with connection.cursor() as cursor:
+        cursor.execute(editor._sql_journal_exists)
+        assert cursor.fetchone() == (False,)
+
+
+def get_blocked_table_indexes():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'tests_blocked' ORDER BY indexname")
+        return [row[0] for row in cursor.fetchall()]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_reuse_indexes__equivalent__ok(blocked_table, caplog):
+    caplog.set_level('INFO')
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX "tests_blocked_old_idx" ON "tests_blocked" USING btree ("id")')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.add_index(BlockedModel, models.Index(fields=['id'], name='tests_blocked_id_idx'))
+    assert get_blocked_table_indexes() == ['tests_blocked_id_idx']
+    assert 'reuse equivalent index tests_blocked_old_idx on "tests_blocked" instead of building' in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_reuse_indexes__tracked_by_migration_state__ok(blocked_table):
+    state = ProjectState()
+    state.add_model(ModelState('tests', 'BlockedModel', [
+        ('id', models.AutoField(primary_key=True)),
+    ], options={'db_table': 'tests_blocked', 'indexes': [
+        models.Index(fields=['id'], name='tests_blocked_old_idx'),
+        models.Index(fields=['id'], name='tests_blocked_id_idx'),
+    ]}))
+    model = state.apps.get_model('tests', 'BlockedModel')
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX "tests_blocked_old_idx" ON "tests_blocked" USING btree ("id")')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.add_index(model, models.Index(fields=['id'], name='tests_blocked_id_idx'))
+    # index built without model isn't reused, as it's unknown which indexes are tracked
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_index_statement(editor, 'tests_blocked', 'id', name='tests_blocked_other_idx'))
+    assert get_blocked_table_indexes() == ['tests_blocked_id_idx', 'tests_blocked_old_idx', 'tests_blocked_other_idx']
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_reuse_indexes__not_equivalent__ok(blocked_table):
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX "tests_blocked_desc_idx" ON "tests_blocked" ("id" DESC)')
+        cursor.execute('CREATE UNIQUE INDEX "tests_blocked_unique_idx" ON "tests_blocked" ("id")')
+        cursor.execute('CREATE INDEX "tests_blocked_partial_idx" ON "tests_blocked" ("id") WHERE "id" > 0')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_index_statement(editor, 'tests_blocked', 'id'))
+    assert get_blocked_table_indexes() == [
+        'tests_blocked_desc_idx', 'tests_blocked_id_idx', 'tests_blocked_partial_idx', 'tests_blocked_unique_idx',
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_reuse_indexes__redundant_prefix__warning(blocked_table):
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE "tests_blocked" ADD COLUMN "field" integer')
+        cursor.execute('CREATE INDEX "tests_blocked_id_field_idx" ON "tests_blocked" ("id", "field")')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        with pytest.warns(RedundantIndexWarning, match='index "tests_blocked_id_idx" on "tests_blocked" is redundant, '
+                                                       'it\'s prefix of existing index tests_blocked_id_field_idx'):
+            editor.execute(create_index_statement(editor, 'tests_blocked', 'id'))
+    assert get_blocked_table_indexes() == ['tests_blocked_id_field_idx', 'tests_blocked_id_idx']
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_reuse_indexes__redundant_prefix_of_constraint__warning(blocked_table):
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE "tests_blocked" ADD COLUMN "field" integer')
+        cursor.execute('ALTER TABLE "tests_blocked" ADD CONSTRAINT "tests_blocked_uniq" UNIQUE ("id", "field")')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        with pytest.warns(RedundantIndexWarning, match='index "tests_blocked_id_idx" on "tests_blocked" is redundant, '
+                                                       'it\'s prefix of existing index tests_blocked_uniq'):
+            editor.execute(create_index_statement(editor, 'tests_blocked', 'id'))
+    assert get_blocked_table_indexes() == ['tests_blocked_id_idx', 'tests_blocked_uniq']
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_reuse_indexes__sqlmigrate__ok():
+    with schema_editor() as editor:
+        editor.execute(create_index_statement(editor, 'tests_blocked', 'id'))
+    assert editor.collected_sql == [
+        'CREATE INDEX CONCURRENTLY "tests_blocked_id_idx" ON "tests_blocked" ("id");',
+    ]
+
+
+def get_blocked_table_constraints():
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT conname, contype, ic.relname
+            FROM pg_constraint
+            JOIN pg_class AS ic ON ic.oid = conindid
+            WHERE conrelid = 'tests_blocked'::regclass
+            ORDER BY conname
+        """)
+        return cursor.fetchall()
+
+
+def create_unique_statement(editor, template, columns, deferrable='', nulls_distinct=''):
+    return Statement(
+        template,
+        table=Table('tests_blocked', editor.quote_name),
+        name=editor.quote_name('tests_blocked_uniq'),
+        columns=', '.join(editor.quote_name(column) for column in columns),
+        deferrable=deferrable,
+        nulls_distinct=nulls_distinct,
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_attach_unique_index__unique__ok(blocked_table, caplog):
+    caplog.set_level('INFO')
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE UNIQUE INDEX "tests_blocked_old_idx" ON "tests_blocked" ("id")')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_unique_statement(
+            editor, editor.sql_create_unique, ['id'], deferrable=' DEFERRABLE INITIALLY DEFERRED',
+        ))
+    assert get_blocked_table_constraints() == [('tests_blocked_uniq', 'u', 'tests_blocked_uniq')]
+    assert get_blocked_table_indexes() == ['tests_blocked_uniq']
+    assert 'attach existing unique index tests_blocked_old_idx on "tests_blocked" ' \
+           'to constraint "tests_blocked_uniq"' in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_attach_unique_index__primary_key__ok(blocked_table):
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE UNIQUE INDEX "tests_blocked_old_idx" ON "tests_blocked" ("id")')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_unique_statement(editor, editor.sql_create_pk, ['id']))
+    assert get_blocked_table_constraints() == [('tests_blocked_uniq', 'p', 'tests_blocked_uniq')]
+    assert get_blocked_table_indexes() == ['tests_blocked_uniq']
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_attach_unique_index__not_matching__ok(blocked_table):
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE "tests_blocked" ADD COLUMN "field" integer')
+        cursor.execute('CREATE UNIQUE INDEX "tests_blocked_desc_idx" ON "tests_blocked" ("id" DESC)')
+        cursor.execute('CREATE UNIQUE INDEX "tests_blocked_partial_idx" ON "tests_blocked" ("id") WHERE "id" > 0')
+        cursor.execute('CREATE UNIQUE INDEX "tests_blocked_expression_idx" ON "tests_blocked" (("id" + 1))')
+        cursor.execute('CREATE UNIQUE INDEX "tests_blocked_include_idx" ON "tests_blocked" ("id") INCLUDE ("field")')
+        cursor.execute('CREATE UNIQUE INDEX "tests_blocked_order_idx" ON "tests_blocked" ("field", "id")')
+        cursor.execute('CREATE INDEX "tests_blocked_not_unique_idx" ON "tests_blocked" ("id", "field")')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_unique_statement(editor, editor.sql_create_unique, ['id', 'field']))
+    assert get_blocked_table_constraints() == [('tests_blocked_uniq', 'u', 'tests_blocked_uniq')]
+    assert get_blocked_table_indexes() == [
+        'tests_blocked_desc_idx', 'tests_blocked_expression_idx', 'tests_blocked_include_idx',
+        'tests_blocked_not_unique_idx', 'tests_blocked_order_idx', 'tests_blocked_partial_idx',
+        'tests_blocked_uniq',
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_REUSE_INDEXES=True)
+def test_attach_unique_index__sqlmigrate__ok():
+    with schema_editor() as editor:
+        editor.execute(create_unique_statement(editor, editor.sql_create_pk, ['id']))
+    assert editor.collected_sql == [
+        'CREATE UNIQUE INDEX CONCURRENTLY "tests_blocked_uniq" ON "tests_blocked" ("id");',
+    ] + timeouts(
+        'ALTER TABLE "tests_blocked" ADD CONSTRAINT "tests_blocked_uniq" PRIMARY KEY USING INDEX "tests_blocked_uniq";',
+    )
+
+
+@pytest.fixture
+def partitioned_table():
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE "tests_partitioned" ("id" integer, "created" date) PARTITION BY RANGE ("created")')
+        cursor.execute(
+            'CREATE TABLE "tests_partitioned_2025" PARTITION OF "tests_partitioned" '
+            'FOR VALUES FROM (\'2025-01-01\') TO (\'2026-01-01\')'
+        )
+        cursor.execute(
+            'CREATE TABLE "tests_partitioned_2026" PARTITION OF "tests_partitioned" '
+            'FOR VALUES FROM (\'2026-01-01\') TO (\'2027-01-01\') PARTITION BY LIST ("id")'
+        )
+        cursor.execute(
+            'CREATE TABLE "tests_partitioned_2026_1" PARTITION OF "tests_partitioned_2026" FOR VALUES IN (1)'
+        )
+        cursor.execute(
+            'CREATE TABLE "tests_partitioned_2026_2" PARTITION OF "tests_partitioned_2026" FOR VALUES IN (2)'
+        )
+        cursor.execute('INSERT INTO "tests_partitioned" VALUES (1, \'2025-06-01\'), (2, \'2026-06-01\')')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE "tests_partitioned"')
+
+
+def get_partitioned_table_indexes():
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT ic.relname, c.relname, i.indisvalid, COALESCE(pic.relname, '')
+            FROM pg_index AS i
+            JOIN pg_class AS ic ON ic.oid = i.indexrelid
+            JOIN pg_class AS c ON c.oid = i.indrelid
+            LEFT JOIN pg_inherits AS inh ON inh.inhrelid = i.indexrelid
+            LEFT JOIN pg_class AS pic ON pic.oid = inh.inhparent
+            WHERE c.relname LIKE 'tests\\_partitioned%%'
+            ORDER BY c.relname
+        """)
+        return cursor.fetchall()
+
+
+def partition_index_name(editor, partition, index):
+    return editor._create_index_name(partition, [index], suffix='')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partitioned_index__ok(partitioned_table):
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_index_statement(editor, 'tests_partitioned', 'created'))
+    index_2026 = partition_index_name(editor, 'tests_partitioned_2026', 'tests_partitioned_created_idx')
+    assert get_partitioned_table_indexes() == [
+        ('tests_partitioned_created_idx', 'tests_partitioned', True, ''),
+        (partition_index_name(editor, 'tests_partitioned_2025', 'tests_partitioned_created_idx'),
+         'tests_partitioned_2025', True, 'tests_partitioned_created_idx'),
+        (index_2026, 'tests_partitioned_2026', True, 'tests_partitioned_created_idx'),
+        (partition_index_name(editor, 'tests_partitioned_2026_1', index_2026),
+         'tests_partitioned_2026_1', True, index_2026),
+        (partition_index_name(editor, 'tests_partitioned_2026_2', index_2026),
+         'tests_partitioned_2026_2', True, index_2026),
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partitioned_index__resume__ok(partitioned_table, caplog):
+    caplog.set_level('INFO')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        index_2025 = partition_index_name(editor, 'tests_partitioned_2025', 'tests_partitioned_created_idx')
+        with connection.cursor() as cursor:
+            # previous run failed after parent index creation and first partition index build
+            cursor.execute('CREATE INDEX "tests_partitioned_created_idx" ON ONLY "tests_partitioned" ("created")')
+            cursor.execute(f'CREATE INDEX "{index_2025}" ON "tests_partitioned_2025" ("created")')
+        editor.execute(create_index_statement(editor, 'tests_partitioned', 'created'))
+    assert all(valid for _, _, valid, _ in get_partitioned_table_indexes())
+    assert len(get_partitioned_table_indexes()) == 5
+    assert 'build index "tests_partitioned_created_idx" on "tests_partitioned" ' \
+           'for 1 partitions and attach 2 partitions' in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS=2)
+def test_partitioned_index__parallel__ok(partitioned_table):
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(Statement(
+            editor.sql_create_unique_index,
+            table=Table('tests_partitioned', editor.quote_name),
+            name=editor.quote_name('tests_partitioned_uniq'),
+            columns='"id", "created"',
+            include='',
+            nulls_distinct='',
+            condition='',
+        ))
+    assert all(valid for _, _, valid, _ in get_partitioned_table_indexes())
+    assert len(get_partitioned_table_indexes()) == 5
+
+
+@pytest.mark.django_db
+def test_partitioned_index__sqlmigrate__ok():
+    with schema_editor() as editor:
+        editor.execute(create_index_statement(editor, 'tests_partitioned', 'created'))
+    assert editor.collected_sql == [
+        'CREATE INDEX CONCURRENTLY "tests_partitioned_created_idx" ON "tests_partitioned" ("created");',
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partitioned_table__cached__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').return_value = None
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_index_statement(editor, 'tests_model', 'field1'))
+        editor.execute(create_index_statement(editor, 'tests_model', 'field2'))
+        editor.execute(editor.sql_delete_table % {'table': '"tests_model"'})
+        editor.execute(create_index_statement(editor, 'tests_model', 'field1'))
+    assert executed_sql(cursor).count(DatabaseSchemaEditor._sql_is_partitioned_table) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partitioned_table__index_and_constraints_share_lookup__ok(cursor, mocker):
+    mocker.patch.object(cursor, 'fetchone').side_effect = [None, ('0', '0')]
+    mocker.patch.object(cursor, 'execute')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        table = Table('tests_model', editor.quote_name)
+        editor.execute(create_index_statement(editor, 'tests_model', 'field1'))
+        editor.execute(Statement(editor.sql_create_check, table=table, name='"check"', check='"field1" > 0'))
+        editor.execute(Statement(editor._sql_column_not_null, table=table, column='"field1"', name='"nn"'))
+    assert executed_sql(cursor).count(DatabaseSchemaEditor._sql_is_partitioned_table) == 1
+
+
+def get_partitioned_table_constraints(name):
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT conrelid::regclass::text, convalidated
+            FROM pg_constraint
+            WHERE conname = %s
+            ORDER BY conrelid::regclass::text
+        """, [name])
+        return cursor.fetchall()
+
+
+def create_partitioned_check_statement(editor):
+    return Statement(
+        editor.sql_create_check,
+        table=Table('tests_partitioned', editor.quote_name),
+        name=editor.quote_name('tests_partitioned_check'),
+        check='"id" > 0',
+    )
+
+
+PARTITIONED_TABLES = [
+    'tests_partitioned', 'tests_partitioned_2025', 'tests_partitioned_2026',
+    'tests_partitioned_2026_1', 'tests_partitioned_2026_2',
+]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partitioned_constraint__check__ok(partitioned_table, caplog):
+    caplog.set_level('INFO')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_partitioned_check_statement(editor))
+    assert get_partitioned_table_constraints('tests_partitioned_check') == [
+        (table, True) for table in PARTITIONED_TABLES
+    ]
+    assert 'validate constraint "tests_partitioned_check" on "tests_partitioned" for 3 of 3 partitions' in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partitioned_constraint__check__resume__ok(partitioned_table, caplog):
+    caplog.set_level('INFO')
+    with connection.cursor() as cursor:
+        # previous run failed after first partition validation
+        cursor.execute('ALTER TABLE "tests_partitioned" ADD CONSTRAINT "tests_partitioned_check" CHECK ("id" > 0) '
+                       'NOT VALID')
+        cursor.execute('ALTER TABLE "tests_partitioned_2025" VALIDATE CONSTRAINT "tests_partitioned_check"')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(create_partitioned_check_statement(editor))
+    assert get_partitioned_table_constraints('tests_partitioned_check') == [
+        (table, True) for table in PARTITIONED_TABLES
+    ]
+    assert 'validate constraint "tests_partitioned_check" on "tests_partitioned" for 2 of 3 partitions' in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(ZERO_DOWNTIME_MIGRATIONS_DEFERRED_SQL_WORKERS=2)
+def test_partitioned_constraint__not_null__parallel__ok(partitioned_table):
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(Statement(
+            editor._sql_column_not_null,
+            table=Table('tests_partitioned', editor.quote_name),
+            name=editor.quote_name('tests_partitioned_id_notnull'),
+            column=editor.quote_name('id'),
+        ))
+    assert get_partitioned_table_constraints('tests_partitioned_id_notnull') == []
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT attrelid::regclass::text, attnotnull
+            FROM pg_attribute
+            WHERE attname = 'id' AND attrelid::regclass::text LIKE 'tests\\_partitioned%%'
+            ORDER BY attrelid::regclass::text
+        """)
+        assert cursor.fetchall() == [(table, True) for table in PARTITIONED_TABLES]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partitioned_constraint__foreign_key__ok(blocked_table, partitioned_table):
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE "tests_blocked" ADD PRIMARY KEY ("id")')
+        cursor.execute('INSERT INTO "tests_blocked" VALUES (1), (2)')
+    with DatabaseSchemaEditor(connection=connection) as editor:
+        editor.execute(Statement(
+            editor.sql_create_fk,
+            table=Table('tests_partitioned', editor.quote_name),
+            name=editor.quote_name('tests_partitioned_id_fk'),
+            column=editor.quote_name('id'),
+            to_table=Table('tests_blocked', editor.quote_name),
+            to_column=editor.quote_name('id'),
+            deferrable='',
+        ))
+    assert get_partitioned_table_constraints('tests_partitioned_id_fk') == [
+        (table, True) for table in PARTITIONED_TABLES
+    ]
+
+
+@pytest.mark.django_db
+def test_partitioned_constraint__sqlmigrate__ok():
+    with schema_editor() as editor:
+        editor.execute(create_partitioned_check_statement(editor))
+    assert editor.collected_sql == timeouts(
+        'ALTER TABLE "tests_partitioned" ADD CONSTRAINT "tests_partitioned_check" CHECK ("id" > 0) NOT VALID;',
+    ) + [
+        'ALTER TABLE "tests_partitioned" VALIDATE CONSTRAINT "tests_partitioned_check";',
+    ]